@@ -1,5 +1,6 @@
 #!/bin/bash
-# This script compresses all the JSON files in the failed and processed folders that do not correspond to the current date.
+# This script compresses all the JSON files in the failed and processed folders that do not correspond to the current date
+# (see importer/monroe_archiver.py).
 # It should be run from cron after midnight.
 
 shopt -s nullglob
@@ -16,40 +17,10 @@ exec 2<&-
 exec 1>>$logPath
 exec 2>&1
 
-today=`date -I`
 echo ----------------------------------
 echo ----------------------------------
 echo ----------------------------------
 echo Autocopy running at `date -I'seconds'`
 
-function DoFolder {
-	cd ${srcPath}/${1}
-	for folder in *; do
-		if [ "${folder}" != "${today}" ]; then
-			destFile=${backupPath}/${1}-${folder}.txz
-			echo Processing $1 folder ${folder} into ${destFile}
-			tar cJf ${destFile} ${folder}/
-			if (($? != 0)); then
-				echo Error creating file ${destFile}
-				continue
-			fi;
-			xz -t -q ${destFile} 
-			if (($? != 0)); then
-				echo Error testing file ${destFile}
-				continue
-			fi;
-			rm -rf ${folder}
-			if (($? != 0)); then
-				echo Error deleting folder ${folder}
-				continue
-			fi;
-			echo File created and folder removed.
-		else
-			echo Ignorando $1 folder $folder;
-		fi;
-	done
-}
-
-DoFolder failed
-DoFolder processed
-
+# Parallel, multi-threaded compression; every archive gets an index and is verified before its folder is removed.
+python -u $(dirname $(readlink -f $0))/importer/monroe_archiver.py --src ${srcPath} --dest ${backupPath} failed processed
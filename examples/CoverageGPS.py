@@ -7,7 +7,7 @@
   Creator: Miguel Peon Quiros, IMDEA Networks Institute
   mikepeon@imdea.org
 
- Dependencies: sudo pip install cassandra-driver python-dateutil
+ Dependencies: sudo pip install cassandra-driver python-dateutil numpy
 
  Cassandra driver (Python) documentation: https://datastax.github.io/python-driver/index.html
 """
@@ -20,112 +20,86 @@ from calendar import timegm
 from dateutil.relativedelta import relativedelta
 from decimal import *
 import argparse
+import numpy
+from itertools import chain
+from PartitionCache import PartitionCache, DayQueries
+from KMLWriter import Placemark, WriteKML, SimplifyPlacemarks, DescribeCode, ModeIconStyle, DEVICE_MODE, DEVICE_SUBMODE, DEVICE_STATE, MODE_ICONS
 
 def DumpKML(nodeID, startTime, endTime, entries):
 	fileName = "{}_{}_{}.kml".format(nodeID, startTime, endTime)
-	with open(fileName, "wt") as output:
-                # Write KML file headers.
-                output.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?><kml xmlns=\"http://www.opengis.net/kml/2.2\">\n"
-                                "<Document>\n"
-                                "<Style id=\"IconUnknown\">\n"
-				"  <IconStyle>\n"
-				"    <scale>0.5</scale>\n"
-				"    <Icon>\n"
-				"      <href>Mark_Unknown.png</href>\n"
-				"    </Icon>\n"
-				"  </IconStyle>\n"
-				"</Style>\n"
-                                "<Style id=\"IconDisconnected\">\n"
-				"  <IconStyle>\n"
-				"    <scale>0.5</scale>\n"
-				"    <Icon>\n"
-				"      <href>Mark_Disconnected.png</href>\n"
-				"    </Icon>\n"
-				"  </IconStyle>\n"
-				"</Style>\n"
-                                "<Style id=\"IconNoService\">\n"
-				"  <IconStyle>\n"
-				"    <scale>0.5</scale>\n"
-				"    <Icon>\n"
-				"      <href>Mark_NoService.png</href>\n"
-				"    </Icon>\n"
-				"  </IconStyle>\n"
-				"</Style>\n"
-                                "<Style id=\"Icon2G\">\n"
-				"  <IconStyle>\n"
-				"    <scale>0.5</scale>\n"
-				"    <Icon>\n"
-				"      <href>Mark_2G.png</href>\n"
-				"    </Icon>\n"
-				"  </IconStyle>\n"
-				"</Style>\n"
-                                "<Style id=\"Icon3G\">\n"
-				"  <IconStyle>\n"
-				"    <scale>0.5</scale>\n"
-				"    <Icon>\n"
-				"      <href>Mark_3G.png</href>\n"
-				"    </Icon>\n"
-				"  </IconStyle>\n"
-				"</Style>\n"
-                                "<Style id=\"IconLTE\">\n"
-				"  <IconStyle>\n"
-				"    <scale>0.5</scale>\n"
-				"    <Icon>\n"
-				"      <href>Mark_LTE.png</href>\n"
-				"    </Icon>\n"
-				"  </IconStyle>\n"
-				"</Style>\n"
-				"<Folder>\n")
-
-		count = 0
-		for entry in entries:
-			output.write("\n<Placemark>\n"
-				"<description>{}</description>\n"
-				"<styleUrl>{}</styleUrl>\n"
-				"<Point> <coordinates>{},{},{} </coordinates> </Point>\n"
-				"</Placemark>\n".format(
-					entry['description'], entry['iconStyle'], entry['longitude'],
-					entry['latitude'], entry['altitude']))
-			count += 1
-
-                # Write KML file footers.
-		output.write("</Folder>\n</Document>\n</kml>\n")
-
+	count = WriteKML(fileName, entries, MODE_ICONS)
 	print "Dumped {} positions to {}\n".format(count, fileName)
 
 
 ###############################################################################
-# Returns a list of GPS positions as read from the query rows.
-def FetchPositions(session, startTime, endTime, nodeID):
+# GPS positions; the GPRMC ones are selected by IsGPRMC.
+GPS_QUERY = "select nmea, nmeatype, nodeid, timestamp, latitude, longitude, altitude, speed, satellitecount from monroe_meta_device_gps where nodeid='{}' and timestamp >= {} and timestamp < {} order by timestamp asc"
+MODEM_QUERY = "select nodeid,iccid,timestamp,band,devicemode,devicestate,devicesubmode,frequency,interfacename,internalinterface,lac,operator,pci,rscp,rsrp,rsrq,rssi from monroe_meta_device_modem where nodeid='{}' and iccid in ('{}') and timestamp >= {} and timestamp < {} order by timestamp asc"
+ICCIDS_QUERY = "select interfaces from devices where nodeid={}"
+# Same queries on the day-bucketed tables (see db_schema.cql), one query per day; {{day}} is formatted
+#  per day after the node and ICCIDs.
+GPS_DAILY_QUERY = "select nmea, nmeatype, nodeid, timestamp, latitude, longitude, altitude, speed, satellitecount from monroe_meta_device_gps_daily where nodeid='{}' and day = {{day}} and timestamp >= {} and timestamp < {} order by timestamp asc"
+MODEM_DAILY_QUERY = "select nodeid,iccid,timestamp,band,devicemode,devicestate,devicesubmode,frequency,interfacename,internalinterface,lac,operator,pci,rscp,rsrp,rsrq,rssi from monroe_meta_device_modem_daily where nodeid='{}' and iccid in ('{}') and day = {{day}} and timestamp >= {} and timestamp < {} order by timestamp asc"
+
+# Returns the rows of a query, one query per day with the day-bucketed tables.
+def ExecuteQuery(session, query, startTime, endTime, bucketed):
+	if not bucketed:
+		query = query.format(startTime, endTime)
+		print query
+		return session.execute(query, timeout = None)
+	dayRows = []
+	for dayQuery in DayQueries(query, startTime, endTime):
+		print dayQuery
+		dayRows.append(session.execute(dayQuery, timeout = None))
+	return chain(*dayRows)
+
+# True for the rows of GPRMC sentences, as classified by the importer (see importer/monroenmea.py).
+#  Rows imported before the classification have no nmeatype and are recognized by their nmea text.
+def IsGPRMC(row):
+	if row.nmeatype is not None:
+		return row.nmeatype == "GPRMC"
+	return (row.nmea is not None) and (row.nmea.find("GPRMC") != -1)
+
+# Returns a list of the GPRMC positions as read from the query rows.
+#  With a PartitionCache, the rows are read from the cache when possible. With bucketed, they are read
+#  from the day-bucketed table.
+def FetchPositions(session, startTime, endTime, nodeID, cache = None, bucketed = False):
 	print "Extracting GPS positions for node {} during interval [{}, {})".format(nodeID, startTime, endTime)
 	
 	session.default_fetch_size = 1000
+	query = (GPS_DAILY_QUERY if bucketed else GPS_QUERY).format(nodeID, "{}", "{}")
+	if cache is None:
+		rows = ExecuteQuery(session, query, startTime, endTime, bucketed)
+	else:
+		rows = cache.Rows(session, "monroe_meta_device_gps_nmeatype", nodeID, None, startTime, endTime, query)
 	gps = []
-	query = "select nmea, nodeid, timestamp, latitude, longitude, altitude, speed, satellitecount from monroe_meta_device_gps where nodeid='{}' and timestamp >= {} and timestamp < {} order by timestamp asc".format(nodeID, startTime, endTime)
-	print query
-	rows = session.execute(query, timeout = None)
-	count = 0
 	for row in rows:
 		try:
-			if row.nmea.find("GPRMC") != -1:
+			if IsGPRMC(row):
 				gps.append(row)
-				count += 1
 		except Exception as error:
 			print "Error in row:", row, error
-	print "Read {} GPS positions\n".format(count)
+	print "Read {} GPS positions\n".format(len(gps))
 	return gps
 
 
 ###############################################################################
 # Returns a list of modem statuses as read from the query rows.
-def FetchModemStatus(session, startTime, endTime, nodeID, iccids, operator):
+#  With a PartitionCache, the rows of every ICCID are read from the cache when possible. With bucketed,
+#  they are read from the day-bucketed table.
+def FetchModemStatus(session, startTime, endTime, nodeID, iccids, operator, cache = None, bucketed = False):
 	print "Extracting modem status for node {} during interval [{}, {})".format(nodeID, startTime, endTime)
 	
 	session.default_fetch_size = None
+	modemQuery = MODEM_DAILY_QUERY if bucketed else MODEM_QUERY
+	if cache is None:
+		rows = ExecuteQuery(session, modemQuery.format(nodeID, "','".join(iccids), "{}", "{}"), startTime, endTime, bucketed)
+	else:
+		rows = []
+		for iccid in iccids:
+			rows.extend(cache.Rows(session, "monroe_meta_device_modem", nodeID, iccid, startTime, endTime, modemQuery.format(nodeID, iccid, "{}", "{}")))
+		rows.sort(key = lambda row: row.timestamp)
 	modem = []
-	query = "select nodeid,iccid,timestamp,band,devicemode,devicestate,devicesubmode,frequency,interfacename,internalinterface,lac,operator,pci,rscp,rsrp,rsrq,rssi from monroe_meta_device_modem where nodeid='{}' and iccid in ('{}') and timestamp >= {} and timestamp < {} order by timestamp asc".format(nodeID, "','".join(iccids), startTime, endTime)
-	print query
-	rows = session.execute(query, timeout = None)
 	count = 0
 	for row in rows:
 		try:
@@ -140,11 +114,13 @@ def FetchModemStatus(session, startTime, endTime, nodeID, iccids, operator):
 
 ###############################################################################
 # Returns the list of iccids associated to the given nodeID
-def FetchNodeICCIDs(session, nodeID):
+def FetchNodeICCIDs(session, nodeID, cache = None):
+	if cache is not None:
+		return cache.Value("devices", nodeID, lambda: FetchNodeICCIDs(session, nodeID))
 	print "Extracting ICCIDs for node {}".format(nodeID)
 	
 	session.default_fetch_size = None
-	query = "select interfaces from devices where nodeid={}".format(nodeID)
+	query = ICCIDS_QUERY.format(nodeID)
 	print query
 	rows = session.execute(query, timeout = None)
 	try:
@@ -155,103 +131,93 @@ def FetchNodeICCIDs(session, nodeID):
 
 
 ###############################################################################
-#  Traverses a list of GPS positions and a list of modem statuses and combines
-# them based on timestamp.
-#  Returns a list of position-modem status.
-def TraverseGPSAndModem(gps, modem, minGPSInterval):
-	combinedEntries = []
-	lastModem = None
-	lastGPS = None
-	lastTimestamp = 0
-	iModem = 0
-	iGPS = 0
-	while (iModem < len(modem)) and (iGPS < len(gps)):	# TODO Change to or and check for buffer overruns.
-		filteredPos = False	# Marks whether we are skipping a GPS position or not.
-		# Update the last known GPS and modem entries.
-		if (gps[iGPS].timestamp == modem[iModem].timestamp):
-			lastGPS = gps[iGPS]
-			lastModem = modem[iModem]
-			lastTimestamp = lastGPS.timestamp
-			iGPS += 1
-			iModem += 1
-		elif (gps[iGPS].timestamp < modem[iModem].timestamp):
-			if (gps[iGPS].timestamp >= (lastTimestamp + minGPSInterval)):
-				lastGPS = gps[iGPS]
-				lastTimestamp = lastGPS.timestamp
-			else:
-				filteredPos = True
-			iGPS += 1
-		else:	# gps[iGPS].timestamp > modem[iModem].timestamp
-			lastModem = modem[iModem]
-			lastTimestamp = lastModem.timestamp
-			iModem += 1
-
-		# Create a new entry with the last known GPS and modem values
-		if (lastGPS != None) and (lastModem != None) and not filteredPos:
-			iconStyle = "#IconUnknown" if lastModem.devicemode == 0 else "#IconDisconnected" if lastModem.devicemode == 1 else "#IconNoService" if lastModem.devicemode == 2 else "#Icon2G" if lastModem.devicemode == 3 else "#Icon3G" if lastModem.devicemode == 4 else "#IconLTE" if lastModem.devicemode == 5 else "#IconUnknown"
-			try:
-				combinedEntries.append(
-					{'description': 
-						"Node: {}\nTimestamp: {}\nLatitude: {} {}\nLongitude: {} {}\nAltitude: {}\n"
-						"Speed: {} Km/h\nSatellites: {}\n"
-						"Modem mode: {}\nModem submode: {}\n"
-						"ICCID: {}\nBand: {}\nDeviceState: {}\n"
-						"Frequency: {}\nInterfaceName: {}\nInternalInterface: {}\n"
-						"LAC: {}\nOperator: {}\nPCI: {}\nRSCP: {}\nRSRP: {}\nRSSI: {}".format(
-							lastGPS.nodeid, lastGPS.timestamp,						
-                        	                	lastGPS.latitude, 'N' if lastGPS.latitude >= 0.0 else 'S',
-                                	        	lastGPS.longitude, 'E' if lastGPS.longitude >= 0.0 else 'W',
-                                        		lastGPS.altitude, 
-							lastGPS.speed * Decimal('1.852') if lastGPS.speed != None else lastGPS.speed,
-							lastGPS.satellitecount,
-							"Unknown (0)" if lastModem.devicemode == 0 
-								else "Disconnected (1)" if lastModem.devicemode == 1 
-								else "No service (2)" if lastModem.devicemode == 2 
-								else "2G (3)" if lastModem.devicemode == 3 
-								else "3G (4)" if lastModem.devicemode == 4 
-								else "LTE (5)" if lastModem.devicemode == 5 
-								else "None" if lastModem.devicemode == None 
-								else "?? ({})".format(lastModem.devicemode),
-							"Unknown (0)" if lastModem.devicesubmode == 0 
-								else "UMTS (1)" if lastModem.devicesubmode == 1 
-								else "WCDMA (2)" if lastModem.devicesubmode == 2 
-								else "EVDO (3)" if lastModem.devicesubmode == 3 
-								else "HSPA (4)" if lastModem.devicesubmode == 4 
-								else "HSPA+ (5)" if lastModem.devicesubmode == 5 
-								else "DC HSPA (6)" if lastModem.devicesubmode == 6 
-								else "DC HSPA+ (7)" if lastModem.devicesubmode == 7 
-								else "HSDPA (8)" if lastModem.devicesubmode == 8 
-								else "HSUPA (9)" if lastModem.devicesubmode == 9 
-								else "HSDPA+HSUPA (10)" if lastModem.devicesubmode == 10 
-								else "HSDPA+ (11)" if lastModem.devicesubmode == 11 
-								else "HSDPA+HSUPA (12)" if lastModem.devicesubmode == 12 
-								else "DC HSDPA+ (13)" if lastModem.devicesubmode == 13 
-								else "DC HSDPA + HSUPA (14)" if lastModem.devicesubmode == 14 
-								else "None" if lastModem.devicesubmode == None 
-								else "?? ({})".format(lastModem.devicesubmode),
-							lastModem.iccid, lastModem.band, 
-							"Unknown (0)" if lastModem.devicestate == 0 
-								else "Registered (1)" if lastModem.devicestate == 1 
-								else "Unregistered (2)" if lastModem.devicestate == 2 
-								else "Connected (3)" if lastModem.devicestate == 3 
-								else "Disconnected (4)" if lastModem.devicestate == 4 
-								else "None" if lastModem.devicestate == None 
-								else "?? ({})".format(lastModem.devicestate),
-							lastModem.frequency, 
-							lastModem.interfacename, lastModem.internalinterface, lastModem.lac,
-							lastModem.operator.encode('latin-1'), lastModem.pci, lastModem.rscp, lastModem.rsrp,
-							lastModem.rssi),
-					'iconStyle': iconStyle,
-					'longitude': lastGPS.longitude,
-					'latitude': lastGPS.latitude,
-					'altitude': lastGPS.altitude
-					} )
-			except Exception as error:
-				print "-------------------- EXCEPTION: ", error
-				print lastGPS
-				print lastModem
-				print "--------------------"
-	return combinedEntries
+FormatDescription = ("Node: {}\nTimestamp: {}\nLatitude: {} {}\nLongitude: {} {}\nAltitude: {}\n"
+	"Speed: {} Km/h\nSatellites: {}\n"
+	"Modem mode: {}\nModem submode: {}\n"
+	"ICCID: {}\nBand: {}\nDeviceState: {}\n"
+	"Frequency: {}\nInterfaceName: {}\nInternalInterface: {}\n"
+	"LAC: {}\nOperator: {}\nPCI: {}\nRSCP: {}\nRSRP: {}\nRSSI: {}").format
+
+# Returns the KML placemark of a GPS position and modem status.
+def CombineEntry(lastGPS, lastModem):
+	return Placemark(
+		FormatDescription(
+			lastGPS.nodeid, lastGPS.timestamp,
+			lastGPS.latitude, 'N' if lastGPS.latitude >= 0.0 else 'S',
+			lastGPS.longitude, 'E' if lastGPS.longitude >= 0.0 else 'W',
+			lastGPS.altitude,
+			lastGPS.speed * Decimal('1.852') if lastGPS.speed != None else lastGPS.speed,
+			lastGPS.satellitecount,
+			DescribeCode(DEVICE_MODE, lastModem.devicemode),
+			DescribeCode(DEVICE_SUBMODE, lastModem.devicesubmode),
+			lastModem.iccid, lastModem.band,
+			DescribeCode(DEVICE_STATE, lastModem.devicestate),
+			lastModem.frequency,
+			lastModem.interfacename, lastModem.internalinterface, lastModem.lac,
+			lastModem.operator.encode('latin-1'), lastModem.pci, lastModem.rscp, lastModem.rsrp,
+			lastModem.rssi),
+		ModeIconStyle(lastModem.devicemode),
+		lastGPS.longitude, lastGPS.latitude, lastGPS.altitude)
+
+
+###############################################################################
+# Returns the timestamps of a list of rows as a NumPy array.
+def Timestamps(rows):
+	return numpy.fromiter((float(row.timestamp) for row in rows), dtype = numpy.float64, count = len(rows))
+
+###############################################################################
+#  Combines a list of GPS positions and a list of modem statuses (both sorted by timestamp)
+# with an as-of join: every modem status is paired with the last GPS position at or before it,
+# and every GPS position with the last modem status at or before it. Entries start as soon as
+# both a position and a status are known and cover the whole time range of both lists.
+#  With minGPSInterval, at most one GPS position is kept in every minGPSInterval window after
+# each modem status (positions in the first window are dropped, as the status itself already
+# produces an entry). The join and the filter run on NumPy arrays; descriptions are only built
+# for the entries that survive.
+#  Yields combine(position, modem status) (by default the KML placemark), in time order.
+def TraverseGPSAndModem(gps, modem, minGPSInterval, combine = CombineEntry):
+	if (len(gps) == 0) or (len(modem) == 0):
+		return
+	gpsTs = Timestamps(gps)
+	modemTs = Timestamps(modem)
+
+	# Filter GPS positions by minGPSInterval, relative to the last modem status (or to the
+	# first position for the ones preceding any status).
+	if minGPSInterval > 0:
+		anchor = numpy.searchsorted(modemTs, gpsTs, side = 'right') - 1
+		anchorTs = numpy.where(anchor >= 0, modemTs[anchor.clip(0)], gpsTs[0] - minGPSInterval)
+		window = numpy.floor((gpsTs - anchorTs) / minGPSInterval)
+		firstInWindow = numpy.ones(len(gpsTs), dtype = bool)
+		firstInWindow[1:] = (anchor[1:] != anchor[:-1]) | (window[1:] != window[:-1])
+		keptGPS = numpy.flatnonzero((firstInWindow & (window >= 1)) | (gpsTs == anchorTs))
+	else:
+		keptGPS = numpy.arange(len(gpsTs))
+	if len(keptGPS) == 0:
+		return
+	keptTs = gpsTs[keptGPS]
+
+	# Events: every modem status, and every kept GPS position not at the time of a status
+	# (a status at the same time already takes that position). -1 marks "not known yet".
+	gpsEvents = keptGPS[~numpy.in1d(keptTs, modemTs)]
+	modemGPS = numpy.searchsorted(keptTs, modemTs, side = 'right') - 1
+	eventTs = numpy.concatenate((modemTs, gpsTs[gpsEvents]))
+	eventGPS = numpy.concatenate((numpy.where(modemGPS >= 0, keptGPS[modemGPS.clip(0)], -1), gpsEvents))
+	eventModem = numpy.concatenate((numpy.arange(len(modemTs)), numpy.searchsorted(modemTs, gpsTs[gpsEvents], side = 'right') - 1))
+	order = numpy.argsort(eventTs, kind = 'mergesort')
+	eventGPS = eventGPS[order]
+	eventModem = eventModem[order]
+	valid = (eventGPS >= 0) & (eventModem >= 0)
+
+	for (iGPS, iModem) in zip(eventGPS[valid], eventModem[valid]):
+		lastGPS = gps[iGPS]
+		lastModem = modem[iModem]
+		try:
+			yield combine(lastGPS, lastModem)
+		except Exception as error:
+			print "-------------------- EXCEPTION: ", error
+			print lastGPS
+			print lastModem
+			print "--------------------"
 
 
 ###############################################################################
@@ -263,6 +229,11 @@ def ParseCommandLine():
 	parser.add_argument('-e', '--endTime', help = 'Ending timestamp (+24 hours by default)', required = False, type = int, default = 0)
 	parser.add_argument('-o', '--operatorName', help = 'Name of the operator to filter (beware of issues when not filtering!). E.g., "voda ES"', required = False, type = str)
 	parser.add_argument('-i', '--minGPSInterval', help = 'Minimum interval between GPS positions with the same modem data', required = False, type = int, default = 0)
+	parser.add_argument('-m', '--minDistance', help = 'Minimum distance (meters) between positions with the same modem mode', required = False, type = float, default = 0)
+	parser.add_argument('-a', '--minAngle', help = 'Minimum heading change (degrees) to keep a position with the same modem mode', required = False, type = float, default = 0)
+	parser.add_argument('--cacheDir', help = 'Directory of the local partition cache (no cache by default)', required = False, type = str)
+	parser.add_argument('--cacheSize', help = 'Maximum size of the partition cache, in MB (default 1024)', required = False, type = int, default = 1024)
+	parser.add_argument('--bucketed', help = 'Read the day-bucketed (_daily) GPS and modem tables', required = False, action = 'store_true')
 
 	args = parser.parse_args()
 
@@ -277,12 +248,15 @@ def ParseCommandLine():
 	print "EndTime: {}".format(args.endTime)
 	print "OperatorName: {}".format(args.operatorName)
 	print "MinGPSInterval: {}".format(args.minGPSInterval)
+	print "MinDistance: {} MinAngle: {}".format(args.minDistance, args.minAngle)
+	print "CacheDir: {} CacheSize: {} MB".format(args.cacheDir, args.cacheSize)
+	print "Bucketed: {}".format(args.bucketed)
 
 	return args
 
 ###############################################################################
 if __name__ == '__main__':
-	print "THE ANALYSIS COVERS FROM THE MINIMUM COMMON TIMESTAMP TO THE MAXIMUM COMMON TIMESTAMP\n\n"
+	print "THE ANALYSIS COVERS FROM THE FIRST TIMESTAMP WITH BOTH GPS AND MODEM DATA TO THE END OF THE INTERVAL\n\n"
 	args = ParseCommandLine()
 
 	# Connect to the DB
@@ -293,11 +267,16 @@ if __name__ == '__main__':
 	session.default_timeout = None
 	session.default_fetch_size = 1000
 
-	iccids = FetchNodeICCIDs(session, args.nodeID)
+	cache = PartitionCache(args.cacheDir, args.cacheSize << 20) if args.cacheDir else None
+	iccids = FetchNodeICCIDs(session, args.nodeID, cache)
 	print "Node {} has ICCIDs: {}\n".format(args.nodeID, iccids)
-        gps = FetchPositions(session, args.startTime, args.endTime, args.nodeID);
-	modem = FetchModemStatus(session, args.startTime, args.endTime, args.nodeID, iccids, args.operatorName);
+        gps = FetchPositions(session, args.startTime, args.endTime, args.nodeID, cache, args.bucketed);
+	modem = FetchModemStatus(session, args.startTime, args.endTime, args.nodeID, iccids, args.operatorName, cache, args.bucketed);
+	if cache is not None:
+		print "Partition cache: {} hits, {} misses\n".format(cache.hits, cache.misses)
 	combinedEntries = TraverseGPSAndModem(gps, modem, args.minGPSInterval)
+	if (args.minDistance > 0) or (args.minAngle > 0):
+		combinedEntries = SimplifyPlacemarks(combinedEntries, args.minDistance, args.minAngle)
 	DumpKML(args.nodeID, args.startTime, args.endTime, combinedEntries)
 
 	#print "Total combined entries: {}".format(len(combinedEntries))
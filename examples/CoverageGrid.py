@@ -0,0 +1,270 @@
+#!/usr/bin/python
+
+"""
+ Example tool to build fleet-wide coverage maps: the modem status of one or more nodes, joined
+  with their GPS positions as in CoverageGPS.py, is aggregated into a latitude/longitude grid.
+  Every cell shows the dominant modem mode (colours as in CoverageGPS_legend.txt) and the
+  number of samples and RSRP statistics in its description.
+  https://www.monroe-project.eu
+
+ Output is a level-of-detail KML "super-overlay" for Google Earth: the grid is computed at
+  --levels resolutions (each one twice as fine as the previous one, the finest with cells of
+  --cellSize degrees) and cut into tiles of TILE_CELLS x TILE_CELLS cells. Every tile is a
+  separate file with a Region, and links to its four children through NetworkLinks with their
+  own Regions, so Google Earth only loads the tiles visible at the current zoom. Open doc.kml
+  in the output directory.
+
+ Example: ./CoverageGrid.py -n 206 292 228 229 -s 1504224000 -e 1506816000 -o "voda ES" -d coverage
+
+ Dependencies: sudo pip install cassandra-driver python-dateutil numpy
+
+ Cassandra driver (Python) documentation: https://datastax.github.io/python-driver/index.html
+"""
+
+from cassandra.cluster import Cluster
+from cassandra.auth import PlainTextAuthProvider
+from CoverageGPS import FetchNodeICCIDs, FetchPositions, FetchModemStatus, TraverseGPSAndModem
+from PartitionCache import PartitionCache
+from KMLWriter import KML_HEADER, DEVICE_MODE, DescribeCode
+from math import floor
+import argparse
+import os
+
+TILE_CELLS = 16	# Cells per side of a tile.
+MIN_LOD_PIXELS = 256	# Tiles are shown when their region is at least this big on screen...
+MAX_LOD_PIXELS = 1024	# ...and hidden (in favour of their children) above this size.
+
+# Polygon colours (aabbggrr) of every devicemode, as in CoverageGPS_legend.txt.
+MODE_COLORS = {0: "b0000000", 1: "b0ff0000", 2: "b02a2aa5", 3: "b00000ff", 4: "b000ffff", 5: "b000ff00"}
+UNKNOWN_MODE = 0
+
+FormatPolygonStyle = ("<Style id=\"Cell{}\">\n"
+	"  <LineStyle><width>0</width></LineStyle>\n"
+	"  <PolyStyle><color>{}</color><outline>0</outline></PolyStyle>\n"
+	"</Style>\n").format
+
+FormatRegion = ("<Region>\n"
+	"  <LatLonAltBox><north>{}</north><south>{}</south><east>{}</east><west>{}</west></LatLonAltBox>\n"
+	"  <Lod><minLodPixels>{}</minLodPixels><maxLodPixels>{}</maxLodPixels></Lod>\n"
+	"</Region>\n").format
+
+FormatNetworkLink = ("<NetworkLink>\n"
+	"<name>{}</name>\n"
+	"{}"
+	"<Link><href>{}</href><viewRefreshMode>onRegion</viewRefreshMode></Link>\n"
+	"</NetworkLink>\n").format
+
+FormatCell = ("<Placemark>\n"
+	"<description>{}</description>\n"
+	"<styleUrl>#Cell{}</styleUrl>\n"
+	"<Polygon><outerBoundaryIs><LinearRing><coordinates>{w},{s} {e},{s} {e},{n} {w},{n} {w},{s}</coordinates></LinearRing></outerBoundaryIs></Polygon>\n"
+	"</Placemark>\n").format
+
+FormatCellDescription = ("Samples: {}\nDominant mode: {} ({:.0f}%)\n"
+	"Samples per mode: {}\nRSRP samples: {}\nRSRP mean: {}\nRSRP min: {}\nRSRP max: {}").format
+
+
+###############################################################################
+#  Statistics of one grid cell: samples per devicemode and RSRP count, sum, min and max.
+class Cell(object):
+	__slots__ = ("modes", "rsrpCount", "rsrpSum", "rsrpMin", "rsrpMax")
+
+	def __init__(self):
+		self.modes = {}
+		self.rsrpCount = 0
+		self.rsrpSum = 0
+		self.rsrpMin = None
+		self.rsrpMax = None
+
+	def Add(self, devicemode, rsrp):
+		self.modes[devicemode] = self.modes.get(devicemode, 0) + 1
+		if rsrp is not None:
+			self.rsrpCount += 1
+			self.rsrpSum += rsrp
+			self.rsrpMin = rsrp if self.rsrpMin is None else min(self.rsrpMin, rsrp)
+			self.rsrpMax = rsrp if self.rsrpMax is None else max(self.rsrpMax, rsrp)
+
+	def Merge(self, other):
+		for (devicemode, samples) in other.modes.items():
+			self.modes[devicemode] = self.modes.get(devicemode, 0) + samples
+		if other.rsrpCount > 0:
+			self.rsrpCount += other.rsrpCount
+			self.rsrpSum += other.rsrpSum
+			self.rsrpMin = other.rsrpMin if self.rsrpMin is None else min(self.rsrpMin, other.rsrpMin)
+			self.rsrpMax = other.rsrpMax if self.rsrpMax is None else max(self.rsrpMax, other.rsrpMax)
+
+	def Samples(self):
+		return sum(self.modes.values())
+
+	def DominantMode(self):
+		return max(self.modes.items(), key = lambda item: (item[1], item[0]))[0]
+
+	def Description(self):
+		samples = self.Samples()
+		dominant = self.DominantMode()
+		return FormatCellDescription(samples, DescribeCode(DEVICE_MODE, dominant), 100.0 * self.modes[dominant] / samples,
+			", ".join("{}: {}".format(DescribeCode(DEVICE_MODE, m), n) for (m, n) in sorted(self.modes.items())),
+			self.rsrpCount, float(self.rsrpSum) / self.rsrpCount if self.rsrpCount > 0 else None, self.rsrpMin, self.rsrpMax)
+
+
+###############################################################################
+#  Grid of cells at several levels of detail. Level levels-1 has cells of cellSize degrees and
+# every coarser level doubles the cell size. Cells are indexed by (floor(lat / size), floor(lon / size)).
+class CoverageGrid(object):
+	def __init__(self, cellSize, levels):
+		self.cellSize = cellSize
+		self.levels = levels
+		self.cells = [{} for level in range(levels)]
+
+	def CellSize(self, level):
+		return self.cellSize * (1 << (self.levels - 1 - level))
+
+	def Add(self, latitude, longitude, devicemode, rsrp):
+		finest = self.cells[-1]
+		key = (int(floor(latitude / self.cellSize)), int(floor(longitude / self.cellSize)))
+		cell = finest.get(key)
+		if cell is None:
+			cell = finest[key] = Cell()
+		cell.Add(devicemode if devicemode is not None else UNKNOWN_MODE, rsrp)
+
+	def BuildLevels(self):
+		# Aggregates every level from the one below it (each cell covers 2x2 cells of the finer level).
+		for level in range(self.levels - 2, -1, -1):
+			coarse = self.cells[level] = {}
+			for ((iLat, iLon), cell) in self.cells[level + 1].items():
+				key = (iLat >> 1, iLon >> 1)
+				if key not in coarse:
+					coarse[key] = Cell()
+				coarse[key].Merge(cell)
+
+	def Tiles(self, level):
+		# Returns {(tile iLat, tile iLon): [(cell key, cell), ...]} of a level.
+		tiles = {}
+		for (key, cell) in self.cells[level].items():
+			tiles.setdefault((key[0] // TILE_CELLS, key[1] // TILE_CELLS), []).append((key, cell))
+		return tiles
+
+
+###############################################################################
+def TileName(level, tile):
+	return "tile_{}_{}_{}.kml".format(level, tile[0], tile[1])
+
+def TileRegion(grid, level, tile, maxLodPixels):
+	size = grid.CellSize(level) * TILE_CELLS
+	return FormatRegion(
+		(tile[0] + 1) * size, tile[0] * size, (tile[1] + 1) * size, tile[1] * size,
+		MIN_LOD_PIXELS, maxLodPixels)
+
+#  The link is loaded when the tile is big enough on screen, and the tile's own region hides it again.
+def TileLink(grid, level, tile, href):
+	return FormatNetworkLink(TileName(level, tile), TileRegion(grid, level, tile, -1), href)
+
+def WriteStyles(output):
+	for (devicemode, color) in sorted(MODE_COLORS.items()):
+		output.write(FormatPolygonStyle(devicemode, color))
+
+#  Writes the tiles of every level to outDir/tiles and the root document outDir/doc.kml.
+# Returns the number of tiles written.
+def WriteLODKML(grid, outDir):
+	tileDir = os.path.join(outDir, "tiles")
+	if not os.path.isdir(tileDir):
+		os.makedirs(tileDir)
+
+	tiles = [grid.Tiles(level) for level in range(grid.levels)]
+	count = 0
+	for level in range(grid.levels):
+		size = grid.CellSize(level)
+		maxLodPixels = -1 if level == grid.levels - 1 else MAX_LOD_PIXELS
+		for (tile, cells) in tiles[level].items():
+			with open(os.path.join(tileDir, TileName(level, tile)), "wt") as output:
+				output.write(KML_HEADER)
+				output.write(TileRegion(grid, level, tile, maxLodPixels))
+				WriteStyles(output)
+				for ((iLat, iLon), cell) in cells:
+					output.write(FormatCell(cell.Description(), cell.DominantMode(),
+						s = iLat * size, n = (iLat + 1) * size, w = iLon * size, e = (iLon + 1) * size))
+				if level < grid.levels - 1:
+					for child in [(2 * tile[0] + a, 2 * tile[1] + b) for a in (0, 1) for b in (0, 1)]:
+						if child in tiles[level + 1]:
+							output.write(TileLink(grid, level + 1, child, TileName(level + 1, child)))
+				output.write("</Document>\n</kml>\n")
+			count += 1
+
+	with open(os.path.join(outDir, "doc.kml"), "wt") as output:
+		output.write(KML_HEADER)
+		for tile in sorted(tiles[0]):
+			output.write(TileLink(grid, 0, tile, "tiles/" + TileName(0, tile)))
+		output.write("</Document>\n</kml>\n")
+	return count
+
+
+###############################################################################
+def ParseCommandLine():
+	parser = argparse.ArgumentParser(description = "Modem status - GPS coverage grid (level-of-detail KML)")
+
+	parser.add_argument('-n', '--nodeIDs', help = 'IDs of the nodes to aggregate', required = True, type = int, nargs = '+')
+	parser.add_argument('-s', '--startTime', help = 'Starting timestamp', required = True, type = int)
+	parser.add_argument('-e', '--endTime', help = 'Ending timestamp (+24 hours by default)', required = False, type = int, default = 0)
+	parser.add_argument('-o', '--operatorName', help = 'Name of the operator to filter (beware of issues when not filtering!). E.g., "voda ES"', required = False, type = str)
+	parser.add_argument('-i', '--minGPSInterval', help = 'Minimum interval between GPS positions with the same modem data', required = False, type = int, default = 0)
+	parser.add_argument('-g', '--cellSize', help = 'Cell size of the finest level, in degrees (default 0.005)', required = False, type = float, default = 0.005)
+	parser.add_argument('-l', '--levels', help = 'Levels of detail (default 5)', required = False, type = int, default = 5)
+	parser.add_argument('-d', '--outDir', help = 'Output directory (default coverage)', required = False, type = str, default = "coverage")
+	parser.add_argument('--cacheDir', help = 'Directory of the local partition cache (no cache by default)', required = False, type = str)
+	parser.add_argument('--cacheSize', help = 'Maximum size of the partition cache, in MB (default 1024)', required = False, type = int, default = 1024)
+	parser.add_argument('--bucketed', help = 'Read the day-bucketed (_daily) GPS and modem tables', required = False, action = 'store_true')
+
+	args = parser.parse_args()
+
+	# Validate args
+	if (args.endTime < args.startTime):
+		args.endTime = args.startTime + 3600*24
+	if (args.cellSize <= 0) or (args.levels < 1):
+		parser.error("cellSize and levels must be positive")
+
+	# Print parameters
+	print "Modem status - GPS coverage grid runs with the following parameters:"
+	print "NodeIDs: {}".format(args.nodeIDs)
+	print "StartTime: {}".format(args.startTime)
+	print "EndTime: {}".format(args.endTime)
+	print "OperatorName: {}".format(args.operatorName)
+	print "MinGPSInterval: {}".format(args.minGPSInterval)
+	print "CellSize: {} LevelsOfDetail: {}".format(args.cellSize, args.levels)
+	print "CacheDir: {} CacheSize: {} MB".format(args.cacheDir, args.cacheSize)
+	print "Bucketed: {}".format(args.bucketed)
+
+	return args
+
+###############################################################################
+if __name__ == '__main__':
+	args = ParseCommandLine()
+
+	# Connect to the DB
+	auth = PlainTextAuthProvider(username = "xxxx", password = "yyyy")
+	cluster = Cluster(contact_points = ['127.0.0.1'], port = 9042, auth_provider = auth)
+	session = None
+	session = cluster.connect("monroe") # Set default keyspace to 'monroe'
+	session.default_timeout = None
+	session.default_fetch_size = 1000
+
+	cache = PartitionCache(args.cacheDir, args.cacheSize << 20) if args.cacheDir else None
+	grid = CoverageGrid(args.cellSize, args.levels)
+	samples = 0
+	for nodeID in args.nodeIDs:
+		iccids = FetchNodeICCIDs(session, nodeID, cache)
+		gps = FetchPositions(session, args.startTime, args.endTime, nodeID, cache, args.bucketed)
+		modem = FetchModemStatus(session, args.startTime, args.endTime, nodeID, iccids, args.operatorName, cache, args.bucketed)
+		combine = lambda lastGPS, lastModem: (float(lastGPS.latitude), float(lastGPS.longitude), lastModem.devicemode, lastModem.rsrp)
+		for (latitude, longitude, devicemode, rsrp) in TraverseGPSAndModem(gps, modem, args.minGPSInterval, combine):
+			grid.Add(latitude, longitude, devicemode, rsrp)
+			samples += 1
+
+	cluster.shutdown() # Closes connection to the DB and frees resources.
+	if cache is not None:
+		print "Partition cache: {} hits, {} misses\n".format(cache.hits, cache.misses)
+
+	grid.BuildLevels()
+	tiles = WriteLODKML(grid, args.outDir)
+	print "Aggregated {} samples into {} cells, written as {} tiles to {}\n".format(samples, len(grid.cells[-1]), tiles, os.path.join(args.outDir, "doc.kml"))
+
+	print "DUMP FINISHED.\n"
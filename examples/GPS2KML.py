@@ -18,53 +18,58 @@ from datetime import datetime
 from calendar import timegm
 from dateutil.relativedelta import relativedelta
 from decimal import *
+from itertools import chain
+from PartitionCache import DayQueries
+from KMLWriter import Placemark, WriteKML, SimplifyPlacemarks
 
-def DumpPositions(session, startTime, endTime, nodeID):
+FormatDescription = "Latitud: {} {}\nLongitud: {} {}\nAltitud: {}\nVelocidad: {} Km/h\n".format
+
+# True for the rows of GPRMC sentences, as classified by the importer (see importer/monroenmea.py).
+#  Rows imported before the classification have no nmeatype and are recognized by their nmea text.
+def IsGPRMC(row):
+	if row.nmeatype is not None:
+		return row.nmeatype == "GPRMC"
+	return (row.nmea is not None) and (row.nmea.find("GPRMC") != -1)
+
+# Yields the placemarks of the GPRMC positions read from the query rows.
+def Positions(rows):
+	for row in rows:
+		try:
+			if IsGPRMC(row):
+				description = FormatDescription(
+					row.latitude, 'N' if row.latitude >= 0.0 else 'S',
+					row.longitude, 'E' if row.longitude >= 0.0 else 'W',
+					row.altitude, row.speed * Decimal('1.852') if row.speed != None else row.speed)
+				yield Placemark(description, "#iconoPosicion", row.longitude, row.latitude, row.altitude)
+		except Exception as error:
+			print "Error in row:", row, error
+
+# With minDistance (meters) and/or minAngle (degrees), positions are simplified as they stream
+#  through (see KMLWriter.SimplifyPlacemarks). With bucketed, they are read from the day-bucketed
+#  table, one query per day (required once the importer runs with --buckets only).
+def DumpPositions(session, startTime, endTime, nodeID, minDistance = 0, minAngle = 0, bucketed = False):
 	print "\n======================================================================"
 	print "======================================================================"
 	print "======================================================================"
 	print "Extracting GPS positions for node {} during interval [{}, {})\n".format(nodeID, startTime, endTime)
-	
+
 	########## monroe_meta_device_gps #################
 	session.default_fetch_size = 1000
 	fileName = "{}_{}_{}.kml".format(nodeID, startTime, endTime)
-	with open(fileName, "wt") as output:
-                # Write KML file headers.
-                output.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?><kml xmlns=\"http://www.opengis.net/kml/2.2\">\n"
-                                "<Document>\n"
-                                #"<Style id=\"iconoPosicion\">\n"
-				#"	<IconStyle>\n"
-				#"    <scale>0.5</scale>\n"
-				#"    <Icon>\n"
-				#"      <href>MarcaRoja.png</href>\n"
-				#"    </Icon>\n"
-				#"  </IconStyle>\n"
-				#"</Style>\n"
-				"<Folder>\n")
-
-		query = "select nmea, nodeid, timestamp, latitude, longitude, altitude, speed, satellitecount from monroe_meta_device_gps where nodeid='{}' and timestamp >= {} and timestamp < {} order by timestamp".format(nodeID, startTime, endTime)
+	if bucketed:
+		query = "select nmea, nmeatype, nodeid, timestamp, latitude, longitude, altitude, speed, satellitecount from monroe_meta_device_gps_daily where nodeid='{}' and day = {{day}} and timestamp >= {{}} and timestamp < {{}} order by timestamp".format(nodeID)
+		queries = list(DayQueries(query, startTime, endTime))
+	else:
+		queries = ["select nmea, nmeatype, nodeid, timestamp, latitude, longitude, altitude, speed, satellitecount from monroe_meta_device_gps where nodeid='{}' and timestamp >= {} and timestamp < {} order by timestamp".format(nodeID, startTime, endTime)]
+	for query in queries:
 		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
-		for row in rows:
-			try:
-				if row.nmea.find("GPRMC") != -1:
-					description = "Latitud: {} {}\nLongitud: {} {}\nAltitud: {}\nVelocidad: {} Km/h\n".format(
-                                        	row.latitude, 'N' if row.latitude >= 0.0 else 'S',
-                                        	row.longitude, 'E' if row.longitude >= 0.0 else 'W',
-                                        	row.altitude, row.speed * Decimal('1.852') if row.speed != None else row.speed)
-					output.write("\n<Placemark>\n"
-						"<description>{}</description>\n"
-						"<styleUrl>#iconoPosicion</styleUrl>\n"
-						"<Point> <coordinates>{},{},{} </coordinates> </Point>\n"
-						"</Placemark>\n".format(description, row.longitude, row.latitude, row.altitude))
-					count += 1
-			except Exception as error:
-                                print "Error in row:", row, error
-
-                # Write KML file footers.
-		output.write("</Folder>\n</Document>\n</kml>\n")
-		
+	# Day by day, in order; the rows of every day are fetched as they are written.
+	rows = chain.from_iterable(session.execute(query, timeout=None) for query in queries)
+	positions = Positions(rows)
+	if (minDistance > 0) or (minAngle > 0):
+		positions = SimplifyPlacemarks(positions, minDistance, minAngle)
+	count = WriteKML(fileName, positions)
+
 	print "Dumped {} positions to {}\n".format(count, fileName)
 
 
@@ -6,6 +6,14 @@
   Creator: Miguel Peon Quiros, IMDEA Networks Institute
   mikepeon@imdea.org
 
+ Every directory holds the telemetry (CSV) files of one train, and its positions are inserted
+  for all the nodes in that train. Directories are given as directory:node,node,... or, if
+  named after the nodes (e.g., 206_292), just as the directory. Each CSV is parsed once and its
+  rows are written for all its nodes with a prepared statement and up to --concurrency
+  concurrent requests, CHUNK_ROWS rows at a time.
+
+ Usage: ./importTrainTelemetry.py 206_292 228_229 telemetry/254:254,255
+
  Dependencies: sudo pip install cassandra-driver python-dateutil
 
  Cassandra driver (Python) documentation: https://datastax.github.io/python-driver/index.html
@@ -13,23 +21,92 @@
 
 from cassandra.cluster import Cluster
 from cassandra.auth import PlainTextAuthProvider
+from cassandra.concurrent import execute_concurrent_with_args
+from decimal import Decimal
+from glob import glob
+from itertools import islice
 import argparse
 import csv
+import os
+import time
+
+CHUNK_ROWS = 2000
+DATA_ID = "MONROE.META.DEVICE.GPS"
+DATA_VERSION = 2
+INSERT_QUERY = "insert into monroe_meta_device_gps (NodeId, Timestamp, DataId, DataVersion, SequenceNumber, Longitude, Latitude, Speed, SatelliteCount) values (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+def ToDecimal(text):
+	return Decimal(text) if text.strip() != "" else None
+
+def ToInt(text):
+	return int(text) if text.strip() != "" else None
+
+# Yields the insert parameters of the rows of a telemetry file for every node.
+#  The sequence number of a row is its position in the file, as for every node.
+def TelemetryParams(fileName, nodeIDs, errors):
+	with open(fileName, "rb") as iFile:
+		theReader = csv.reader(iFile, delimiter = ',')
+		theReader.next() # Skip CSV header
+		for (count, line) in enumerate(theReader):
+			try:
+				values = [Decimal(int(line[2])), DATA_ID, DATA_VERSION, count, ToDecimal(line[6]), ToDecimal(line[5]), ToDecimal(line[8]), ToInt(line[7])]
+			except Exception as error:
+				print "Error in line {} of {}: {} {}".format(theReader.line_num, fileName, line, error)
+				errors.append(count)
+				continue
+			for nodeID in nodeIDs:
+				yield [str(nodeID)] + values
 
 
 ###############################################################################
+# Imports one telemetry file for all its nodes. Returns (rows inserted, rows failed).
+def ImportFile(session, statement, fileName, nodeIDs, concurrency):
+	errors = []
+	params = TelemetryParams(fileName, nodeIDs, errors)
+	inserted = 0
+	failed = 0
+	startTime = time.time()
+	while True:
+		chunk = list(islice(params, CHUNK_ROWS))
+		if len(chunk) == 0:
+			break
+		results = execute_concurrent_with_args(session, statement, chunk, concurrency = concurrency, raise_on_first_error = False)
+		for (success, result) in results:
+			if success:
+				inserted += 1
+			else:
+				print "Error inserting from {}: {}".format(fileName, result)
+				failed += 1
+		elapsed = time.time() - startTime
+		print "{}: {} rows inserted, {} failed, {:.0f} rows/s".format(fileName, inserted, failed, inserted / elapsed if elapsed > 0 else 0.0)
+	return (inserted, failed + len(errors) * len(nodeIDs))
+
+
+###############################################################################
+# Returns (directory, [nodeIDs]) of a directory:node,node argument, or of a directory named node_node.
+def ParseMapping(text):
+	(directory, separator, nodes) = text.rpartition(":")
+	if separator == "":
+		(directory, nodes) = (text, os.path.basename(os.path.normpath(text)).replace("_", ","))
+	try:
+		nodeIDs = [int(node) for node in nodes.split(",")]
+	except ValueError:
+		raise argparse.ArgumentTypeError("{} is not directory:node,node,... nor a directory named node_node".format(text))
+	return (directory, nodeIDs)
+
 def ParseCommandLine():
 	parser = argparse.ArgumentParser(description = "Train telemetry (GPS) importer")
 
-	parser.add_argument('-n', '--nodeID', help = 'ID of the node in the train', required = True, type = int)
-	parser.add_argument('-f', '--fileName', help = 'Telemetry filename (CSV)', required = True, type = str)
+	parser.add_argument('mappings', help = 'Telemetry directories and their nodes (directory:node,node,... or node_node directory)', nargs = '+', type = ParseMapping)
+	parser.add_argument('-c', '--concurrency', help = 'Concurrent insert requests (default 64)', required = False, type = int, default = 64)
 
 	args = parser.parse_args()
 
 	# Print parameters
 	print "Train telemetry (GPS) runs with the following parameters:"
-	print "NodeID: {}".format(args.nodeID)
-	print "StartTime: {}".format(args.fileName)
+	for (directory, nodeIDs) in args.mappings:
+		print "Directory: {} NodeIDs: {}".format(directory, nodeIDs)
+	print "Concurrency: {}".format(args.concurrency)
 
 	return args
 
@@ -44,20 +121,20 @@ if __name__ == '__main__':
 	session = cluster.connect("monroe") # Set default keyspace to 'monroe'
 	session.default_timeout = None
 	session.default_fetch_size = 1000
+	statement = session.prepare(INSERT_QUERY)
 
-	with open(args.fileName, "rb") as iFile:
-		theReader = csv.reader(iFile, delimiter = ',')
-		count = 0
-		theReader.next() # Skip CSV header
-		for line in theReader:
-			query = "insert into monroe_meta_device_gps (NodeId, Timestamp, DataId, DataVersion, SequenceNumber, Longitude, Latitude, Speed, SatelliteCount) values ('{}', {:.6f}, '{}', {}, {}, {}, {}, {}, {})".format(args.nodeID, int(line[2]), "MONROE.META.DEVICE.GPS", 2, count, line[6], line[5], line[8], line[7])
-			#print query
-			session.execute(query, timeout = None)
-			count = count + 1
-
-	print "Inserted {} lines.".format(count)
+	totalInserted = 0
+	totalFailed = 0
+	startTime = time.time()
+	for (directory, nodeIDs) in args.mappings:
+		for fileName in sorted(glob(os.path.join(directory, "*.csv"))):
+			(inserted, failed) = ImportFile(session, statement, fileName, nodeIDs, args.concurrency)
+			totalInserted += inserted
+			totalFailed += failed
 
 	cluster.shutdown() # Closes connection to the DB and frees resources.
 
-	print "DUMP FINISHED.\n"
+	elapsed = time.time() - startTime
+	print "Inserted {} rows, {} failed in {:.0f} s.".format(totalInserted, totalFailed, elapsed)
 
+	print "DUMP FINISHED.\n"
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+"""
+ Streaming KML writer shared by the MONROE GPS tools (GPS2KML.py, CoverageGPS.py).
+  https://www.monroe-project.eu
+
+ WriteKML takes any iterable (e.g., a generator) of Placemark and writes each placemark as soon
+  as it is produced, so memory does not grow with the number of positions. Templates are
+  formatted once per placemark through pre-bound str.format methods, and the modem codes are
+  translated through the lookup tables below.
+
+ SimplifyPlacemarks thins a stream of placemarks by distance and heading change before it is
+  written, keeping every point where the style (i.e., the modem mode) changes.
+"""
+
+from collections import namedtuple
+from xml.sax.saxutils import escape
+from math import atan2, cos, degrees, radians, sqrt
+
+Placemark = namedtuple("Placemark", ["description", "styleUrl", "longitude", "latitude", "altitude"])
+
+KML_HEADER = "<?xml version=\"1.0\" encoding=\"UTF-8\"?><kml xmlns=\"http://www.opengis.net/kml/2.2\">\n<Document>\n"
+KML_FOLDER = "<Folder>\n"
+KML_FOOTER = "</Folder>\n</Document>\n</kml>\n"
+
+FormatIconStyle = ("<Style id=\"{}\">\n"
+	"  <IconStyle>\n"
+	"    <scale>0.5</scale>\n"
+	"    <Icon>\n"
+	"      <href>{}</href>\n"
+	"    </Icon>\n"
+	"  </IconStyle>\n"
+	"</Style>\n").format
+
+FormatPlacemark = ("\n<Placemark>\n"
+	"<description>{}</description>\n"
+	"<styleUrl>{}</styleUrl>\n"
+	"<Point> <coordinates>{},{},{} </coordinates> </Point>\n"
+	"</Placemark>\n").format
+
+###############################################################################
+# Modem codes (monroe_meta_device_modem), see CoverageGPS_legend.txt
+DEVICE_MODE = {0: "Unknown (0)", 1: "Disconnected (1)", 2: "No service (2)", 3: "2G (3)", 4: "3G (4)", 5: "LTE (5)"}
+DEVICE_SUBMODE = {0: "Unknown (0)", 1: "UMTS (1)", 2: "WCDMA (2)", 3: "EVDO (3)", 4: "HSPA (4)", 5: "HSPA+ (5)",
+	6: "DC HSPA (6)", 7: "DC HSPA+ (7)", 8: "HSDPA (8)", 9: "HSUPA (9)", 10: "HSDPA+HSUPA (10)", 11: "HSDPA+ (11)",
+	12: "HSDPA+HSUPA (12)", 13: "DC HSDPA+ (13)", 14: "DC HSDPA + HSUPA (14)"}
+DEVICE_STATE = {0: "Unknown (0)", 1: "Registered (1)", 2: "Unregistered (2)", 3: "Connected (3)", 4: "Disconnected (4)"}
+
+# Icon style of every devicemode, and the icons of the styles.
+MODE_ICON_STYLE = {0: "#IconUnknown", 1: "#IconDisconnected", 2: "#IconNoService", 3: "#Icon2G", 4: "#Icon3G", 5: "#IconLTE"}
+MODE_ICONS = [("IconUnknown", "Mark_Unknown.png"), ("IconDisconnected", "Mark_Disconnected.png"),
+	("IconNoService", "Mark_NoService.png"), ("Icon2G", "Mark_2G.png"), ("Icon3G", "Mark_3G.png"), ("IconLTE", "Mark_LTE.png")]
+
+# Returns the name of a modem code in one of the tables above.
+def DescribeCode(table, code):
+	name = table.get(code)
+	if name is not None:
+		return name
+	return "None" if code is None else "?? ({})".format(code)
+
+def ModeIconStyle(devicemode):
+	return MODE_ICON_STYLE.get(devicemode, "#IconUnknown")
+
+
+###############################################################################
+# Writes the placemarks to fileName as they are produced. icons is a list of (style id, image).
+#  Returns the number of placemarks written.
+def WriteKML(fileName, placemarks, icons = ()):
+	count = 0
+	with open(fileName, "wt") as output:
+		output.write(KML_HEADER)
+		for (styleId, href) in icons:
+			output.write(FormatIconStyle(styleId, href))
+		output.write(KML_FOLDER)
+		for placemark in placemarks:
+			output.write(FormatPlacemark(escape(placemark.description), placemark.styleUrl,
+				placemark.longitude, placemark.latitude, placemark.altitude))
+			count += 1
+		output.write(KML_FOOTER)
+	return count
+
+
+###############################################################################
+EARTH_RADIUS = 6371000.0	# meters
+MIN_STEP = 0.5	# meters; shorter moves have no reliable heading.
+
+# Returns the distance (meters) and heading (degrees) from one placemark to another, with an
+#  equirectangular approximation (good enough for the short hops between consecutive fixes).
+def Displacement(origin, target):
+	latitude = radians(float(origin.latitude))
+	x = radians(float(target.longitude) - float(origin.longitude)) * cos(latitude)
+	y = radians(float(target.latitude)) - latitude
+	return (EARTH_RADIUS * sqrt(x * x + y * y), degrees(atan2(x, y)))
+
+def HeadingChange(a, b):
+	return abs((b - a + 180.0) % 360.0 - 180.0)
+
+#  Yields the placemarks (in order) that are worth drawing:
+#  - Placemarks closer than minDistance meters to the last kept one are dropped (e.g., a node
+#    standing in a station).
+#  - With minAngle, a placemark is only kept where the track turns at least minAngle degrees
+#    from the heading of the last kept segment, so straight runs collapse to their ends while
+#    curves keep their shape.
+#  - A placemark whose styleUrl differs from the previous one is always kept, together with the
+#    one preceding it, so the places where the modem mode changes are exact. So is the last one.
+# Only the last dropped placemark is held, so it works on streams of any length.
+def SimplifyPlacemarks(placemarks, minDistance = 0, minAngle = 0):
+	lastKept = None
+	heading = None	# Heading of the last kept segment.
+	pending = None	# Last placemark seen, if it was dropped.
+	for placemark in placemarks:
+		keep = False
+		if lastKept is None:
+			keep = True
+		elif placemark.styleUrl != (pending or lastKept).styleUrl:
+			if pending is not None:
+				yield pending
+				lastKept = pending
+			keep = True
+		elif minAngle <= 0:
+			keep = Displacement(lastKept, placemark)[0] >= minDistance
+		elif (pending is not None) and (Displacement(lastKept, pending)[0] >= max(minDistance, MIN_STEP)):
+			# Is the pending placemark a vertex, i.e. does the track turn there?
+			(step, direction) = Displacement(pending, placemark)
+			if (step >= MIN_STEP) and ((heading is None) or (HeadingChange(heading, direction) >= minAngle)):
+				yield pending
+				lastKept = pending
+				heading = direction
+
+		if keep:
+			if lastKept is not None:
+				(step, direction) = Displacement(lastKept, placemark)
+				if step >= MIN_STEP:
+					heading = direction
+			yield placemark
+			lastKept = placemark
+			pending = None
+		else:
+			pending = placemark
+	if pending is not None:
+		yield pending
@@ -0,0 +1,163 @@
+#!/usr/bin/python
+
+"""
+ On-disk cache of the Cassandra partitions read by the MONROE analysis tools (CoverageGPS.py,
+  CoverageGrid.py), so that repeated runs over the same nodes and days do not query the cluster.
+  https://www.monroe-project.eu
+
+ Rows are cached per (table, NodeId, Iccid, UTC day): a request for [startTime, endTime) reads
+  every whole day it overlaps (from the cache or, on a miss, with one query per day) and returns
+  the rows inside the interval as namedtuples, like the driver does. Every entry is stored
+  column-wise (one list per column), pickled and zlib-compressed in its own file.
+
+ Days that ended more than CLOSED_AFTER ago are immutable (data older than the importer's
+  TS_GRACE is rejected) and are kept until evicted. More recent days may still receive data,
+  so their entries expire after ttl seconds. The least recently used entries are evicted once
+  the cache grows over maxBytes.
+"""
+
+from collections import namedtuple
+import cPickle
+import hashlib
+import os
+import tempfile
+import time
+import zlib
+
+DAY = 24*3600
+CLOSED_AFTER = 15*DAY	# monroevalidator.TS_GRACE (2 weeks) plus one day.
+DEFAULT_TTL = 3600
+DEFAULT_MAX_BYTES = 1 << 30
+COMPRESSION_LEVEL = 6
+ENTRY_EXTENSION = ".zpkl"
+
+# Namedtuple classes of the cached rows, by column list, so that rows of the same table compare
+# and pickle alike.
+_ROW_CLASSES = {}
+
+def RowClass(columns):
+	columns = tuple(columns)
+	rowClass = _ROW_CLASSES.get(columns)
+	if rowClass is None:
+		rowClass = _ROW_CLASSES[columns] = namedtuple("Row", columns)
+	return rowClass
+
+def DayBuckets(startTime, endTime):
+	return range(int(startTime) // DAY, (int(endTime) - 1) // DAY + 1)
+
+# Yields the query of every day of [startTime, endTime), formatted like in PartitionCache.Rows but
+#  with the interval clipped to the day. Used to read the day-bucketed (_daily) tables without a cache.
+def DayQueries(query, startTime, endTime):
+	for day in DayBuckets(startTime, endTime):
+		yield query.format(max(startTime, day*DAY), min(endTime, (day + 1)*DAY), day = day)
+
+
+###############################################################################
+class PartitionCache(object):
+	def __init__(self, cacheDir, maxBytes = DEFAULT_MAX_BYTES, ttl = DEFAULT_TTL):
+		self.cacheDir = cacheDir
+		self.maxBytes = maxBytes
+		self.ttl = ttl
+		self.hits = 0
+		self.misses = 0
+		if not os.path.isdir(cacheDir):
+			os.makedirs(cacheDir)
+
+	def EntryPath(self, table, nodeID, iccid, day):
+		key = "{}|{}|{}|{}".format(table, nodeID, iccid, day)
+		return os.path.join(self.cacheDir, "{}_{}_{}{}".format(table, day, hashlib.sha1(key).hexdigest()[:16], ENTRY_EXTENSION))
+
+	def IsFresh(self, path, day):
+		try:
+			modified = os.path.getmtime(path)
+		except OSError:
+			return False
+		# Entries are written after the query, so an entry written after the day closed is complete.
+		return (modified >= (day + 1)*DAY + CLOSED_AFTER) or (time.time() - modified < self.ttl)
+
+	def Load(self, path):
+		with open(path, "rb") as f:
+			(columns, values) = cPickle.loads(zlib.decompress(f.read()))
+		now = time.time()
+		os.utime(path, (now, os.path.getmtime(path)))	# The access time orders the LRU eviction.
+		return (columns, values)
+
+	def Store(self, path, columns, values):
+		data = zlib.compress(cPickle.dumps((list(columns), values), cPickle.HIGHEST_PROTOCOL), COMPRESSION_LEVEL)
+		# Write to a temporary file and rename it, so concurrent runs never read a partial entry.
+		(fd, tempPath) = tempfile.mkstemp(dir = self.cacheDir, suffix = ".tmp")
+		with os.fdopen(fd, "wb") as f:
+			f.write(data)
+		os.rename(tempPath, path)
+		self.Evict()
+
+	# Removes the least recently used entries until the cache fits in maxBytes.
+	def Evict(self):
+		entries = []
+		total = 0
+		for name in os.listdir(self.cacheDir):
+			if not name.endswith(ENTRY_EXTENSION):
+				continue
+			path = os.path.join(self.cacheDir, name)
+			try:
+				stat = os.stat(path)
+			except OSError:
+				continue
+			entries.append((stat.st_atime, stat.st_size, path))
+			total += stat.st_size
+		entries.sort()
+		for (accessed, size, path) in entries:
+			if total <= self.maxBytes:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			total -= size
+
+	#  Returns the rows of one partition (nodeID, iccid; iccid may be None) with startTime <= timestamp < endTime,
+	# sorted by timestamp. query is the CQL query of a day, formatted with (dayStart, dayEnd) and, for the
+	# day-bucketed tables, day = the day number. timeColumn is the column holding the timestamp.
+	def Rows(self, session, table, nodeID, iccid, startTime, endTime, query, timeColumn = "timestamp"):
+		rows = []
+		for day in DayBuckets(startTime, endTime):
+			path = self.EntryPath(table, nodeID, iccid, day)
+			if self.IsFresh(path, day):
+				try:
+					(columns, values) = self.Load(path)
+					self.hits += 1
+				except Exception as error:
+					print "Ignoring unreadable cache entry {}: {}".format(path, error)
+					columns = None
+			else:
+				columns = None
+			if columns is None:
+				self.misses += 1
+				dayQuery = query.format(day*DAY, (day + 1)*DAY, day = day)
+				print dayQuery
+				dayRows = list(session.execute(dayQuery, timeout = None))
+				columns = dayRows[0]._fields if len(dayRows) > 0 else ()
+				values = [[row[i] for row in dayRows] for i in range(len(columns))]
+				self.Store(path, columns, values)
+			if len(columns) == 0:
+				continue
+			rowClass = RowClass(columns)
+			iTimestamp = list(columns).index(timeColumn)
+			rows.extend(row for row in map(rowClass._make, zip(*values)) if startTime <= row[iTimestamp] < endTime)
+		return rows
+
+	#  Returns the value cached under (table, key), or fetch() stored with the cache's ttl, for small
+	# values that are not split by day (e.g., the ICCIDs of a node).
+	def Value(self, table, key, fetch):
+		path = self.EntryPath(table, key, None, None)
+		try:
+			if time.time() - os.path.getmtime(path) < self.ttl:
+				(columns, values) = self.Load(path)
+				self.hits += 1
+				return values
+		except Exception:
+			pass
+		self.misses += 1
+		value = fetch()
+		self.Store(path, (), value)
+		return value
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+
+"""
+ Local read gateway to the MONROE database for the analysis tools.
+  https://www.monroe-project.eu
+
+ A small HTTP service (bound to localhost by default) that keeps one long-lived Cassandra session
+  and answers time-range reads of a partition:
+   GET /rows?table=monroe_meta_device_modem&nodeid=54&iccid=8934...&start=1473940800&end=1474027200[&columns=timestamp,rsrp]
+  with {"columns": [...], "rows": [[...], ...], "decimals": [...]} (rows sorted by time), and
+  GET /stats with the cache and request counters. Every partition key column of the table
+  (nodeid, iccid, ...) is a parameter; the tables, keys and time columns come from the schema
+  registry (importer/monroeschema.py). Only tables whose time column is the first clustering
+  column can be read (not e.g. the traceroute and paris tables). Decimal values are sent as
+  strings, so they keep all their digits, and "decimals" lists their columns.
+
+ Reads go through a PartitionCache (see PartitionCache.py): whole days of all the columns of a
+  partition are read and cached, and requests are answered from them, so overlapping requests
+  (other intervals or columns of the same days) share the same queries and closed days are never
+  read twice. Concurrent requests for the same partition wait for the first one and are then
+  answered from the cache, instead of querying the cluster again.
+
+ Scripts read through it with FetchRows (same rows as the driver, as namedtuples, with the decimal
+  values as Decimal), without connecting to the cluster themselves, e.g.:
+   from ReadGateway import FetchRows
+   modem = FetchRows("monroe_meta_device_modem", 1473940800, 1474027200, nodeid = 54, iccid = "8934...")
+
+ Usage: ./ReadGateway.py --cacheDir /tmp/monroeCache [-P 8642]
+
+ Dependencies: sudo pip install cassandra-driver python-dateutil
+
+ Cassandra driver (Python) documentation: https://datastax.github.io/python-driver/index.html
+"""
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from contextlib import contextmanager
+from decimal import Decimal
+from PartitionCache import PartitionCache, RowClass
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "importer"))
+from monroeschema import load_registry, column_types, BUCKET_COLUMN
+
+DB_HOSTS = ['127.0.0.1']
+DB_KEYSPACE = "monroe"
+DB_USER = "xxxx"
+DB_PASSWORD = "yyyy"
+DEFAULT_PORT = 8642
+DEFAULT_GATEWAY = "http://127.0.0.1:{}".format(DEFAULT_PORT)
+TEXT_TYPES = ("text", "varchar", "ascii")
+
+
+###############################################################################
+# Client side: returns the rows of a partition in [startTime, endTime) as namedtuples.
+#  partition holds the partition key columns of the table (e.g. nodeid = 54, iccid = "8934...").
+def FetchRows(table, startTime, endTime, columns = None, gateway = DEFAULT_GATEWAY, **partition):
+	params = dict(partition, table = table, start = startTime, end = endTime)
+	if columns is not None:
+		params['columns'] = ",".join(columns)
+	try:
+		reply = json.load(urllib2.urlopen("{}/rows?{}".format(gateway, urllib.urlencode(params))))
+	except urllib2.HTTPError as error:
+		raise Exception("Gateway error {}: {}".format(error.code, error.read()))
+	rowClass = RowClass(reply['columns'])
+	decimals = [reply['columns'].index(c) for c in reply.get('decimals', [])]
+	rows = []
+	for row in reply['rows']:
+		for i in decimals:
+			if row[i] is not None:
+				row[i] = Decimal(row[i])
+		rows.append(rowClass._make(row))
+	return rows
+
+
+###############################################################################
+#  Locks by key, removed once nobody holds or waits for them: requests for the same partition
+# run one at a time.
+class KeyedLocks(object):
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.locks = {}
+
+	@contextmanager
+	def Hold(self, key):
+		with self.lock:
+			entry = self.locks.setdefault(key, [threading.Lock(), 0])
+			entry[1] += 1
+		try:
+			with entry[0]:
+				yield
+		finally:
+			with self.lock:
+				entry[1] -= 1
+				if entry[1] == 0:
+					del self.locks[key]
+
+
+# Decimals as strings, converted back by FetchRows: as floats they would lose digits.
+def JSONValue(value):
+	if isinstance(value, Decimal):
+		return str(value)
+	if isinstance(value, (set, frozenset)):
+		return sorted(value)
+	return str(value)
+
+
+###############################################################################
+class Gateway(object):
+	def __init__(self, session, cache, registry, bucketed = False):
+		self.session = session
+		self.cache = cache
+		self.registry = registry
+		self.bucketed = bucketed
+		self.locks = KeyedLocks()
+		self.requests = 0
+		self.waited = 0
+
+	#  Returns (columns, rows, decimal columns) of a request (the parsed query string), raising
+	# ValueError for bad requests.
+	def Rows(self, params):
+		table = params.get('table', '').lower()
+		info = self.registry['tables'].get(table)
+		if (info is None) or (info['time_column'] is None) or (info['bucket_of'] is not None):
+			raise ValueError("Unknown or unsupported table {}".format(table))
+		# The day queries select a time range, on the first clustering column only.
+		if info['clustering_key'][:1] != [info['time_column']]:
+			raise ValueError("{} cannot be read by time: its time column is not the first clustering column".format(table))
+		types = column_types(self.registry, table)
+		try:
+			startTime = int(params['start'])
+			endTime = int(params['end'])
+			keys = [(column, params[column]) for column in info['partition_key'] if column != BUCKET_COLUMN]
+		except (KeyError, ValueError) as error:
+			raise ValueError("Missing or invalid parameter: {}".format(error))
+		columns = [c.strip().lower() for c in params['columns'].split(",")] if 'columns' in params else None
+		for column in columns or []:
+			if column not in types:
+				raise ValueError("{} has no column {}".format(table, column))
+
+		# The day query of the partition, on the day-bucketed table if wanted and there is one.
+		queryTable = info['bucketed_table'] if self.bucketed and info['bucketed_table'] else table
+		timeColumn = info['time_column']
+		# The query is a template of PartitionCache.Rows (str.format): braces of the values are escaped.
+		where = ["{} = {}".format(column, "'{}'".format(value.replace("'", "''").replace("{", "{{").replace("}", "}}")) if types[column] in TEXT_TYPES else int(value)) for (column, value) in keys]
+		if queryTable != table:
+			where.append("{} = {{day}}".format(BUCKET_COLUMN))
+		query = "select * from {} where {} and {} >= {{}} and {} < {{}}".format(queryTable, " and ".join(where), timeColumn, timeColumn)
+
+		nodeID = dict(keys).get('nodeid')
+		otherKeys = "|".join(value for (column, value) in keys if column != 'nodeid') or None
+		self.requests += 1
+		started = time.time()
+		with self.locks.Hold((table, tuple(keys))):
+			if time.time() - started > 0.01:
+				self.waited += 1
+			rows = self.cache.Rows(self.session, table, nodeID, otherKeys, startTime, endTime, query, timeColumn)
+		if len(rows) == 0:
+			return (columns or [], [], [])
+		allColumns = list(rows[0]._fields)
+		if columns is None:
+			columns = allColumns
+			rows = [list(row) for row in rows]
+		else:
+			indices = [allColumns.index(c) for c in columns]
+			rows = [[row[i] for i in indices] for row in rows]
+		return (columns, rows, [c for c in columns if types.get(c) == "decimal"])
+
+	def Stats(self):
+		return {'requests': self.requests, 'waitedForSamePartition': self.waited, 'cacheHits': self.cache.hits, 'cacheMisses': self.cache.misses}
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+	gateway = None
+
+	def Reply(self, code, data):
+		body = json.dumps(data, default = JSONValue)
+		self.send_response(code)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		url = urlparse.urlparse(self.path)
+		params = dict((k, v[-1]) for (k, v) in urlparse.parse_qs(url.query).items())
+		try:
+			if url.path == "/rows":
+				(columns, rows, decimals) = self.gateway.Rows(params)
+				self.Reply(200, {'columns': columns, 'rows': rows, 'decimals': decimals})
+			elif url.path == "/stats":
+				self.Reply(200, self.gateway.Stats())
+			else:
+				self.Reply(404, {'error': "Unknown path {}".format(url.path)})
+		except ValueError as error:
+			self.Reply(400, {'error': str(error)})
+		except Exception as error:
+			self.Reply(500, {'error': str(error)})
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+
+###############################################################################
+def ParseCommandLine():
+	parser = argparse.ArgumentParser(description = "Local read gateway to the MONROE database")
+
+	parser.add_argument('-d', '--cacheDir', help = 'Directory of the partition cache', required = True, type = str)
+	parser.add_argument('--cacheSize', help = 'Maximum size of the partition cache, in MB (default 4096)', required = False, type = int, default = 4096)
+	parser.add_argument('-b', '--bind', help = 'Address to listen on (default 127.0.0.1)', required = False, type = str, default = '127.0.0.1')
+	parser.add_argument('-P', '--port', help = 'Port to listen on (default {})'.format(DEFAULT_PORT), required = False, type = int, default = DEFAULT_PORT)
+	parser.add_argument('--bucketed', help = 'Read the day-bucketed (_daily) tables when there are', required = False, action = 'store_true')
+
+	args = parser.parse_args()
+
+	# Print parameters
+	print "Read gateway runs with the following parameters:"
+	print "CacheDir: {} CacheSize: {} MB".format(args.cacheDir, args.cacheSize)
+	print "Listening on: {}:{} Bucketed: {}".format(args.bind, args.port, args.bucketed)
+
+	return args
+
+###############################################################################
+if __name__ == '__main__':
+	from cassandra.cluster import Cluster
+	from cassandra.auth import PlainTextAuthProvider
+
+	args = ParseCommandLine()
+
+	# Connect to the DB once; the session is shared by all the requests.
+	auth = PlainTextAuthProvider(username = DB_USER, password = DB_PASSWORD)
+	cluster = Cluster(contact_points = DB_HOSTS, port = 9042, auth_provider = auth)
+	session = cluster.connect(DB_KEYSPACE)
+	session.default_timeout = None
+	session.default_fetch_size = 1000
+
+	GatewayHandler.gateway = Gateway(session, PartitionCache(args.cacheDir, args.cacheSize << 20), load_registry(), args.bucketed)
+	server = ThreadingHTTPServer((args.bind, args.port), GatewayHandler)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		cluster.shutdown() # Closes connection to the DB and frees resources.
+
+	print "GATEWAY STOPPED.\n"
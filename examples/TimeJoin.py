@@ -0,0 +1,392 @@
+#!/usr/bin/python
+
+"""
+ Time-aligned joins of any two MONROE tables, e.g. the ping RTT against the modem RSRP of every
+  (NodeId, Iccid), or the nettest throughput against the GPS speed of a node.
+  https://www.monroe-project.eu
+
+ Rows are read per partition (NodeId, plus Iccid for the tables keyed by it, as found in the
+  schema registry, importer/monroeschema.py) in time slices of --slice seconds, and every slice
+  becomes a batch: a dict of NumPy arrays, one per column (numeric columns as float64 with NaN
+  for nulls, other columns as object arrays), sorted by time. Both sides are streamed, and only
+  the rows of the right side that can still match the current left batch are kept, so memory
+  is bounded by the slice size and the tolerance or window, not by the interval.
+
+ Joins (vectorized with numpy.searchsorted on every batch):
+  - as-of: every left row gets the values of the last right row at or before it (backward), the
+     first at or after it (forward) or the closest (nearest), within --tolerance seconds.
+  - window: every left row gets the count, mean, min and max of every right column over the
+     right rows in [t - before, t + after].
+ Right columns are prefixed with the last word of the right table (e.g. modem_rsrp, modem_count).
+
+ Only tables whose rows of a node (and Iccid) can be read by time are supported: the time column
+  must be the first clustering column and the partition key hold only NodeId and Iccid (e.g. not
+  the traceroute, paris and tstat_tcp_complete tables). When Iccid is a clustering column (nettest,
+  udp_ping) the rows of every ICCID are read apart.
+  Batches can be converted to Arrow record batches with ToArrow (if pyarrow is installed).
+
+ Usage: ./TimeJoin.py -n 54 -s 1473940800 -e 1474027200 -l monroe_exp_ping rtt -r monroe_meta_device_modem rsrp rsrq -t 30 -o ping_modem.csv
+
+ Dependencies: sudo pip install cassandra-driver python-dateutil numpy
+  Optional: pyarrow (ToArrow)
+
+ Cassandra driver (Python) documentation: https://datastax.github.io/python-driver/index.html
+"""
+
+from cassandra.cluster import Cluster
+from cassandra.auth import PlainTextAuthProvider
+from CoverageGPS import FetchNodeICCIDs
+import argparse
+import csv
+import numpy
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "importer"))
+from monroeschema import load_registry, column_types, BUCKET_COLUMN, BUCKET_SECONDS
+
+try:
+	import pyarrow
+except ImportError:
+	pyarrow = None
+
+DEFAULT_SLICE = 3600
+NUMERIC_TYPES = ("int", "bigint", "smallint", "tinyint", "varint", "decimal", "double", "float", "timestamp", "counter")
+TEXT_TYPES = ("text", "varchar", "ascii")
+DIRECTIONS = ("backward", "forward", "nearest")
+
+
+###############################################################################
+# Batches: dicts of equally long NumPy arrays, one per column.
+def BatchLength(batch):
+	return len(next(iter(batch.values()))) if batch else 0
+
+def SliceBatch(batch, start, end):
+	return dict((column, values[start:end]) for (column, values) in batch.items())
+
+def ConcatBatches(batches):
+	batches = [b for b in batches if BatchLength(b) > 0]
+	if len(batches) == 0:
+		return {}
+	if len(batches) == 1:
+		return batches[0]
+	return dict((column, numpy.concatenate([b[column] for b in batches])) for column in batches[0])
+
+def ColumnArray(values, numeric):
+	if numeric:
+		return numpy.array([numpy.nan if v is None else float(v) for v in values], dtype = numpy.float64)
+	array = numpy.empty(len(values), dtype = object)
+	array[:] = values
+	return array
+
+def ToArrow(batch):
+	if pyarrow is None:
+		raise ImportError("ToArrow needs pyarrow (pip install pyarrow)")
+	columns = sorted(batch.keys())
+	return pyarrow.RecordBatch.from_arrays([pyarrow.array(batch[c]) for c in columns], columns)
+
+
+###############################################################################
+# Partition key columns a partition can be given by (see Partitions).
+PARTITION_COLUMNS = ("nodeid", "iccid", BUCKET_COLUMN)
+
+# Table side of a join: table, columns and partition, as found in the schema registry.
+class TableScan(object):
+	def __init__(self, registry, table, columns, bucketed = False):
+		info = registry['tables'][table]
+		self.types = column_types(registry, table)
+		self.timeColumn = info['time_column']
+		self.partitionKey = info['partition_key']
+		if (self.timeColumn is None) or (info['clustering_key'][:1] != [self.timeColumn]):
+			raise ValueError("{} cannot be read by time: its time column is not the first clustering column".format(table))
+		if [c for c in self.partitionKey if c not in PARTITION_COLUMNS]:
+			raise ValueError("{} cannot be read by node: its partition key is {}".format(table, ", ".join(self.partitionKey)))
+		# Iccid as a clustering column: rows of every ICCID are filtered apart.
+		self.iccidFilter = "iccid" in info['clustering_key']
+		self.byIccid = self.iccidFilter or ("iccid" in self.partitionKey)
+		self.columns = [self.timeColumn] + [c for c in columns if c != self.timeColumn]
+		for column in self.columns:
+			if column not in self.types:
+				raise ValueError("{} has no column {}".format(table, column))
+		# The day-bucketed table, if wanted and there is one (see db_schema.cql).
+		self.table = info['bucketed_table'] if bucketed and info['bucketed_table'] else table
+
+	# The columns converted to float64 (see ColumnArray), by their CQL type.
+	def NumericColumns(self):
+		return [c for c in self.columns if self.types[c] in NUMERIC_TYPES]
+
+	def Literal(self, column, value):
+		return "'{}'".format(str(value).replace("'", "''")) if self.types[column] in TEXT_TYPES else str(value)
+
+	def Query(self, partition, start, end):
+		where = ["{} = {}".format(column, self.Literal(column, partition[column])) for column in self.partitionKey if column != BUCKET_COLUMN]
+		if self.table.endswith("_daily"):
+			where.append("{} = {}".format(BUCKET_COLUMN, int(start) // BUCKET_SECONDS))
+		where.append("{} >= {} and {} < {}".format(self.timeColumn, start, self.timeColumn, end))
+		allowFiltering = ""
+		if self.iccidFilter and ("iccid" in partition):
+			# Filtered within the partition, after the time range.
+			where.append("iccid = {}".format(self.Literal("iccid", partition["iccid"])))
+			allowFiltering = " allow filtering"
+		return "select {} from {} where {}{}".format(", ".join(self.columns), self.table, " and ".join(where), allowFiltering)
+
+	#  Yields the rows of partition (a dict with the values of the partition key) in
+	# [startTime, endTime) as batches, one query per slice (slices never cross a day with the
+	# day-bucketed tables).
+	def Batches(self, session, partition, startTime, endTime, sliceSeconds = DEFAULT_SLICE):
+		numeric = [c in self.NumericColumns() for c in self.columns]
+		start = startTime
+		while start < endTime:
+			end = min(endTime, start + sliceSeconds)
+			if self.table.endswith("_daily"):
+				end = min(end, (int(start) // BUCKET_SECONDS + 1) * BUCKET_SECONDS)
+			query = self.Query(partition, start, end)
+			print query
+			rows = list(session.execute(query, timeout = None))
+			if len(rows) > 0:
+				yield dict((c, ColumnArray([row[i] for row in rows], numeric[i])) for (i, c) in enumerate(self.columns))
+			start = end
+
+
+###############################################################################
+#  Buffer of the right side of a join: pulls right batches while they can match the current left
+# batch and drops the rows no later left row can match.
+class RightBuffer(object):
+	def __init__(self, batches, timeColumn):
+		self.batches = iter(batches)
+		self.timeColumn = timeColumn
+		self.batch = {}
+		self.exhausted = False
+
+	def Times(self):
+		return self.batch[self.timeColumn] if self.batch else numpy.empty(0)
+
+	# Reads right rows until the buffer covers up to time (or the right side ends).
+	def FillUntil(self, time):
+		pending = [self.batch]
+		last = self.Times()[-1] if BatchLength(self.batch) > 0 else None
+		while not self.exhausted and (last is None or last < time):
+			batch = next(self.batches, None)
+			if batch is None:
+				self.exhausted = True
+			elif BatchLength(batch) > 0:
+				pending.append(batch)
+				last = batch[self.timeColumn][-1]
+		self.batch = ConcatBatches(pending)
+
+	# Drops the rows before time, keeping the last keepBefore of them.
+	def DropBefore(self, time, keepBefore = 0):
+		first = max(0, numpy.searchsorted(self.Times(), time, side = 'left') - keepBefore)
+		if first > 0:
+			self.batch = SliceBatch(self.batch, first, BatchLength(self.batch))
+
+
+# Prefix of the right columns: the last word of the right table (e.g. modem).
+def Prefix(table):
+	return table.split("_")[-1]
+
+def Prefixed(prefix, column):
+	return "{}_{}".format(prefix, column)
+
+def EmptyColumn(values, length):
+	if values.dtype == object:
+		return numpy.empty(length, dtype = object)
+	return numpy.full(length, numpy.nan)
+
+#  Yields the left batches with the columns of the matching right rows (see the module doc), both
+# sides sorted by time and from the same partitions.
+def AsOfJoin(left, right, leftTime, rightTime, rightColumns, prefix, tolerance = None, direction = "backward"):
+	if direction not in DIRECTIONS:
+		raise ValueError("direction must be one of {}".format(DIRECTIONS))
+	tolerance = numpy.inf if tolerance is None else tolerance
+	buffer = RightBuffer(right, rightTime)
+	for batch in left:
+		times = batch[leftTime]
+		if len(times) == 0:
+			continue
+		# Rows before the last one at or before the first left row can no longer match.
+		buffer.FillUntil(times[-1])
+		buffer.DropBefore(times[0], keepBefore = 0 if direction == "forward" else 1)
+		rightTimes = buffer.Times()
+		if len(rightTimes) == 0:
+			match = numpy.full(len(times), -1)
+		else:
+			before = numpy.searchsorted(rightTimes, times, side = 'right') - 1
+			after = numpy.searchsorted(rightTimes, times, side = 'left')
+			beforeOk = (before >= 0) & (times - rightTimes[before.clip(0)] <= tolerance)
+			afterOk = (after < len(rightTimes)) & (rightTimes[after.clip(0, len(rightTimes) - 1)] - times <= tolerance)
+			if direction == "backward":
+				match = numpy.where(beforeOk, before, -1)
+			elif direction == "forward":
+				match = numpy.where(afterOk, after, -1)
+			else:
+				beforeGap = numpy.where(beforeOk, times - rightTimes[before.clip(0)], numpy.inf)
+				afterGap = numpy.where(afterOk, rightTimes[after.clip(0, len(rightTimes) - 1)] - times, numpy.inf)
+				match = numpy.where(beforeGap <= afterGap, numpy.where(beforeOk, before, -1), after)
+		found = match >= 0
+		output = dict(batch)
+		for column in [rightTime] + [c for c in rightColumns if c != rightTime]:
+			if len(rightTimes) == 0:
+				output[Prefixed(prefix, column)] = numpy.full(len(times), numpy.nan)
+				continue
+			values = buffer.batch[column]
+			joined = EmptyColumn(values, len(times))
+			joined[found] = values[match[found]]
+			output[Prefixed(prefix, column)] = joined
+		yield output
+
+#  Yields the left batches with the count, mean, min and max of every right column (numeric, from
+# TableScan.NumericColumns, so every batch has the same columns) over the right rows in
+# [t - before, t + after] of every left row t.
+def WindowJoin(left, right, leftTime, rightTime, rightColumns, prefix, before, after):
+	buffer = RightBuffer(right, rightTime)
+	for batch in left:
+		times = batch[leftTime]
+		if len(times) == 0:
+			continue
+		buffer.FillUntil(times[-1] + after)
+		buffer.DropBefore(times[0] - before)
+		rightTimes = buffer.Times()
+		lo = numpy.searchsorted(rightTimes, times - before, side = 'left')
+		hi = numpy.searchsorted(rightTimes, times + after, side = 'right')
+		output = dict(batch)
+		output[Prefixed(prefix, "count")] = (hi - lo).astype(numpy.int64)
+		for column in rightColumns:
+			if column == rightTime:
+				continue
+			values = buffer.batch[column] if len(rightTimes) > 0 else numpy.empty(0)
+			(mean, low, high) = WindowStats(values.astype(numpy.float64), lo, hi)
+			output[Prefixed(prefix, column + "_mean")] = mean
+			output[Prefixed(prefix, column + "_min")] = low
+			output[Prefixed(prefix, column + "_max")] = high
+		yield output
+
+# Mean, min and max (ignoring NaN) of values[lo[i]:hi[i]] for every i, NaN for empty windows.
+def WindowStats(values, lo, hi):
+	valid = ~numpy.isnan(values)
+	sums = numpy.concatenate(([0.0], numpy.cumsum(numpy.where(valid, values, 0.0))))
+	counts = numpy.concatenate(([0], numpy.cumsum(valid)))
+	n = counts[hi] - counts[lo]
+	with numpy.errstate(invalid = 'ignore', divide = 'ignore'):
+		mean = numpy.where(n > 0, (sums[hi] - sums[lo]) / n, numpy.nan)
+	low = numpy.full(len(lo), numpy.nan)
+	high = numpy.full(len(lo), numpy.nan)
+	nonEmpty = numpy.flatnonzero(hi > lo)
+	if len(nonEmpty) > 0:
+		# reduceat over [lo, hi) pairs: the odd results span [hi, next lo) and are discarded.
+		padded = numpy.append(values, numpy.nan)
+		bounds = numpy.empty(2 * len(nonEmpty), dtype = numpy.intp)
+		bounds[0::2] = lo[nonEmpty]
+		bounds[1::2] = hi[nonEmpty]
+		low[nonEmpty] = numpy.fmin.reduceat(padded, bounds)[0::2]
+		high[nonEmpty] = numpy.fmax.reduceat(padded, bounds)[0::2]
+	return (mean, low, high)
+
+
+###############################################################################
+# Partitions of both tables for a node: per ICCID if either table is keyed by it.
+def Partitions(session, nodeID, left, right):
+	if left.byIccid or right.byIccid:
+		return [{"nodeid": nodeID, "iccid": iccid} for iccid in FetchNodeICCIDs(session, nodeID)]
+	return [{"nodeid": nodeID}]
+
+def Join(session, args, registry):
+	left = TableScan(registry, args.left[0], args.left[1:], args.bucketed)
+	right = TableScan(registry, args.right[0], args.right[1:], args.bucketed)
+	prefix = Prefix(args.right[0])
+	for partition in Partitions(session, str(args.nodeID), left, right):
+		leftBatches = left.Batches(session, partition, args.startTime, args.endTime, args.slice)
+		# The right side also covers the rows that can match the first and last left rows.
+		margin = args.tolerance if args.join == "asof" else max(args.before, args.after)
+		rightBatches = right.Batches(session, partition, args.startTime - margin, args.endTime + margin, args.slice)
+		if args.join == "asof":
+			joined = AsOfJoin(leftBatches, rightBatches, left.timeColumn, right.timeColumn, right.columns, prefix, args.tolerance, args.direction)
+		else:
+			joined = WindowJoin(leftBatches, rightBatches, left.timeColumn, right.timeColumn, right.NumericColumns(), prefix, args.before, args.after)
+		for batch in joined:
+			yield (partition, batch)
+
+
+###############################################################################
+def ParseCommandLine():
+	parser = argparse.ArgumentParser(description = "Time-aligned join of two MONROE tables")
+
+	parser.add_argument('-n', '--nodeID', help = 'ID of the node', required = True, type = int)
+	parser.add_argument('-s', '--startTime', help = 'Starting timestamp', required = True, type = int)
+	parser.add_argument('-e', '--endTime', help = 'Ending timestamp (+24 hours by default)', required = False, type = int, default = 0)
+	parser.add_argument('-l', '--left', help = 'Left table and its columns', required = True, nargs = '+')
+	parser.add_argument('-r', '--right', help = 'Right table and its columns', required = True, nargs = '+')
+	parser.add_argument('-j', '--join', help = 'Join type (default asof)', required = False, choices = ['asof', 'window'], default = 'asof')
+	parser.add_argument('-t', '--tolerance', help = 'As-of join: maximum seconds between matched rows (default 60)', required = False, type = float, default = 60)
+	parser.add_argument('-d', '--direction', help = 'As-of join direction (default backward)', required = False, choices = DIRECTIONS, default = 'backward')
+	parser.add_argument('-b', '--before', help = 'Window join: seconds before every left row (default 30)', required = False, type = float, default = 30)
+	parser.add_argument('-a', '--after', help = 'Window join: seconds after every left row (default 30)', required = False, type = float, default = 30)
+	parser.add_argument('--slice', help = 'Seconds of every query and batch (default 3600)', required = False, type = int, default = DEFAULT_SLICE)
+	parser.add_argument('--bucketed', help = 'Read the day-bucketed (_daily) tables when there are', required = False, action = 'store_true')
+	parser.add_argument('-o', '--output', help = 'CSV file of the joined rows (default none, only the summary)', required = False, type = str)
+
+	args = parser.parse_args()
+
+	# Validate args
+	if (args.endTime < args.startTime):
+		args.endTime = args.startTime + 3600*24
+	args.left = [c.lower() for c in args.left]
+	args.right = [c.lower() for c in args.right]
+
+	# Print parameters
+	print "Time join runs with the following parameters:"
+	print "NodeID: {} StartTime: {} EndTime: {}".format(args.nodeID, args.startTime, args.endTime)
+	print "Left: {} Right: {}".format(args.left, args.right)
+	print "Join: {} Tolerance: {} Direction: {} Before: {} After: {}".format(args.join, args.tolerance, args.direction, args.before, args.after)
+	print "Slice: {} Bucketed: {} Output: {}".format(args.slice, args.bucketed, args.output)
+
+	return args
+
+###############################################################################
+if __name__ == '__main__':
+	args = ParseCommandLine()
+	registry = load_registry()
+	for table in (args.left[0], args.right[0]):
+		if table not in registry['tables']:
+			print "Unknown table {}".format(table)
+			sys.exit(1)
+	try:
+		for side in (args.left, args.right):
+			TableScan(registry, side[0], side[1:], args.bucketed)
+	except ValueError as error:
+		print error
+		sys.exit(1)
+
+	# Connect to the DB
+	auth = PlainTextAuthProvider(username = "xxxx", password = "yyyy")
+	cluster = Cluster(contact_points = ['127.0.0.1'], port = 9042, auth_provider = auth)
+	session = None
+	session = cluster.connect("monroe") # Set default keyspace to 'monroe'
+	session.default_timeout = None
+	session.default_fetch_size = 1000
+
+	writer = None
+	rows = 0
+	matched = 0
+	# Rows with a match: a non-empty window, or a right time (as-of).
+	matchColumn = Prefixed(Prefix(args.right[0]), "count" if args.join == "window" else registry['tables'][args.right[0]]['time_column'])
+	for (partition, batch) in Join(session, args, registry):
+		columns = sorted(batch.keys())
+		if (args.output is not None) and (writer is None):
+			outFile = open(args.output, "wb")
+			writer = csv.writer(outFile)
+			writer.writerow(["partition"] + columns)
+		if writer is not None:
+			key = ":".join(str(partition[k]) for k in sorted(partition))
+			writer.writerows([key] + list(row) for row in zip(*[batch[c] for c in columns]))
+		rows += BatchLength(batch)
+		if args.join == "window":
+			matched += int(numpy.count_nonzero(batch[matchColumn]))
+		else:
+			matched += int(numpy.count_nonzero(~numpy.isnan(batch[matchColumn])))
+	if writer is not None:
+		outFile.close()
+
+	cluster.shutdown() # Closes connection to the DB and frees resources.
+
+	print "Joined {} rows, {} with a match{}".format(rows, matched, ", written to {}".format(args.output) if writer is not None else "")
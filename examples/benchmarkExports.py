@@ -0,0 +1,783 @@
+#!/usr/bin/python
+
+"""
+ Benchmarks of the exporters and KML tools of the MONROE project without a Cassandra cluster.
+  https://www.monroe-project.eu
+
+ The tools run unchanged against a FakeSession that answers their queries (execute, and
+  execute_async with fetch sizes and paging states, as the driver does) from rows held in memory:
+  - synthetic rows (default): one day of the tables for --nodes nodes from --nodeID, generated
+     from the column types of the schema registry (importer/monroeschema.py), as many rows as a
+     busy node writes (ROW_INTERVALS: one ping per second and ICCID, one modem status every 5 s,
+     two NMEA sentences per second, ...) times --scale, with moving positions, modem modes, etc.
+  - recorded fixtures (--fixtures DIR): the rows of every query as returned by the cluster,
+     saved once with --record (the benchmarks then run against the cluster) and replayed after.
+ The latency of the cluster can be simulated with --pageLatency (ms per page) and --rowLatency
+  (us per row), so that the overlap of fetching and processing (e.g. in PrefetchRows) shows.
+
+ Benchmarks (--benchmarks):
+  - csv: dailyCassandra2CSV.DumpOneDay of every table (--tables), for every fetch size
+     (--fetchSizes; 'adaptive' is the adaptive page size of PrefetchRows) and compression (--compress).
+  - parquet: the same rows and pages written to Parquet with pyarrow (DumpTableParquet), to
+     compare the writers (none, xz and zstd are the NONE, GZIP and ZSTD codecs).
+  - kml: GPS2KML.DumpPositions of the node.
+  - coverage: CoverageGPS as run from the command line: ICCIDs, GPS positions, modem statuses,
+     the NumPy as-of join of TraverseGPSAndModem and the KML file.
+  - timejoin: the as-of join of the modem statuses and GPS positions with TimeJoin (by slices).
+ Every case runs in its own process (fork), after the rows are loaded, so that its peak memory is
+  its own: the result has the wall and CPU seconds, queries, pages and rows read, bytes written and
+  the peak RSS of the process, and its growth during the case. With --profile every case also
+  writes the monroeprofile report of its stages (see importer/monroeprofile.py) to --outDir.
+  --json FILE saves the results to compare runs.
+
+ Usage: ./benchmarkExports.py -b csv parquet -t monroe_exp_ping monroe_meta_device_modem -f adaptive 100 5000 -c none zstd
+        ./benchmarkExports.py --fixtures /tmp/monroeFixtures --record -n 54 -s 1473897600 (once, against the cluster)
+        ./benchmarkExports.py --fixtures /tmp/monroeFixtures -n 54 -s 1473897600
+
+ Dependencies: sudo pip install cassandra-driver python-dateutil numpy
+  Optional: pyarrow (parquet), backports.lzma (--compress xz), zstandard (--compress zstd)
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+from multiprocessing import Pipe, Process
+from PartitionCache import RowClass
+from time import gmtime, strftime
+import argparse
+import cPickle
+import gzip
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+import dailyCassandra2CSV
+from dailyCassandra2CSV import TABLE_DUMPS, Compression, PrefetchRows
+from GPS2KML import DumpPositions
+from CoverageGPS import FetchNodeICCIDs, FetchPositions, FetchModemStatus, TraverseGPSAndModem, DumpKML
+from TimeJoin import Join, BatchLength, DEFAULT_SLICE
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "importer"))
+from monroeschema import load_registry, column_types, BUCKET_COLUMN
+from monroeprofile import Profiler
+
+try:
+	import pyarrow
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+DAY = 24*3600
+DEFAULT_START = 1473897600	# 2016-09-15 00:00 UTC
+BENCHMARKS = ["csv", "parquet", "kml", "coverage", "timejoin"]
+FIXTURE_EXTENSION = ".pkl.gz"
+PARQUET_BATCH_ROWS = 10000
+PARQUET_CODECS = {None: "NONE", "xz": "GZIP", "zstd": "ZSTD"}
+
+# Seconds between the rows of every partition (NodeId, plus Iccid etc. when in the key) of a busy node.
+ROW_INTERVALS = {
+	"monroe_exp_ping": 1,
+	"monroe_exp_udp_ping": 1,
+	"monroe_meta_device_gps": 0.5,	# GPRMC and GPGGA sentences every second.
+	"monroe_meta_device_modem": 5,
+	"monroe_meta_node_sensor": 10,
+	"monroe_meta_node_event": 600,
+	"monroe_exp_http": 300,
+	"monroe_exp_http_download": 300,
+	"monroe_exp_simple_traceroute": 60,
+	"monroe_exp_exhaustive_paris": 60,
+	"monroe_exp_nettest": 3600,
+	"monroe_exp_tstat_tcp_complete": 60,	# Per server address, KEY_VALUES['s_ip'].
+	"monroe_exp_tstat_tcp_nocomplete": 30,
+	"monroe_exp_tstat_udp_complete": 10,
+	"monroe_exp_tstat_http_complete": 20,
+}
+DEFAULT_ROW_INTERVAL = 60
+
+# Values of the partition key columns other than nodeid and iccid.
+KEY_VALUES = {
+	"s_ip": [u"216.58.201.{}".format(n) for n in range(4)],
+	"country": [u"es"],
+}
+
+OPERATORS = [u"voda ES", u"Orange", u"Telenor SE", u"Telia", u"TIM", u"Movistar"]
+START_POSITION = (40.3322, -3.7675)	# Leganes, Madrid.
+POOL_SIZES = [89, 97, 101, 103, 107, 109, 113]	# Distinct values of the other columns (primes, not in lockstep).
+
+GPS_COLUMNS = ["latitude", "longitude", "altitude"]
+MODEM_COLUMNS = ["devicemode", "devicesubmode", "rsrp", "rsrq", "rssi", "operator"]
+
+
+###############################################################################
+# Synthetic rows
+###############################################################################
+
+def ICCIDs(nodeID, count):
+	return [u"8934{:04d}{:012d}".format(nodeID % 10000, n) for n in range(count)]
+
+def TypedValue(cqlType, text):
+	return int(text) if cqlType in ("int", "bigint") else unicode(text)
+
+#  Returns a function of the row number giving the value of a column. Columns with a meaning of their
+# own (time, keys, positions, modem modes...) get realistic values, the others cycle through a pool
+# of random values of their type.
+def ColumnValues(rng, column, cqlType, partition, times, info):
+	if column in partition:
+		value = partition[column]
+		return lambda k: value
+	if column == info['time_column']:
+		return lambda k: times[k]
+	if column == "dataid":
+		value = info['data_id'].upper()
+		return lambda k: value
+	if column == "sequencenumber":
+		return lambda k: k + 1
+	if column == "iccid":
+		value = ICCIDs(int(partition.get('nodeid', 0)), 1)[0]
+		return lambda k: value
+	if column == "operator":
+		value = OPERATORS[hash(partition.get('iccid', partition.get('nodeid'))) % len(OPERATORS)]
+		return lambda k: value
+	if column == "nmeatype":
+		return lambda k: u"GPRMC" if k % 2 == 0 else u"GPGGA"
+	if column == "devicemode":
+		modes = [rng.choice([0, 1, 2, 3, 4, 5, 5, 5]) for n in range(64)]
+		return lambda k: modes[(k // 60) % len(modes)]	# Changes every 60 rows at most.
+	if column == "devicesubmode":
+		return lambda k: (k // 120) % 11
+	if column == "devicestate":
+		return lambda k: 3
+	pool = [RandomValue(rng, column, cqlType) for n in range(rng.choice(POOL_SIZES))]
+	return lambda k: pool[k % len(pool)]
+
+def RandomValue(rng, column, cqlType):
+	if cqlType in ("int", "smallint", "tinyint", "counter"):
+		return rng.randint(-140, 20000)
+	if cqlType in ("bigint", "varint"):
+		return rng.randint(0, 10**12)
+	if cqlType == "decimal":
+		return Decimal("{:.6f}".format(rng.uniform(0, 10000)))
+	if cqlType in ("double", "float"):
+		return rng.uniform(0, 1000)
+	if cqlType == "boolean":
+		return rng.random() < 0.5
+	if cqlType == "timestamp":
+		return datetime.utcfromtimestamp(rng.randint(1400000000, 1500000000))
+	if cqlType.startswith(("list<", "set<")):
+		values = [RandomValue(rng, column, cqlType[cqlType.index("<") + 1:-1]) for n in range(rng.randint(1, 8))]
+		return values if cqlType.startswith("list<") else set(values)
+	if cqlType.startswith("map<"):
+		return dict((u"{}{}".format(column, n), unicode(rng.randint(0, 1000))) for n in range(rng.randint(1, 4)))
+	return u"{}-{}".format(column, "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for n in range(rng.randint(4, 20))))
+
+#  Positions of a node moving around START_POSITION: (latitude, longitude, altitude, speed) of every
+# row, two rows per position as the GPRMC and GPGGA sentences of a second.
+def Track(rng, count):
+	(latitude, longitude) = START_POSITION
+	heading = rng.uniform(0, 2*math.pi)
+	track = []
+	for k in range(0, count, 2):
+		if rng.random() < 0.02:
+			heading += rng.uniform(-math.pi/2, math.pi/2)
+		speed = 30 + 20*math.sin(k / 600.0)	# Knots.
+		step = speed * 0.514 / 111320.0	# Degrees in a second.
+		latitude += step*math.cos(heading)
+		longitude += step*math.sin(heading) / math.cos(math.radians(latitude))
+		position = (Decimal("{:.6f}".format(latitude)), Decimal("{:.6f}".format(longitude)), Decimal("{:.1f}".format(650 + 10*math.sin(k / 900.0))), Decimal("{:.3f}".format(speed)))
+		track.extend([position, position])
+	return track[:count]
+
+def NMEA(row):
+	sentence = "GPRMC,{},A,{},{},{},{},{},,,,".format(strftime("%H%M%S", gmtime(float(row['timestamp']))),
+		abs(row['latitude']), "N" if row['latitude'] >= 0 else "S", abs(row['longitude']), "E" if row['longitude'] >= 0 else "W", row['speed'])
+	checksum = reduce(lambda a, b: a ^ b, map(ord, sentence), 0)
+	return u"${}*{:02X}\r\n".format(sentence, checksum)
+
+#  Rows of one table held like in Cassandra: sorted by time in every partition, partitions by
+# (values of the partition key).
+class FakeTable(object):
+	def __init__(self, registry, table):
+		self.table = table
+		self.info = registry['tables'][table]
+		self.types = column_types(registry, table)
+		self.columns = [column for (column, cqlType) in self.info['columns']]
+		self.rowClass = RowClass(self.columns)
+		self.partitionKey = [c for c in self.info['partition_key'] if c != BUCKET_COLUMN]
+		self.timeColumn = self.info['time_column']
+		self.partitions = {}	# (key values): (times as floats, rows)
+
+	def Add(self, key, rows):
+		if self.timeColumn is not None:
+			rows.sort(key = lambda row: getattr(row, self.timeColumn))
+			times = [float(getattr(row, self.timeColumn)) for row in rows]
+		else:
+			times = None
+		self.partitions[key] = (times, rows)
+
+	#  Generates the rows of every partition of the nodes in [startTime, startTime + days),
+	# ROW_INTERVALS / scale seconds apart.
+	def Generate(self, rng, nodeIDs, iccidCount, startTime, days, scale):
+		interval = ROW_INTERVALS.get(self.table, DEFAULT_ROW_INTERVAL) / scale
+		for nodeID in nodeIDs:
+			choices = []
+			for column in self.partitionKey:
+				if column == "nodeid":
+					choices.append([TypedValue(self.types[column], nodeID)])
+				elif column == "iccid":
+					choices.append(ICCIDs(nodeID, iccidCount))
+				elif column == "site":
+					choices.append([u"site-{}".format(nodeID)])
+				else:
+					choices.append(KEY_VALUES.get(column) or [RandomValue(rng, column, self.types[column])])
+			for key in itertools.product(*choices):
+				partition = dict(zip(self.partitionKey, key))
+				if self.timeColumn is None:
+					count = 1
+					times = []
+				else:
+					count = int(days*DAY / interval)
+					times = [Decimal("{:.6f}".format(startTime + (k + 0.5 + rng.uniform(-0.4, 0.4))*interval)) for k in range(count)]
+				values = [ColumnValues(rng, column, self.types[column], partition, times, self.info) for column in self.columns]
+				rows = [dict(zip(self.columns, [value(k) for value in values])) for k in range(count)]
+				if self.table == "devices":
+					for row in rows:
+						row['nodeid'] = nodeID
+						row['interfaces'] = ICCIDs(nodeID, iccidCount)
+				if "latitude" in self.columns and self.timeColumn is not None:
+					for (row, position) in zip(rows, Track(rng, count)):
+						row.update((c, v) for (c, v) in zip(("latitude", "longitude", "altitude", "speed"), position) if c in row)
+						if "nmea" in row:
+							row['nmea'] = NMEA(row)
+				self.Add(key, [self.rowClass(**row) for row in rows])
+
+	def Rows(self):
+		return sum(len(rows) for (times, rows) in self.partitions.values())
+
+
+###############################################################################
+# Queries
+###############################################################################
+
+QUERY = re.compile(r"^select\s+(?P<columns>.+?)\s+from\s+(?P<table>\w+)(?:\s+where\s+(?P<where>.+?))?(?P<order>\s+order\s+by\s+\w+(?:\s+(?:asc|desc))?)?(?:\s+allow\s+filtering)?\s*;?\s*$", re.I | re.S)
+CONDITION = re.compile(r"^(?P<column>\w+)\s*(?:(?P<op>>=|<=|=|<|>)\s*(?P<value>.+)|\s+in\s*\((?P<values>.*)\))$", re.I | re.S)
+OPERATORS_BY_NAME = {"=": lambda a, b: a == b, "<": lambda a, b: a < b, "<=": lambda a, b: a <= b, ">": lambda a, b: a > b, ">=": lambda a, b: a >= b}
+
+def ParseLiteral(text):
+	text = text.strip()
+	if text.startswith("'"):
+		return unicode(text[1:-1].replace("''", "'"))
+	return float(text) if ("." in text or "e" in text.lower()) else int(text)
+
+def SplitLiterals(text):
+	return [ParseLiteral(value) for value in re.findall(r"'(?:[^']|'')*'|[^,\s]+", text)]
+
+Select = namedtuple("Select", ["table", "columns", "conditions", "ordered"])
+
+# Parses the queries of the tools: select, where with =, in (), ranges, order by, allow filtering.
+def ParseQuery(query):
+	match = QUERY.match(query.strip())
+	if match is None:
+		raise ValueError("Unsupported query: {}".format(query))
+	columns = [c.strip().lower() for c in match.group('columns').split(",")]
+	conditions = []
+	where = match.group('where')
+	for text in (re.split(r"\s+and\s+", where, flags = re.I) if where else []):
+		condition = CONDITION.match(text.strip())
+		if condition is None:
+			raise ValueError("Unsupported condition {} in: {}".format(text, query))
+		if condition.group('values') is not None:
+			conditions.append((condition.group('column').lower(), "in", SplitLiterals(condition.group('values'))))
+		else:
+			conditions.append((condition.group('column').lower(), condition.group('op'), ParseLiteral(condition.group('value'))))
+	return Select(match.group('table').lower(), None if columns == ["*"] else columns, conditions, match.group('order') is not None)
+
+
+###############################################################################
+# Row sources of the FakeSession: Rows(query) returns the list of rows of a query.
+###############################################################################
+
+class SyntheticSource(object):
+	def __init__(self, registry, nodeIDs, iccidCount, startTime, days = 1, scale = 1.0, seed = 1):
+		self.registry = registry
+		self.nodeIDs = nodeIDs
+		self.iccidCount = iccidCount
+		self.startTime = startTime
+		self.days = days
+		self.scale = scale
+		self.seed = seed
+		self.tables = {}
+
+	# Returns the FakeTable of a table (or of the table it is the day bucket of), generating it once.
+	def Table(self, table):
+		info = self.registry['tables'].get(table)
+		if info is None:
+			raise ValueError("Unknown table {}".format(table))
+		table = info['bucket_of'] or table
+		if table not in self.tables:
+			fake = FakeTable(self.registry, table)
+			fake.Generate(random.Random("{}|{}".format(self.seed, table)), self.nodeIDs, self.iccidCount, self.startTime, self.days, self.scale)
+			self.tables[table] = fake
+		return self.tables[table]
+
+	def Rows(self, query):
+		select = ParseQuery(query)
+		fake = self.Table(select.table)
+		allowed = dict((column, None) for column in fake.partitionKey)
+		(low, high) = ((float("-inf"), bisect_left), (float("inf"), bisect_left))
+		filters = []
+		for (column, op, value) in select.conditions:
+			if column == BUCKET_COLUMN:
+				continue	# The time range is enough to select the rows of the day.
+			if column in allowed and op in ("=", "in"):
+				allowed[column] = set(value if op == "in" else [value])
+			elif column == fake.timeColumn and op in (">=", ">"):
+				low = (value, bisect_left if op == ">=" else bisect_right)
+			elif column == fake.timeColumn and op in ("<", "<="):
+				high = (value, bisect_left if op == "<" else bisect_right)
+			elif op == "in":
+				filters.append((fake.columns.index(column), lambda a, b: a in b, set(value)))
+			else:
+				filters.append((fake.columns.index(column), OPERATORS_BY_NAME[op], value))
+		rows = []
+		for key in sorted(fake.partitions):
+			if any((allowed[c] is not None) and (v not in allowed[c]) for (c, v) in zip(fake.partitionKey, key)):
+				continue
+			(times, partitionRows) = fake.partitions[key]
+			if times is not None:
+				partitionRows = partitionRows[low[1](times, low[0]):high[1](times, high[0])]
+			if filters:
+				partitionRows = [row for row in partitionRows if all(op(row[i], value) for (i, op, value) in filters)]
+			rows.extend(partitionRows)
+		if select.ordered and fake.timeColumn is not None:
+			rows.sort(key = lambda row: getattr(row, fake.timeColumn))	# Several partitions (iccid in (...)).
+		if select.columns is None:
+			return rows
+		indices = [fake.columns.index(column) for column in select.columns]
+		rowClass = RowClass(select.columns)
+		return [rowClass._make([row[i] for i in indices]) for row in rows]
+
+#  Rows recorded from the cluster, one file per query (gzipped pickle of the query, columns and
+# values). With a session, the queries without a fixture are run on it and recorded.
+class FixtureSource(object):
+	def __init__(self, directory, session = None):
+		self.directory = directory
+		self.session = session
+		self.fixtures = {}
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		for name in sorted(os.listdir(directory)):
+			if name.endswith(FIXTURE_EXTENSION):
+				with gzip.open(os.path.join(directory, name), "rb") as f:
+					(query, columns, values) = cPickle.load(f)
+				rowClass = RowClass(columns)
+				self.fixtures[query] = [rowClass._make(row) for row in values]
+
+	def Path(self, query):
+		return os.path.join(self.directory, "{}_{}{}".format(ParseQuery(query).table, hashlib.sha1(query).hexdigest()[:16], FIXTURE_EXTENSION))
+
+	def Rows(self, query):
+		rows = self.fixtures.get(query)
+		if rows is not None:
+			return rows
+		if self.session is None:
+			raise KeyError("No fixture for query (record it with --record): {}".format(query))
+		rows = list(self.session.execute(query, timeout = None))
+		columns = rows[0]._fields if len(rows) > 0 else ()
+		(fd, tempPath) = tempfile.mkstemp(dir = self.directory, suffix = ".tmp")
+		os.close(fd)
+		with gzip.open(tempPath, "wb") as f:
+			cPickle.dump((query, list(columns), [tuple(row) for row in rows]), f, cPickle.HIGHEST_PROTOCOL)
+		os.rename(tempPath, self.Path(query))
+		self.fixtures[query] = rows
+		return rows
+
+
+###############################################################################
+# Fake session
+###############################################################################
+
+class FakePage(object):
+	def __init__(self, rows, start, fetchSize):
+		end = len(rows) if not fetchSize else min(len(rows), start + fetchSize)
+		self.current_rows = rows[start:end]
+		self.has_more_pages = end < len(rows)
+		self.paging_state = end if self.has_more_pages else None
+
+class FakeFuture(object):
+	def __init__(self, page, readyAt):
+		self.page = page
+		self.readyAt = readyAt
+
+	def result(self):
+		wait = self.readyAt - time.time()
+		if wait > 0:
+			time.sleep(wait)
+		return self.page
+
+#  Session answering the queries from a source. Pages are ready pageLatency + rows*rowLatency
+# seconds after their request, so asynchronous requests overlap with the caller's work.
+class FakeSession(object):
+	def __init__(self, source, pageLatency = 0, rowLatency = 0):
+		self.source = source
+		self.pageLatency = pageLatency
+		self.rowLatency = rowLatency
+		self.default_fetch_size = 5000
+		self.default_timeout = None
+		self.lastQuery = None
+		self.lastRows = None
+		self.queries = 0
+		self.pages = 0
+		self.rows = 0
+
+	def Rows(self, query):
+		if query != self.lastQuery:	# Pages of the same query do not run it again.
+			self.lastRows = self.source.Rows(query)
+			self.lastQuery = query
+			self.queries += 1
+		return self.lastRows
+
+	def Latency(self, pages, rows):
+		return pages*self.pageLatency + rows*self.rowLatency
+
+	def execute(self, query, timeout = None):
+		query = getattr(query, "query_string", query)
+		rows = self.Rows(query)
+		pages = int(math.ceil(len(rows) / float(self.default_fetch_size))) if self.default_fetch_size else 1
+		latency = self.Latency(max(1, pages), len(rows))
+		if latency > 0:
+			time.sleep(latency)
+		self.pages += max(1, pages)
+		self.rows += len(rows)
+		return list(rows)
+
+	def execute_async(self, statement, timeout = None, paging_state = None):
+		query = getattr(statement, "query_string", statement)
+		fetchSize = getattr(statement, "fetch_size", None) or self.default_fetch_size
+		page = FakePage(self.Rows(query), paging_state or 0, fetchSize)
+		self.pages += 1
+		self.rows += len(page.current_rows)
+		return FakeFuture(page, time.time() + self.Latency(1, len(page.current_rows)))
+
+
+###############################################################################
+# Parquet writer
+###############################################################################
+
+def ArrowType(cqlType):
+	if cqlType in ("int", "smallint", "tinyint"):
+		return pyarrow.int32()
+	if cqlType in ("bigint", "varint", "counter"):
+		return pyarrow.int64()
+	if cqlType in ("decimal", "double"):
+		return pyarrow.float64()
+	if cqlType == "float":
+		return pyarrow.float32()
+	if cqlType == "boolean":
+		return pyarrow.bool_()
+	if cqlType.startswith(("list<", "set<")):
+		return pyarrow.list_(ArrowType(cqlType[cqlType.index("<") + 1:-1]))
+	return pyarrow.string()	# Text, and maps and timestamps as text.
+
+def ArrowValue(value, cqlType):
+	if value is None:
+		return None
+	if cqlType == "decimal":
+		return float(value)
+	if cqlType.startswith("set<"):
+		return sorted(value)
+	if cqlType.startswith("map<") or cqlType == "timestamp":
+		return unicode(value)
+	return value
+
+def Batched(rows, size):
+	rows = iter(rows)
+	while True:
+		batch = list(itertools.islice(rows, size))
+		if len(batch) == 0:
+			break
+		yield batch
+
+#  Dumps one table for [startTime, endTime) to a Parquet file, with the query and pages of DumpTable,
+# in row groups of batchRows rows. Returns the number of rows written.
+def DumpTableParquet(session, startTime, endTime, dump, registry, compression = None, batchRows = PARQUET_BATCH_ROWS):
+	profiler = dailyCassandra2CSV.profiler
+	fileName = dailyCassandra2CSV.FileNamePrefix(startTime) + "{}_{}.parquet".format(startTime, dump.table)
+	types = column_types(registry, dump.table)
+	query = "select * from {} where {} >= {} and {} < {}{}".format(dump.table, dump.timeColumn, startTime, dump.timeColumn, endTime, " allow filtering" if dump.allowFiltering else "")
+	print query
+	writer = None
+	count = 0
+	with profiler.file(fileName):
+		for rows in Batched(PrefetchRows(session, query), batchRows):
+			with profiler.stage("format"):
+				columns = rows[0]._fields
+				if writer is None:
+					schema = pyarrow.schema([pyarrow.field(c, ArrowType(types[c])) for c in columns])
+					writer = pyarrow.parquet.ParquetWriter(fileName, schema, compression = PARQUET_CODECS[compression.method if compression else None])
+				arrays = [pyarrow.array([ArrowValue(row[i], types[c]) for row in rows], type = schema.field(c).type) for (i, c) in enumerate(columns)]
+				table = pyarrow.Table.from_arrays(arrays, schema = schema)
+			with profiler.stage("write"):
+				writer.write_table(table)
+			count += len(rows)
+		if writer is not None:
+			writer.close()
+	print "Dumped {} rows to {}\n".format(count, fileName)
+	return count
+
+
+###############################################################################
+# Cases
+###############################################################################
+
+Case = namedtuple("Case", ["name", "benchmark", "table", "fetchSize", "compression"])
+
+def Cases(args):
+	cases = []
+	for benchmark in args.benchmarks:
+		if benchmark in ("csv", "parquet"):
+			for (table, fetchSize, compression) in itertools.product(args.tables, args.fetchSizes, args.compressions):
+				name = "{} {} fetch={} compress={}".format(benchmark, table, fetchSize or "adaptive", compression.method if compression else "none")
+				cases.append(Case(name, benchmark, table, fetchSize, compression))
+		else:
+			cases.append(Case("{} node={}".format(benchmark, args.nodeID), benchmark, None, None, None))
+	return cases
+
+# Tables read by the cases, to load their rows before the cases run.
+def CaseTables(cases):
+	tables = set()
+	for case in cases:
+		if case.table is not None:
+			tables.add(case.table)
+		elif case.benchmark == "kml":
+			tables.add("monroe_meta_device_gps")
+		else:
+			tables.update(["devices", "monroe_meta_device_gps", "monroe_meta_device_modem"])
+	return sorted(tables)
+
+def SetFetchSize(fetchSize):
+	if fetchSize is None:
+		(initial, low, high) = FETCH_SIZES
+	else:
+		(initial, low, high) = (fetchSize, fetchSize, fetchSize)
+	dailyCassandra2CSV.INITIAL_FETCH_SIZE = initial
+	dailyCassandra2CSV.MIN_FETCH_SIZE = low
+	dailyCassandra2CSV.MAX_FETCH_SIZE = high
+
+FETCH_SIZES = (dailyCassandra2CSV.INITIAL_FETCH_SIZE, dailyCassandra2CSV.MIN_FETCH_SIZE, dailyCassandra2CSV.MAX_FETCH_SIZE)
+
+def RunBenchmark(session, case, args, registry):
+	startTime = args.startTime
+	endTime = startTime + DAY
+	if case.benchmark == "csv":
+		dailyCassandra2CSV.DumpOneDay(session, 1, [case.table], case.compression)
+	elif case.benchmark == "parquet":
+		dump = [d for d in TABLE_DUMPS if d.table == case.table][0]
+		DumpTableParquet(session, startTime, endTime, dump, registry, case.compression)
+	elif case.benchmark == "kml":
+		DumpPositions(session, startTime, endTime, args.nodeID)
+	elif case.benchmark == "coverage":
+		iccids = FetchNodeICCIDs(session, args.nodeID)
+		gps = FetchPositions(session, startTime, endTime, args.nodeID)
+		modem = FetchModemStatus(session, startTime, endTime, args.nodeID, iccids, None)
+		DumpKML(args.nodeID, startTime, endTime, TraverseGPSAndModem(gps, modem, args.minGPSInterval))
+	else:
+		joinArgs = argparse.Namespace(nodeID = args.nodeID, startTime = startTime, endTime = endTime,
+			left = ["monroe_meta_device_modem"] + MODEM_COLUMNS, right = ["monroe_meta_device_gps"] + GPS_COLUMNS,
+			join = "asof", tolerance = 60, direction = "backward", before = 0, after = 0, slice = DEFAULT_SLICE, bucketed = False)
+		count = 0
+		for (partition, batch) in Join(session, joinArgs, registry):
+			count += BatchLength(batch)
+		print "Joined {} rows\n".format(count)
+
+def DirectoryBytes(directory):
+	return sum(os.path.getsize(os.path.join(root, name)) for (root, dirs, names) in os.walk(directory) for name in names)
+
+def MaxRSS():
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+#  Runs a case in the current process, writing its files to caseDir, and returns its result. The
+# dump files of dailyCassandra2CSV go to the current directory, for the day of args.startTime.
+def RunCase(session, case, caseDir, args, registry):
+	os.makedirs(caseDir)
+	os.chdir(caseDir)
+	dailyCassandra2CSV.FileNamePrefix = lambda startTime: "{}_".format(strftime("%Y-%m-%d", gmtime(startTime)))
+	dailyCassandra2CSV.CalcDumpTimes = lambda daysBack: (args.startTime, args.startTime + DAY)
+	SetFetchSize(case.fetchSize)
+	if args.profile:
+		dailyCassandra2CSV.profiler = Profiler("{} {}".format(os.path.basename(__file__), case.name))
+	(queries, pages, rows) = (session.queries, session.pages, session.rows)
+	baseRSS = MaxRSS()
+	started = time.time()
+	cpuStarted = sum(os.times()[:2])
+	with dailyCassandra2CSV.profiler.file(case.name):
+		RunBenchmark(session, case, args, registry)
+	result = {
+		'case': case.name,
+		'seconds': time.time() - started,
+		'cpuSeconds': sum(os.times()[:2]) - cpuStarted,
+		'queries': session.queries - queries,
+		'pages': session.pages - pages,
+		'rows': session.rows - rows,
+		'outputBytes': DirectoryBytes(caseDir),
+		'maxRSSKB': MaxRSS(),
+		'rssGrowthKB': MaxRSS() - baseRSS,
+	}
+	if args.profile:
+		profilePath = os.path.join(args.outDir, "{}.profile.json".format(os.path.basename(caseDir)))
+		dailyCassandra2CSV.profiler.write(profilePath)
+		result['profile'] = profilePath
+	return result
+
+def ForkedCase(connection, session, case, caseDir, args, registry):
+	try:
+		connection.send(RunCase(session, case, caseDir, args, registry))
+	except Exception:
+		connection.send({'case': case.name, 'error': traceback.format_exc()})
+	connection.close()
+
+#  Runs every case in a child process (in this one when recording, as the connection to the cluster
+# cannot be used after a fork) and returns the results.
+def RunCases(session, cases, args, registry):
+	results = []
+	directory = os.getcwd()
+	for (index, case) in enumerate(cases):
+		caseDir = os.path.join(args.outDir, "{:03d}_{}".format(index, re.sub(r"[^\w=.-]+", "_", case.name)))
+		print "\n=== {} ===".format(case.name)
+		if args.record:
+			try:
+				result = RunCase(session, case, caseDir, args, registry)
+			except Exception:
+				result = {'case': case.name, 'error': traceback.format_exc()}
+			os.chdir(directory)
+		else:
+			(parentEnd, childEnd) = Pipe(duplex = False)
+			child = Process(target = ForkedCase, args = (childEnd, session, case, caseDir, args, registry))
+			child.start()
+			childEnd.close()
+			try:
+				result = parentEnd.recv()
+			except EOFError:
+				result = {'case': case.name, 'error': "Process exited with code {}".format(child.exitcode)}
+			child.join()
+		if not args.keep:
+			shutil.rmtree(caseDir, ignore_errors = True)
+		results.append(result)
+	return results
+
+def PrintResults(results):
+	print "\n{:<64} {:>9} {:>9} {:>8} {:>9} {:>12} {:>10} {:>10}".format("Case", "Seconds", "CPU", "Pages", "Rows", "Output", "Peak KB", "Growth KB")
+	for result in results:
+		if 'error' in result:
+			print "{:<64} ERROR".format(result['case'])
+			print result['error']
+			continue
+		print "{:<64} {:>9.2f} {:>9.2f} {:>8} {:>9} {:>12} {:>10} {:>10}".format(result['case'], result['seconds'], result['cpuSeconds'],
+			result['pages'], result['rows'], result['outputBytes'], result['maxRSSKB'], result['rssGrowthKB'])
+
+
+###############################################################################
+def ParseFetchSize(text):
+	return None if text == "adaptive" else int(text)
+
+def ParseCommandLine():
+	tableNames = [dump.table for dump in TABLE_DUMPS]
+	parser = argparse.ArgumentParser(description = "Benchmarks of the MONROE exporters and KML tools on synthetic or recorded rows")
+
+	parser.add_argument('-b', '--benchmarks', help = 'Benchmarks to run (default all)', required = False, nargs = '+', choices = BENCHMARKS, default = BENCHMARKS)
+	parser.add_argument('-t', '--tables', help = 'Tables of the csv and parquet benchmarks (default all)', required = False, nargs = '+', choices = tableNames, default = tableNames)
+	parser.add_argument('-f', '--fetchSizes', help = 'Fetch sizes of the csv and parquet benchmarks: adaptive or rows per page (default adaptive)', required = False, nargs = '+', type = ParseFetchSize, default = [None])
+	parser.add_argument('-c', '--compress', help = 'Compressions of the csv and parquet benchmarks (default none)', required = False, nargs = '+', choices = ['none', 'xz', 'zstd'], default = ['none'])
+	parser.add_argument('-n', '--nodeID', help = 'Node of the kml, coverage and timejoin benchmarks, and first synthetic node (default 54)', required = False, type = int, default = 54)
+	parser.add_argument('-s', '--startTime', help = 'Start of the day read (default {}, 2016-09-15)'.format(DEFAULT_START), required = False, type = int, default = DEFAULT_START)
+	parser.add_argument('--nodes', help = 'Synthetic nodes (default 1)', required = False, type = int, default = 1)
+	parser.add_argument('--iccids', help = 'Synthetic ICCIDs per node (default 3)', required = False, type = int, default = 3)
+	parser.add_argument('--scale', help = 'Factor of the synthetic rows per day (default 1.0)', required = False, type = float, default = 1.0)
+	parser.add_argument('--seed', help = 'Seed of the synthetic rows (default 1)', required = False, type = int, default = 1)
+	parser.add_argument('--fixtures', help = 'Directory of recorded rows to replay instead of synthetic rows', required = False, type = str)
+	parser.add_argument('--record', help = 'Run against the cluster and record the rows of every query into --fixtures', required = False, action = 'store_true')
+	parser.add_argument('--pageLatency', help = 'Simulated latency of every page, in ms (default 0)', required = False, type = float, default = 0)
+	parser.add_argument('--rowLatency', help = 'Simulated latency of every row, in us (default 0)', required = False, type = float, default = 0)
+	parser.add_argument('-i', '--minGPSInterval', help = 'minGPSInterval of the coverage benchmark (default 0)', required = False, type = int, default = 0)
+	parser.add_argument('-o', '--outDir', help = 'Directory of the written files and profiles (default a temporary one, removed at the end)', required = False, type = str)
+	parser.add_argument('--keep', help = 'Keep the files written by every case', required = False, action = 'store_true')
+	parser.add_argument('--profile', help = 'Write the monroeprofile report of every case to --outDir', required = False, action = 'store_true')
+	parser.add_argument('--json', help = 'Write the results to this file as JSON', required = False, type = str)
+
+	args = parser.parse_args()
+
+	# Validate args
+	if args.record and not args.fixtures:
+		parser.error("--record needs --fixtures")
+	if "xz" in args.compress and dailyCassandra2CSV.lzma is None:
+		parser.error("--compress xz needs backports.lzma (sudo pip install backports.lzma)")
+	if "zstd" in args.compress and dailyCassandra2CSV.zstandard is None:
+		parser.error("--compress zstd needs zstandard (sudo pip install zstandard)")
+	if "parquet" in args.benchmarks and pyarrow is None:
+		print "pyarrow is not installed: skipping the parquet benchmark"
+		args.benchmarks = [b for b in args.benchmarks if b != "parquet"]
+	args.compressions = [None if method == "none" else Compression(method, 6 if method == "xz" else 3, 2) for method in args.compress]
+	args.temporaryOutDir = args.outDir is None
+	if args.outDir is None:
+		args.outDir = tempfile.mkdtemp(prefix = "benchmarkExports.")
+	elif not os.path.isdir(args.outDir):
+		os.makedirs(args.outDir)
+	args.outDir = os.path.abspath(args.outDir)
+
+	# Print parameters
+	print "Benchmarks run with the following parameters:"
+	print "Benchmarks: {} Tables: {}".format(args.benchmarks, args.tables)
+	print "FetchSizes: {} Compress: {}".format([f or "adaptive" for f in args.fetchSizes], args.compress)
+	print "NodeID: {} StartTime: {} Nodes: {} ICCIDs: {} Scale: {} Seed: {}".format(args.nodeID, args.startTime, args.nodes, args.iccids, args.scale, args.seed)
+	print "Fixtures: {} Record: {} PageLatency: {} ms RowLatency: {} us".format(args.fixtures, args.record, args.pageLatency, args.rowLatency)
+	print "OutDir: {} Keep: {} Profile: {} JSON: {}".format(args.outDir, args.keep, args.profile, args.json)
+
+	return args
+
+###############################################################################
+if __name__ == '__main__':
+	args = ParseCommandLine()
+	registry = load_registry()
+	cases = Cases(args)
+
+	cluster = None
+	if args.fixtures:
+		if args.record:
+			(cluster, liveSession) = dailyCassandra2CSV.Connect()
+			source = FixtureSource(args.fixtures, liveSession)
+		else:
+			source = FixtureSource(args.fixtures)
+		print "Loaded {} recorded queries from {}".format(len(source.fixtures), args.fixtures)
+	else:
+		source = SyntheticSource(registry, range(args.nodeID, args.nodeID + args.nodes), args.iccids, args.startTime, 1, args.scale, args.seed)
+		started = time.time()
+		for table in CaseTables(cases):
+			print "Generated {} rows of {}".format(source.Table(table).Rows(), table)
+		print "Generated in {:.1f} s".format(time.time() - started)
+	session = FakeSession(source, args.pageLatency / 1000.0, args.rowLatency / 1000000.0)
+
+	try:
+		results = RunCases(session, cases, args, registry)
+	finally:
+		if cluster is not None:
+			cluster.shutdown() # Closes connection to the DB and frees resources.
+		if args.temporaryOutDir and not args.keep and not args.profile:
+			shutil.rmtree(args.outDir, ignore_errors = True)
+
+	PrintResults(results)
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump({'parameters': dict((k, v) for (k, v) in vars(args).items() if k != 'compressions'), 'results': results}, f, indent = 1, sort_keys = True)
+		print "\nResults written to {}".format(args.json)
+
+	print "BENCHMARKS FINISHED.\n"
@@ -6,25 +6,94 @@
   Creator: Miguel Peon Quiros, IMDEA Networks Institute
   mikepeon@imdea.org
 
- The method shown here is the easiest, but the least efficient because it runs in a single
-  thread and stops to fetch the next page of rows. More efficient options are asynchronous
-  retrieval of rows (in parallel with the processing of the previous page), multithreading
-  or multiprocessing (e.g., one process per query).
+ Rows are read with PrefetchRows: the next page of rows is requested asynchronously
+  (execute_async with the paging state of the current page) before the current page is
+  formatted and written, so the wait for the network overlaps with the processing of the
+  previous page. The page size adapts to the width of the rows of each table.
 
  One connection per process. If using fork(), remember not to reuse the same connection from the
   child process.
 
+ Without arguments the previous day is dumped. With --startDate/--endDate a range of days is
+  backfilled, running one job per day and table on a pool of processes, e.g.:
+   ./dailyCassandra2CSV.py -s 2017-01-01 -e 2017-03-31 -t monroe_exp_ping monroe_meta_device_modem -p 8 -q 3
+
+ Files can be written directly into a compressed stream (--compress xz or zstd). Compression
+  runs on a background thread fed with large buffered chunks, so it overlaps with fetching,
+  and zstd can use several worker threads of its own (--compressThreads).
+
+ With --bucketed the tables with a day-bucketed variant (<table>_daily) are read from it, one
+  query per day; this is required once the importer runs with --buckets only.
+
+ With --profile FILE the fetch, format, write and compress stages are profiled (cProfile) and the
+  time and memory of every dumped file recorded, and the report is written to FILE as JSON (see
+  importer/monroeprofile.py). In backfill mode every process writes its own FILE.<pid>.
+
  Dependencies: sudo pip install cassandra-driver python-dateutil
+  Optional: backports.lzma (--compress xz), zstandard (--compress zstd)
 
  Cassandra driver (Python) documentation: https://datastax.github.io/python-driver/index.html
 """
 
 from cassandra.cluster import Cluster
 from cassandra.auth import PlainTextAuthProvider
-from time import struct_time, strftime, gmtime
-from datetime import datetime
+from cassandra.query import SimpleStatement
+from time import struct_time, strftime, gmtime, sleep
+from datetime import datetime, timedelta
 from calendar import timegm
+from collections import namedtuple
 from dateutil.relativedelta import relativedelta
+from multiprocessing import Pool, BoundedSemaphore
+from threading import Thread
+from Queue import Queue
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "importer"))
+from monroeprofile import Profiler, NullProfiler
+from PartitionCache import DayQueries
+
+#  The xz streams need the API of the Python 3 lzma module (backports.lzma on Python 2). On Python 2
+# "import lzma" may find pyliblzma (python-lzma, used by the importer) instead, whose compressor
+# takes no preset, so it is only used if it has that API.
+try:
+	from backports import lzma
+except ImportError:
+	try:
+		import lzma
+	except ImportError:
+		lzma = None
+if (lzma is not None) and not hasattr(lzma, "FORMAT_XZ"):
+	lzma = None
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+DB_HOSTS = ['127.0.0.1']
+DB_KEYSPACE = "monroe"
+DB_USER = "xxxx"
+DB_PASSWORD = "yyy"
+RETRY_DELAY = 30	# Seconds to wait before retrying a failed backfill job (times the attempt number).
+
+# Page sizes are chosen so that every page holds about TARGET_PAGE_BYTES of row data.
+INITIAL_FETCH_SIZE = 100	# Rows in the first page, before the row width is known.
+MIN_FETCH_SIZE = 10
+MAX_FETCH_SIZE = 5000
+TARGET_PAGE_BYTES = 1 << 20
+ROW_WIDTH_SAMPLES = 8	# Rows of every page used to estimate the row width.
+
+# Compressed output is handed to the compression thread in chunks of WRITE_BUFFER_BYTES.
+WRITE_BUFFER_BYTES = 1 << 20
+WRITE_QUEUE_CHUNKS = 8	# Chunks waiting to be compressed before the writer blocks.
+COMPRESSED_EXTENSIONS = {"xz": ".xz", "zstd": ".zst"}
+
+# Per-stage profiler (--profile); a NullProfiler records nothing.
+profiler = NullProfiler()
+
+Compression = namedtuple("Compression", ["method", "level", "threads"])
+TableDump = namedtuple("TableDump", ["table", "header", "timeColumn", "allowFiltering", "formatRow"])
 
 def FileNamePrefix(startTime):
 	# Returns a date-stamped file name prefix including path.
@@ -41,250 +110,399 @@ def FormatDate():
 	return "[{} (UTC)] --".format(datetime.utcnow())
 
 
-def DumpOneDay(session, daysBack):
+###############################################################################
+# Returns the average width in bytes of (a sample of) the rows of a page, or None for an empty page.
+def EstimateRowBytes(rows):
+	sample = rows[:ROW_WIDTH_SAMPLES]
+	if len(sample) == 0:
+		return None
+	total = 0
+	for row in sample:
+		for value in row:
+			total += len(value) if isinstance(value, basestring) else len(str(value))
+	return max(1, total // len(sample))
+
+def AdaptFetchSize(rowBytes, fetchSize):
+	if rowBytes is None:
+		return fetchSize
+	return max(MIN_FETCH_SIZE, min(MAX_FETCH_SIZE, TARGET_PAGE_BYTES // rowBytes))
+
+###############################################################################
+#  Yields the rows returned by query, page by page. Page N+1 is requested (execute_async with
+# the paging_state of page N) before the rows of page N are handed to the caller, so fetching
+# and formatting overlap. The size of each page is adapted to the row width of the previous one.
+#  The first page has INITIAL_FETCH_SIZE rows unless fetchSize is given (read at call time, so that
+# the fetch sizes can be changed, e.g. by benchmarkExports.py).
+def PrefetchRows(session, query, fetchSize = None):
+	if fetchSize is None:
+		fetchSize = INITIAL_FETCH_SIZE
+	future = session.execute_async(SimpleStatement(query, fetch_size = fetchSize), timeout = None)
+	while future is not None:
+		with profiler.stage("fetch"):
+			result = future.result()
+		rows = result.current_rows
+		fetchSize = AdaptFetchSize(EstimateRowBytes(rows), fetchSize)
+		if result.has_more_pages:
+			future = session.execute_async(SimpleStatement(query, fetch_size = fetchSize), timeout = None, paging_state = result.paging_state)
+		else:
+			future = None
+		for row in rows:
+			yield row
+
+
+########## monroe_exp_ping ###############
+def FormatExpPing(row):
+	return "{},{},{},{},{},{},{},{},{},{},{}\n".format(row.nodeid, row.iccid, row.timestamp, row.sequencenumber, row.bytes, row.dataid, row.dataversion, row.guid, row.host, row.operator.encode('latin-1'), row.rtt)
+
+########## monroe_exp_http_download ###############
+def FormatExpHttpDownload(row):
+	return "{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(row.nodeid, row.iccid, row.timestamp, row.sequencenumber, row.bytes, row.dataid, row.dataversion, row.downloadtime, row.guid, row.host, row.operator, row.port, row.setuptime, row.speed, row.totaltime, row.errorcode, row.url)
+
+########## monroe_meta_device_gps ###############
+def FormatMetaDeviceGps(row):
+	nmea = row.nmea.replace("\r","\\r").replace("\n","\\n") if row.nmea is not None else ""
+	return '{},{},{},{},{},{},{},{},{},"{}",{},{},{}\n'.format(row.nodeid, row.timestamp, row.sequencenumber, row.altitude, row.dataid, row.dataversion, row.fixquality, row.latitude, row.longitude, nmea, row.nmeatype, row.satellitecount, row.speed)
+
+########## monroe_meta_device_modem ###############
+def FormatMetaDeviceModem(row):
+	return "{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(row.nodeid, row.iccid, row.timestamp, row.sequencenumber, row.band, row.cid, row.dataid, row.dataversion, row.devicemode, row.devicestate, row.devicesubmode, row.ecio, row.enodebid, row.frequency, row.imei, row.imsi, row.imsimccmnc, row.interfacename, row.internalinterface, row.internalipaddress, row.ipaddress, row.lac, row.mccmnc, row.nwmccmnc, row.operator.encode('latin-1'), row.pci, row.rscp, row.rsrp, row.rsrq, row.rssi)
+
+########## monroe_meta_node_event ###############
+def FormatMetaNodeEvent(row):
+	return '{},{},{},{},{},{},"{}",{},{}\n'.format(row.nodeid, row.sequencenumber, row.timestamp, row.dataid, row.dataversion, row.eventtype, row.message, row.user, row.id)
+
+########## monroe_meta_node_sensor ###############
+def FormatMetaNodeSensor(row):
+	return '{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(row.nodeid, row.timestamp, row.sequencenumber, row.apps, row.cpu, row.current, row.dataid, row.dataversion, row.dlb, row.free, row.guest, row.id, row.idle, row.iowait, row.irq, row.modems, row.nice, row.percent, row.running, row.softirq, row.start, row.steal, row.swap, row.system, row.total, row.usb0, row.usb0charging, row.usb1, row.usb1charging, row.usb2, row.usb2charging, row.usbmonitor, row.user)
+
+########## monroe_exp_simple_traceroute ###############
+def FormatExpSimpleTraceroute(row):
+	return '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(row.nodeid, row.timestamp, row.endtime, row.dataid, row.dataversion, row.containertimestamp, row.hop, row.targetdomainname, row.interfacename, row.ipdst, row.numberofhops, row.sizeofprobes, row.ip, row.hopname, row.rttsection, row.annotationsection)
+
+########## monroe_exp_exhaustive_paris ###############
+def FormatExpExhaustiveParis(row):
+	return '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(row.nodeid, row.timestamp, row.endtime, row.dataid, row.dataversion, row.containertimestamp, row.hop, row.targetdomainname, row.interfacename, row.ipdst, row.portdst, row.ipsrc, row.portsrc, row.ip, row.proto, row.algorithm, row.duration, row.minhoprtt, row.medianhoprtt, row.maxhoprtt, row.stdhoprtt, row.annotation, row.flowids, row.mpls, row.transmittedprobes, row.successfulprobes)
+
+########## monroe_exp_tstat_udp_complete ###############
+def FormatExpTstatUdpComplete(row):
+	return '{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(row.nodeid, row.iccid, row.dataid, row.c_ip, row.c_port, row.c_first_abs, row.c_durat, row.c_bytes_all, row.c_pkts_all, row.c_isint, row.c_iscrypto, row.c_type, row.s_ip, row.s_port, row.s_first_abs, row.s_durat, row.s_bytes_all, row.s_pkts_all, row.s_isint, row.s_iscrypto, row.s_type, row.fqdn)
+
+########## monroe_exp_tstat_http_complete ###############
+def FormatExpTstatHttpComplete(row):
+	return '{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(row.nodeid, row.iccid, row.dataid, row.c_ip, row.c_port, row.s_ip, row.s_port, row.time_abs, row.method_http, row.hostname_response, row.fqdn_content_len, row.path_content_type, row.referer_server, row.user_agent_range, row.cookie_location, row.dnt_set_cookie)
+
+########## monroe_exp_tstat_tcp_complete ###############
+def FormatExpTstatTcpComplete(row):
+	return '{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(row.nodeid, row.iccid, row.dataid, row.c_ip, row.c_port, row.c_pkts_all, row.c_rst_cnt, row.c_ack_cnt, row.c_ack_cnt_p, row.c_bytes_uniq, row.c_pkts_data, row.c_bytes_all, row.c_pkts_retx, row.c_bytes_retx, row.c_pkts_ooo, row.c_syn_cnt, row.c_fin_cnt, row.s_ip, row.s_port, row.s_pkts_all, row.s_rst_cnt, row.s_ack_cnt, row.s_ack_cnt_p, row.s_bytes_uniq, row.s_pkts_data, row.s_bytes_all, row.s_pkts_retx, row.s_bytes_retx, row.s_pkts_ooo, row.s_syn_cnt, row.s_fin_cnt, row.first, row.last, row.durat, row.c_first, row.s_first, row.c_last, row.s_last, row.c_first_ack, row.s_first_ack, row.c_isint, row.s_isint, row.c_iscrypto, row.s_iscrypto, row.con_t, row.p2p_t, row.http_t, row.c_rtt_avg, row.c_rtt_min, row.c_rtt_max, row.c_rtt_std, row.c_rtt_cnt, row.c_ttl_min, row.c_ttl_max, row.s_rtt_avg, row.s_rtt_min, row.s_rtt_max, row.s_rtt_std, row.s_rtt_cnt, row.s_ttl_min, row.s_ttl_max, row.p2p_st, row.ed2k_data, row.ed2k_sig, row.ed2k_c2s, row.ed2k_c2c, row.ed2k_chat, row.c_f1323_opt, row.c_tm_opt, row.c_win_scl, row.c_sack_opt, row.c_sack_cnt, row.c_mss, row.c_mss_max, row.c_mss_min, row.c_win_max, row.c_win_min, row.c_win_0, row.c_cwin_max, row.c_cwin_min, row.c_cwin_ini, row.c_pkts_rto, row.c_pkts_fs, row.c_pkts_reor, row.c_pkts_dup, row.c_pkts_unk, row.c_pkts_fc, row.c_pkts_unrto, row.c_pkts_unfs, row.c_syn_retx, row.s_f1323_opt, row.s_tm_opt, row.s_win_scl, row.s_sack_opt, row.s_sack_cnt, row.s_mss, row.s_mss_max, row.s_mss_min, row.s_win_max, row.s_win_min, row.s_win_0, row.s_cwin_max, row.s_cwin_min, row.s_cwin_ini, row.s_pkts_rto, row.s_pkts_fs, row.s_pkts_reor, row.s_pkts_dup, row.s_pkts_unk, row.s_pkts_fc, row.s_pkts_unrto, row.s_pkts_unfs, row.s_syn_retx, row.http_req_cnt, row.http_res_cnt, row.http_res, row.c_pkts_push, row.s_pkts_push, row.c_tls_sni, row.s_tls_scn, row.c_npnalpn, row.s_npnalpn, row.c_tls_sesid, row.c_last_handshaket, row.s_last_handshaket, row.c_appdatat, row.s_appdatat, row.c_appdatab, row.s_appdatab, row.fqdn, row.dns_rslv, row.req_tm, row.res_tm)
+
+########## monroe_exp_tstat_tcp_nocomplete ###############
+def FormatExpTstatTcpNocomplete(row):
+	return '{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(row.nodeid, row.iccid, row.dataid, row.c_ip, row.c_port, row.c_pkts_all, row.c_rst_cnt, row.c_ack_cnt, row.c_ack_cnt_p, row.c_bytes_uniq, row.c_pkts_data, row.c_bytes_all, row.c_pkts_retx, row.c_bytes_retx, row.c_pkts_ooo, row.c_syn_cnt, row.c_fin_cnt, row.s_ip, row.s_port, row.s_pkts_all, row.s_rst_cnt, row.s_ack_cnt, row.s_ack_cnt_p, row.s_bytes_uniq, row.s_pkts_data, row.s_bytes_all, row.s_pkts_retx, row.s_bytes_retx, row.s_pkts_ooo, row.s_syn_cnt, row.s_fin_cnt, row.first, row.last, row.durat, row.c_first, row.s_first, row.c_last, row.s_last, row.c_first_ack, row.s_first_ack, row.c_isint, row.s_isint, row.c_iscrypto, row.s_iscrypto, row.con_t, row.p2p_t, row.http_t)
+
+########## monroe_exp_nettest ###############
+def FormatExpNettest(row):
+	return "{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(row.timestamp, row.iccid, row.nodeid, row.dataversion, row.dataid, row.sequencenumber, row.guid, row.operator.encode('latin-1'), row.errorcode, row.cnf_server_host, row.res_id_test, row.res_time_start_s, row.res_time_end_s, row.res_status, row.res_status_msg, row.res_version_client, row.res_version_server, row.res_server_ip, row.res_server_port, row.res_encrypt, row.res_chunksize, row.res_tcp_congestion, row.res_total_bytes_dl, row.res_total_bytes_ul, row.res_uname_sysname, row.res_uname_nodename, row.res_uname_release, row.res_uname_version, row.res_uname_machine, row.res_rtt_tcp_payload_num, row.res_rtt_tcp_payload_client_ns, row.res_rtt_tcp_payload_server_ns, row.res_dl_num_flows, row.res_dl_time_ns, row.res_dl_bytes, row.res_dl_throughput_kbps, row.res_ul_num_flows, row.res_ul_time_ns, row.res_ul_bytes, row.res_ul_throughput_kbps, row.imsimccmnc, row.nwmccmnc)
+
+
+# Tables dumped by DumpOneDay, in order: (table, CSV header, time column, allow filtering, row formatter).
+TABLE_DUMPS = [
+	TableDump("monroe_exp_ping",
+		"nodeid,iccid,timestamp,sequencenumber,bytes,dataid,dataversion,guid,host,operator,rtt\n",
+		"timestamp", True, FormatExpPing),
+	TableDump("monroe_exp_http_download",
+		"nodeid,iccid,timestamp,sequencenumber,bytes,dataid,dataversion,downloadtime,guid,host,operator,port,setuptime,speed,totaltime,errorcode,url\n",
+		"timestamp", True, FormatExpHttpDownload),
+	TableDump("monroe_meta_device_gps",
+		"nodeid,timestamp,sequencenumber,altitude,dataid,dataversion,fixquality,latitude,longitude,nmea,nmeatype,satellitecount,speed\n",
+		"timestamp", True, FormatMetaDeviceGps),
+	TableDump("monroe_meta_device_modem",
+		"nodeid,iccid,timestamp,sequencenumber,band,cid,dataid,dataversion,devicemode,devicestate,devicesubmode,ecio,enodebid,frequency,imei,imsi,imsimccmnc,interfacename,internalinterface,internalipaddress,ipaddress,lac,mccmnc,nwmccmnc,operator,pci,rscp,rsrp,rsrq,rssi\n",
+		"timestamp", True, FormatMetaDeviceModem),
+	TableDump("monroe_meta_node_event",
+		"nodeid, sequencenumber, timestamp, dataid, dataversion, eventtype, message, user, id\n",
+		"timestamp", True, FormatMetaNodeEvent),
+	TableDump("monroe_meta_node_sensor",
+		"nodeid, timestamp, sequencenumber, apps, cpu, current, dataid, dataversion, dlb, free, guest, id, idle, iowait, irq, modems, nice, percent, running, softirq, start, steal, swap, system, total, usb0, usb0charging, usb1, usb1charging, usb2, usb2charging, usbmonitor, user\n",
+		"timestamp", True, FormatMetaNodeSensor),
+	TableDump("monroe_exp_simple_traceroute",
+		"NodeId\ttimestamp\tendTime\tDataId\tDataVersion\tcontainerTimestamp\thop\ttargetdomainname\tInterfaceName\tIpDst\tnumberOfHops\tsizeOfProbes\tIP\tHopName\tRTTSection\tannotationSection\n",
+		"timestamp", False, FormatExpSimpleTraceroute),
+	TableDump("monroe_exp_exhaustive_paris",
+		"NodeId\ttimestamp\tendTime\tDataId\tDataVersion\tcontainerTimestamp\thop\ttargetdomainname\tInterfaceName\tIpDst\tPortDst\tIpSrc\tPortSrc\tIP\tProto\tAlgorithm\tduration\tMinHopRTT\tMedianHopRTT\tMaxHopRTT\tStdHopRTT\tannotation\tflowIds\tMPLS\tTransmittedProbes\tSuccessfulProbes\n",
+		"timestamp", False, FormatExpExhaustiveParis),
+	TableDump("monroe_exp_tstat_udp_complete",
+		"NodeId,Iccid,DataId,c_ip,c_port,c_first_abs,c_durat,c_bytes_all,c_pkts_all,c_isint,c_iscrypto,c_type,s_ip,s_port,s_first_abs,s_durat,s_bytes_all,s_pkts_all,s_isint,s_iscrypto,s_type,fqdn\n",
+		"c_first_abs", True, FormatExpTstatUdpComplete),
+	TableDump("monroe_exp_tstat_http_complete",
+		"NodeId,Iccid,DataId,c_ip,c_port,s_ip,s_port,time_abs,method_HTTP,hostname_response,fqdn_content_len,path_content_type,referer_server,user_agent_range,cookie_location,dnt_set_cookie\n",
+		"time_abs", True, FormatExpTstatHttpComplete),
+	TableDump("monroe_exp_tstat_tcp_complete",
+		"NodeId,Iccid,DataId,c_ip,c_port,c_pkts_all,c_rst_cnt,c_ack_cnt,c_ack_cnt_p,c_bytes_uniq,c_pkts_data,c_bytes_all,c_pkts_retx,c_bytes_retx,c_pkts_ooo,c_syn_cnt,c_fin_cnt,s_ip,s_port,s_pkts_all,s_rst_cnt,s_ack_cnt,s_ack_cnt_p,s_bytes_uniq,s_pkts_data,s_bytes_all,s_pkts_retx,s_bytes_retx,s_pkts_ooo,s_syn_cnt,s_fin_cnt,first,last,durat,c_first,s_first,c_last,s_last,c_first_ack,s_first_ack,c_isint,s_isint,c_iscrypto,s_iscrypto,con_t,p2p_t,http_t,c_rtt_avg,c_rtt_min,c_rtt_max,c_rtt_std,c_rtt_cnt,c_ttl_min,c_ttl_max,s_rtt_avg,s_rtt_min,s_rtt_max,s_rtt_std,s_rtt_cnt,s_ttl_min,s_ttl_max,p2p_st,ed2k_data,ed2k_sig,ed2k_c2s,ed2k_c2c,ed2k_chat,c_f1323_opt,c_tm_opt,c_win_scl,c_sack_opt,c_sack_cnt,c_mss,c_mss_max,c_mss_min,c_win_max,c_win_min,c_win_0,c_cwin_max,c_cwin_min,c_cwin_ini,c_pkts_rto,c_pkts_fs,c_pkts_reor,c_pkts_dup,c_pkts_unk,c_pkts_fc,c_pkts_unrto,c_pkts_unfs,c_syn_retx,s_f1323_opt,s_tm_opt,s_win_scl,s_sack_opt,s_sack_cnt,s_mss,s_mss_max,s_mss_min,s_win_max,s_win_min,s_win_0,s_cwin_max,s_cwin_min,s_cwin_ini,s_pkts_rto,s_pkts_fs,s_pkts_reor,s_pkts_dup,s_pkts_unk,s_pkts_fc,s_pkts_unrto,s_pkts_unfs,s_syn_retx,http_req_cnt,http_res_cnt,http_res,c_pkts_push,s_pkts_push,c_tls_SNI,s_tls_SCN,c_npnalpn,s_npnalpn,c_tls_sesid,c_last_handshakeT,s_last_handshakeT,c_appdataT,s_appdataT,c_appdataB,s_appdataB,fqdn,dns_rslv,req_tm,res_tm\n",
+		"first", True, FormatExpTstatTcpComplete),
+	TableDump("monroe_exp_tstat_tcp_nocomplete",
+		"NodeId,Iccid,DataId,c_ip,c_port,c_pkts_all,c_rst_cnt,c_ack_cnt,c_ack_cnt_p,c_bytes_uniq,c_pkts_data,c_bytes_all,c_pkts_retx,c_bytes_retx,c_pkts_ooo,c_syn_cnt,c_fin_cnt,s_ip,s_port,s_pkts_all,s_rst_cnt,s_ack_cnt,s_ack_cnt_p,s_bytes_uniq,s_pkts_data,s_bytes_all,s_pkts_retx,s_bytes_retx,s_pkts_ooo,s_syn_cnt,s_fin_cnt,first,last,durat,c_first,s_first,c_last,s_last,c_first_ack,s_first_ack,c_isint,s_isint,c_iscrypto,s_iscrypto,con_t,p2p_t,http_t\n",
+		"first", True, FormatExpTstatTcpNocomplete),
+	TableDump("monroe_exp_nettest",
+		"timestamp,iccid,nodeid,dataversion,dataid,sequencenumber,guid,operator,errorcode,cnf_server_host,res_id_test,res_time_start_s,res_time_end_s,res_status,res_status_msg,res_version_client,res_version_server,res_server_ip,res_server_port,res_encrypt,res_chunksize,res_tcp_congestion,res_total_bytes_dl,res_total_bytes_ul,res_uname_sysname,res_uname_nodename,res_uname_release,res_uname_version,res_uname_machine,res_rtt_tcp_payload_num,res_rtt_tcp_payload_client_ns,res_rtt_tcp_payload_server_ns,res_dl_num_flows,res_dl_time_ns,res_dl_bytes,res_dl_throughput_kbps,res_ul_num_flows,res_ul_time_ns,res_ul_bytes,res_ul_throughput_kbps,IMSIMCCMNC,NWMCCMNC\n",
+		"timestamp", True, FormatExpNettest),
+]
+
+# Tables with a day-bucketed variant (<table>_daily, see db_schema.cql), dumped from it with --bucketed.
+DAILY_TABLES = ["monroe_exp_ping", "monroe_meta_device_gps", "monroe_meta_device_modem", "monroe_meta_node_event", "monroe_meta_node_sensor"]
+
+
+###############################################################################
+#  File-like object that writes into an xz or zstd stream. Writes are buffered into large chunks
+# that a background thread compresses and writes to disk while the caller keeps fetching rows.
+class CompressedWriter(object):
+	def __init__(self, fileName, compression):
+		if compression.method == "xz":
+			self.compressor = lzma.LZMACompressor(preset = compression.level)
+		else:
+			self.compressor = zstandard.ZstdCompressor(level = compression.level, threads = compression.threads).compressobj()
+		self.output = open(fileName, "wb")
+		self.buffer = []
+		self.buffered = 0
+		self.error = None
+		self.chunks = Queue(maxsize = WRITE_QUEUE_CHUNKS)
+		self.thread = Thread(target = self._Compress)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _Compress(self):
+		chunk = ""
+		try:
+			while chunk is not None:
+				chunk = self.chunks.get()
+				if chunk is not None:
+					with profiler.stage("compress"):
+						self.output.write(self.compressor.compress(chunk))
+			with profiler.stage("compress"):
+				self.output.write(self.compressor.flush())
+		except Exception as error:
+			self.error = error
+			while chunk is not None:	# Keep draining so that the writer never blocks.
+				chunk = self.chunks.get()
+
+	def _Flush(self):
+		if self.error is not None:
+			raise self.error
+		if self.buffered > 0:
+			self.chunks.put("".join(self.buffer))
+			self.buffer = []
+			self.buffered = 0
+
+	def write(self, text):
+		self.buffer.append(text)
+		self.buffered += len(text)
+		if self.buffered >= WRITE_BUFFER_BYTES:
+			self._Flush()
+
+	def close(self):
+		try:
+			self._Flush()
+		finally:
+			self.chunks.put(None)
+			self.thread.join()
+			self.output.close()
+		if self.error is not None:
+			raise self.error
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+
+def OpenDumpFile(fileName, compression):
+	if compression is None:
+		return (fileName, open(fileName, "wt"))
+	fileName += COMPRESSED_EXTENSIONS[compression.method]
+	return (fileName, CompressedWriter(fileName, compression))
+
+
+###############################################################################
+# Dumps one table for the interval [startTime, endTime) and returns the number of rows written.
+#  With bucketed, tables in DAILY_TABLES are read from their day-bucketed variant, one query per day.
+def DumpTable(session, startTime, endTime, dump, compression = None, bucketed = False):
+	(fileName, output) = OpenDumpFile(FileNamePrefix(startTime) + "{}_{}.csv".format(startTime, dump.table), compression)
+	with profiler.file(fileName), output:
+		output.write(dump.header)
+		allowFiltering = " allow filtering" if dump.allowFiltering else ""
+		if bucketed and (dump.table in DAILY_TABLES):
+			query = "select * from {}_daily where day = {{day}} and {} >= {{}} and {} < {{}}{}".format(dump.table, dump.timeColumn, dump.timeColumn, allowFiltering)
+			queries = list(DayQueries(query, startTime, endTime))
+		else:
+			queries = ["select * from {} where {} >= {} and {} < {}{}".format(dump.table, dump.timeColumn, startTime, dump.timeColumn, endTime, allowFiltering)]
+		count = 0
+		for query in queries:
+			print query
+			for row in PrefetchRows(session, query):
+				try:
+					with profiler.stage("format"):
+						line = dump.formatRow(row)
+					with profiler.stage("write"):
+						output.write(line)
+				except Exception as error:
+					print "Error in row:", row, error
+				count += 1
+	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	return count
+
+def DumpOneDay(session, daysBack, tables = None, compression = None, bucketed = False):
 	(startTime, endTime) = CalcDumpTimes(daysBack)
 	print "\n======================================================================"
 	print "======================================================================"
 	print "======================================================================"
 	print FormatDate(), "Dumping MONROE tables for interval [{}, {})\n".format(startTime, endTime)
-	
-	########## monroe_exp_ping ###############
-	session.default_fetch_size = 1000
-	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_ping.csv".format(startTime)
-	with open(fileName, "wt") as output:	
-		output.write("nodeid,iccid,timestamp,sequencenumber,bytes,dataid,dataversion,guid,host,operator,rtt\n")
-		query = "select * from monroe_exp_ping where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
-		print query
-		rows = session.execute(query, timeout=None)
-		count = 0;
-		for row in rows:
-			# The driver automatically fetches the next page of rows when the current one is exhausted.
-			try:
-				output.write("{},{},{},{},{},{},{},{},{},{},{}\n".format(row.nodeid, row.iccid, row.timestamp, row.sequencenumber, row.bytes, row.dataid, row.dataversion, row.guid, row.host, row.operator.encode('latin-1'), row.rtt))
-			except Exception as error:
-                                print "Error in row:", row, error
-			count += 1
-	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
 
-	########## monroe_exp_http_download ###############
-	session.default_fetch_size = 1000
-	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_http_download.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("nodeid,iccid,timestamp,sequencenumber,bytes,dataid,dataversion,downloadtime,guid,host,operator,port,setuptime,speed,totaltime,errorcode,url\n")
-		query = "select * from monroe_exp_http_download where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
-		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
-		for row in rows:
-			try:
-				output.write("{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(row.nodeid, row.iccid, row.timestamp, row.sequencenumber, row.bytes, row.dataid, row.dataversion, row.downloadtime, row.guid, row.host, row.operator, row.port, row.setuptime, row.speed, row.totaltime, row.errorcode, row.url))
-			except Exception as error:
-                                print "Error in row:", row, error
-			count += 1
-	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	for dump in TABLE_DUMPS:
+		if (tables is None) or (dump.table in tables):
+			DumpTable(session, startTime, endTime, dump, compression, bucketed)
 
-	########## monroe_meta_device_gps #################
-	session.default_fetch_size = 1000
-	fileName = FileNamePrefix(startTime) + "{}_monroe_meta_device_gps.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("nodeid,timestamp,sequencenumber,altitude,dataid,dataversion,latitude,longitude,nmea,satellitecount,speed\n")
-		query = "select * from monroe_meta_device_gps where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
-		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
-		for row in rows:
-			try:
-				nmea = row.nmea.replace("\r","\\r").replace("\n","\\n") if row.nmea is not None else ""
-				output.write('{},{},{},{},{},{},{},{},"{}",{},{}\n'.format(row.nodeid, row.timestamp, row.sequencenumber, row.altitude, row.dataid, row.dataversion, row.latitude, row.longitude, nmea, row.satellitecount, row.speed))
-			except Exception as error:
-                                print "Error in row:", row, error
-			count += 1
-	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
 
-	########## monroe_meta_device_modem ###############
-	session.default_fetch_size = 1000
-	fileName = FileNamePrefix(startTime) + "{}_monroe_meta_device_modem.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("nodeid,iccid,timestamp,sequencenumber,band,cid,dataid,dataversion,devicemode,devicestate,devicesubmode,ecio,enodebid,frequency,imei,imsi,imsimccmnc,interfacename,internalinterface,internalipaddress,ipaddress,lac,mccmnc,nwmccmnc,operator,pci,rscp,rsrp,rsrq,rssi\n")
-		query = "select * from monroe_meta_device_modem where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
-		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
-		for row in rows:
-			try:
-				output.write("{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(row.nodeid, row.iccid, row.timestamp, row.sequencenumber, row.band, row.cid, row.dataid, row.dataversion, row.devicemode, row.devicestate, row.devicesubmode, row.ecio, row.enodebid, row.frequency, row.imei, row.imsi, row.imsimccmnc, row.interfacename, row.internalinterface, row.internalipaddress, row.ipaddress, row.lac, row.mccmnc, row.nwmccmnc, row.operator.encode('latin-1'), row.pci, row.rscp, row.rsrp, row.rsrq, row.rssi))
-			except Exception as error:
-                                print "Error in row:", row, error
-			count += 1
-	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+###############################################################################
+# Backfill mode: dumps a range of days, one job per (day, table), on a pool of processes.
+#  Every process opens its own connection. A semaphore shared by all the processes limits the
+# number of queries running at the same time on the cluster.
+backfillSession = None
+backfillQuerySlots = None
+backfillProfilePath = None
 
-	########## monroe_meta_node_event ###############
-	session.default_fetch_size = 1000
-	fileName = FileNamePrefix(startTime) + "{}_monroe_meta_node_event.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("nodeid, sequencenumber, timestamp, dataid, dataversion, eventtype, message, user, id\n")
-		query = "select * from monroe_meta_node_event where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
-		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
-		for row in rows:
-			try:
-				output.write('{},{},{},{},{},{},"{}",{},{}\n'.format(row.nodeid, row.sequencenumber, row.timestamp, row.dataid, row.dataversion, row.eventtype, row.message, row.user, row.id))
-			except Exception as error:
-                                print "Error in row:", row, error
-			count += 1
-	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+def Connect():
+	auth = PlainTextAuthProvider(username = DB_USER, password = DB_PASSWORD)
+	cluster = Cluster(contact_points = DB_HOSTS, port = 9042, auth_provider = auth)
+	session = cluster.connect(DB_KEYSPACE)
+	session.default_timeout = None
+	return (cluster, session)
 
-	########## monroe_meta_node_sensor ###############
-	session.default_fetch_size = 10
-	fileName = FileNamePrefix(startTime) + "{}_monroe_meta_node_sensor.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("nodeid, timestamp, sequencenumber, apps, cpu, current, dataid, dataversion, dlb, free, guest, id, idle, iowait, irq, modems, nice, percent, running, softirq, start, steal, swap, system, total, usb0, usb0charging, usb1, usb1charging, usb2, usb2charging, usbmonitor, user\n")
-		query = "select * from monroe_meta_node_sensor where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
-		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
-		for row in rows:
-			try:
-				output.write('{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(row.nodeid, row.timestamp, row.sequencenumber, row.apps, row.cpu, row.current, row.dataid, row.dataversion, row.dlb, row.free, row.guest, row.id, row.idle, row.iowait, row.irq, row.modems, row.nice, row.percent, row.running, row.softirq, row.start, row.steal, row.swap, row.system, row.total, row.usb0, row.usb0charging, row.usb1, row.usb1charging, row.usb2, row.usb2charging, row.usbmonitor, row.user))
-			except Exception as error:
-                                print "Error in row:", row, error
-			count += 1
-	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+def InitBackfillWorker(querySlots, profilePath = None):
+	global backfillSession, backfillQuerySlots, backfillProfilePath, profiler
+	(cluster, backfillSession) = Connect()
+	backfillQuerySlots = querySlots
+	if profilePath is not None:
+		backfillProfilePath = "{}.{}".format(profilePath, os.getpid())
+		profiler = Profiler(os.path.basename(__file__))
 
-	########## monroe_exp_simple_traceroute ###############
-	session.default_fetch_size = 1000
-	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_simple_traceroute.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("NodeId\ttimestamp\tendTime\tDataId\tDataVersion\tcontainerTimestamp\thop\ttargetdomainname\tInterfaceName\tIpDst\tnumberOfHops\tsizeOfProbes\tIP\tHopName\tRTTSection\tannotationSection\n")
-		query = "select * from monroe_exp_simple_traceroute where timestamp >= {} and timestamp < {}".format(startTime, endTime)
-		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
-		for row in rows:
-			try:
-				output.write('{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(row.nodeid, row.timestamp, row.endtime, row.dataid, row.dataversion, row.containertimestamp, row.hop, row.targetdomainname, row.interfacename, row.ipdst, row.numberofhops, row.sizeofprobes, row.ip, row.hopname, row.rttsection, row.annotationsection))
-			except Exception as error:
-                                print "Error in row:", row, error
-			count += 1
-	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+def CalcDayTimes(day):
+	# Timestamps for 00:00 (UTC) of the given date and of the next day.
+	startTime = timegm(day.timetuple())
+	return (startTime, startTime + 3600*24)
 
-	########## monroe_exp_exhaustive_paris ###############
-	session.default_fetch_size = 1000
-	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_exhaustive_paris.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("NodeId\ttimestamp\tendTime\tDataId\tDataVersion\tcontainerTimestamp\thop\ttargetdomainname\tInterfaceName\tIpDst\tPortDst\tIpSrc\tPortSrc\tIP\tProto\tAlgorithm\tduration\tMinHopRTT\tMedianHopRTT\tMaxHopRTT\tStdHopRTT\tannotation\tflowIds\tMPLS\tTransmittedProbes\tSuccessfulProbes\n")
-		query = "select * from monroe_exp_exhaustive_paris where timestamp >= {} and timestamp < {}".format(startTime, endTime)
-		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
-		for row in rows:
-			try:
-				output.write('{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(row.nodeid, row.timestamp, row.endtime, row.dataid, row.dataversion, row.containertimestamp, row.hop, row.targetdomainname, row.interfacename, row.ipdst, row.portdst, row.ipsrc, row.portsrc, row.ip, row.proto, row.algorithm, row.duration, row.minhoprtt, row.medianhoprtt, row.maxhoprtt, row.stdhoprtt, row.annotation, row.flowids, row.mpls, row.transmittedprobes, row.successfulprobes))
-			except Exception as error:
-				print "Error in row:", row, error
-			count += 1
-	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+def BackfillJob(job):
+	(day, table, retries, compression, bucketed) = job
+	(startTime, endTime) = CalcDayTimes(day)
+	dump = [d for d in TABLE_DUMPS if d.table == table][0]
+	result = {'day': day, 'table': table, 'rows': 0, 'attempts': 0, 'error': None}
+	begin = datetime.utcnow()
+	while result['attempts'] <= retries:
+		result['attempts'] += 1
+		try:
+			with backfillQuerySlots:
+				result['rows'] = DumpTable(backfillSession, startTime, endTime, dump, compression, bucketed)
+			result['error'] = None
+			break
+		except Exception as error:
+			result['error'] = str(error)
+			print FormatDate(), "Attempt {} of {} {} failed: {}".format(result['attempts'], table, day, error)
+			if result['attempts'] <= retries:	# Only wait if another attempt follows.
+				sleep(RETRY_DELAY * result['attempts'])
+	result['seconds'] = (datetime.utcnow() - begin).total_seconds()
+	if backfillProfilePath is not None:
+		profiler.write(backfillProfilePath)	# Rewritten after every job of the process.
+	return result
 
-	########## monroe_exp_tstat_udp_complete ###############
-	session.default_fetch_size = 1000
-	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_tstat_udp_complete.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("NodeId,Iccid,DataId,c_ip,c_port,c_first_abs,c_durat,c_bytes_all,c_pkts_all,c_isint,c_iscrypto,c_type,s_ip,s_port,s_first_abs,s_durat,s_bytes_all,s_pkts_all,s_isint,s_iscrypto,s_type,fqdn\n")
-		query = "select * from monroe_exp_tstat_udp_complete where c_first_abs >= {} and c_first_abs < {} allow filtering".format(startTime, endTime)
-		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
-		for row in rows:
-			try:
-				output.write('{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(row.nodeid, row.iccid, row.dataid, row.c_ip, row.c_port, row.c_first_abs, row.c_durat, row.c_bytes_all, row.c_pkts_all, row.c_isint, row.c_iscrypto, row.c_type, row.s_ip, row.s_port, row.s_first_abs, row.s_durat, row.s_bytes_all, row.s_pkts_all, row.s_isint, row.s_iscrypto, row.s_type, row.fqdn))
-			except Exception as error:
-				print "Error in row:", row, error
-			count += 1
-	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+def Backfill(firstDay, lastDay, tables, processes, maxQueries, retries, compression = None, profilePath = None, bucketed = False):
+	days = [firstDay + timedelta(days = ii) for ii in range((lastDay - firstDay).days + 1)]
+	jobs = [(day, table, retries, compression, bucketed) for day in days for table in tables]
+	print FormatDate(), "Backfilling {} tables for {} days ({} jobs) on {} processes, at most {} concurrent queries\n".format(len(tables), len(days), len(jobs), processes, maxQueries)
 
-	########## monroe_exp_tstat_http_complete ###############
-	session.default_fetch_size = 1000
-	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_tstat_http_complete.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("NodeId,Iccid,DataId,c_ip,c_port,s_ip,s_port,time_abs,method_HTTP,hostname_response,fqdn_content_len,path_content_type,referer_server,user_agent_range,cookie_location,dnt_set_cookie\n")
-		query = "select * from monroe_exp_tstat_http_complete where time_abs >= {} and time_abs < {} allow filtering".format(startTime, endTime)
-		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
-		for row in rows:
-			try:
-				output.write('{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(row.nodeid, row.iccid, row.dataid, row.c_ip, row.c_port, row.s_ip, row.s_port, row.time_abs, row.method_http, row.hostname_response, row.fqdn_content_len, row.path_content_type, row.referer_server, row.user_agent_range, row.cookie_location, row.dnt_set_cookie))
-			except Exception as error:
-				print "Error in row:", row, error
-			count += 1
-	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	querySlots = BoundedSemaphore(maxQueries)
+	pool = Pool(processes = processes, initializer = InitBackfillWorker, initargs = (querySlots, profilePath))
+	results = []
+	try:
+		for result in pool.imap_unordered(BackfillJob, jobs):
+			results.append(result)
+			print FormatDate(), "Job {} of {} done: {} {}".format(len(results), len(jobs), result['day'], result['table'])
+	finally:
+		pool.close()
+		pool.join()
 
-	########## monroe_exp_tstat_tcp_complete ###############
-	session.default_fetch_size = 1000
-	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_tstat_tcp_complete.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("NodeId,Iccid,DataId,c_ip,c_port,c_pkts_all,c_rst_cnt,c_ack_cnt,c_ack_cnt_p,c_bytes_uniq,c_pkts_data,c_bytes_all,c_pkts_retx,c_bytes_retx,c_pkts_ooo,c_syn_cnt,c_fin_cnt,s_ip,s_port,s_pkts_all,s_rst_cnt,s_ack_cnt,s_ack_cnt_p,s_bytes_uniq,s_pkts_data,s_bytes_all,s_pkts_retx,s_bytes_retx,s_pkts_ooo,s_syn_cnt,s_fin_cnt,first,last,durat,c_first,s_first,c_last,s_last,c_first_ack,s_first_ack,c_isint,s_isint,c_iscrypto,s_iscrypto,con_t,p2p_t,http_t,c_rtt_avg,c_rtt_min,c_rtt_max,c_rtt_std,c_rtt_cnt,c_ttl_min,c_ttl_max,s_rtt_avg,s_rtt_min,s_rtt_max,s_rtt_std,s_rtt_cnt,s_ttl_min,s_ttl_max,p2p_st,ed2k_data,ed2k_sig,ed2k_c2s,ed2k_c2c,ed2k_chat,c_f1323_opt,c_tm_opt,c_win_scl,c_sack_opt,c_sack_cnt,c_mss,c_mss_max,c_mss_min,c_win_max,c_win_min,c_win_0,c_cwin_max,c_cwin_min,c_cwin_ini,c_pkts_rto,c_pkts_fs,c_pkts_reor,c_pkts_dup,c_pkts_unk,c_pkts_fc,c_pkts_unrto,c_pkts_unfs,c_syn_retx,s_f1323_opt,s_tm_opt,s_win_scl,s_sack_opt,s_sack_cnt,s_mss,s_mss_max,s_mss_min,s_win_max,s_win_min,s_win_0,s_cwin_max,s_cwin_min,s_cwin_ini,s_pkts_rto,s_pkts_fs,s_pkts_reor,s_pkts_dup,s_pkts_unk,s_pkts_fc,s_pkts_unrto,s_pkts_unfs,s_syn_retx,http_req_cnt,http_res_cnt,http_res,c_pkts_push,s_pkts_push,c_tls_SNI,s_tls_SCN,c_npnalpn,s_npnalpn,c_tls_sesid,c_last_handshakeT,s_last_handshakeT,c_appdataT,s_appdataT,c_appdataB,s_appdataB,fqdn,dns_rslv,req_tm,res_tm\n")
-		query = "select * from monroe_exp_tstat_tcp_complete where first >= {} and first < {} allow filtering".format(startTime, endTime)
-		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
-		for row in rows:
-			try:
-				output.write('{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(row.nodeid, row.iccid, row.dataid, row.c_ip, row.c_port, row.c_pkts_all, row.c_rst_cnt, row.c_ack_cnt, row.c_ack_cnt_p, row.c_bytes_uniq, row.c_pkts_data, row.c_bytes_all, row.c_pkts_retx, row.c_bytes_retx, row.c_pkts_ooo, row.c_syn_cnt, row.c_fin_cnt, row.s_ip, row.s_port, row.s_pkts_all, row.s_rst_cnt, row.s_ack_cnt, row.s_ack_cnt_p, row.s_bytes_uniq, row.s_pkts_data, row.s_bytes_all, row.s_pkts_retx, row.s_bytes_retx, row.s_pkts_ooo, row.s_syn_cnt, row.s_fin_cnt, row.first, row.last, row.durat, row.c_first, row.s_first, row.c_last, row.s_last, row.c_first_ack, row.s_first_ack, row.c_isint, row.s_isint, row.c_iscrypto, row.s_iscrypto, row.con_t, row.p2p_t, row.http_t, row.c_rtt_avg, row.c_rtt_min, row.c_rtt_max, row.c_rtt_std, row.c_rtt_cnt, row.c_ttl_min, row.c_ttl_max, row.s_rtt_avg, row.s_rtt_min, row.s_rtt_max, row.s_rtt_std, row.s_rtt_cnt, row.s_ttl_min, row.s_ttl_max, row.p2p_st, row.ed2k_data, row.ed2k_sig, row.ed2k_c2s, row.ed2k_c2c, row.ed2k_chat, row.c_f1323_opt, row.c_tm_opt, row.c_win_scl, row.c_sack_opt, row.c_sack_cnt, row.c_mss, row.c_mss_max, row.c_mss_min, row.c_win_max, row.c_win_min, row.c_win_0, row.c_cwin_max, row.c_cwin_min, row.c_cwin_ini, row.c_pkts_rto, row.c_pkts_fs, row.c_pkts_reor, row.c_pkts_dup, row.c_pkts_unk, row.c_pkts_fc, row.c_pkts_unrto, row.c_pkts_unfs, row.c_syn_retx, row.s_f1323_opt, row.s_tm_opt, row.s_win_scl, row.s_sack_opt, row.s_sack_cnt, row.s_mss, row.s_mss_max, row.s_mss_min, row.s_win_max, row.s_win_min, row.s_win_0, row.s_cwin_max, row.s_cwin_min, row.s_cwin_ini, row.s_pkts_rto, row.s_pkts_fs, row.s_pkts_reor, row.s_pkts_dup, row.s_pkts_unk, row.s_pkts_fc, row.s_pkts_unrto, row.s_pkts_unfs, row.s_syn_retx, row.http_req_cnt, row.http_res_cnt, row.http_res, row.c_pkts_push, row.s_pkts_push, row.c_tls_sni, row.s_tls_scn, row.c_npnalpn, row.s_npnalpn, row.c_tls_sesid, row.c_last_handshaket, row.s_last_handshaket, row.c_appdatat, row.s_appdatat, row.c_appdatab, row.s_appdatab, row.fqdn, row.dns_rslv, row.req_tm, row.res_tm))
-			except Exception as error:
-				print "Error in row:", row, error
-			count += 1
-	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+	# Summary report
+	results.sort(key = lambda r: (r['day'], r['table']))
+	failed = [r for r in results if r['error'] is not None]
+	print "\n======================================================================"
+	print "BACKFILL SUMMARY"
+	print "{:<12} {:<34} {:>10} {:>9} {:>9}  {}".format("Day", "Table", "Rows", "Attempts", "Seconds", "Status")
+	for r in results:
+		print "{:<12} {:<34} {:>10} {:>9} {:>9.1f}  {}".format(str(r['day']), r['table'], r['rows'], r['attempts'], r['seconds'], "OK" if r['error'] is None else "FAILED ({})".format(r['error']))
+	print "{} jobs, {} rows, {} failed".format(len(results), sum(r['rows'] for r in results), len(failed))
+	print "======================================================================\n"
+	return len(failed) == 0
 
-	########## monroe_exp_tstat_tcp_nocomplete ###############
-	session.default_fetch_size = 1000
-	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_tstat_tcp_nocomplete.csv".format(startTime)
-	with open(fileName, "wt") as output:
-		output.write("NodeId,Iccid,DataId,c_ip,c_port,c_pkts_all,c_rst_cnt,c_ack_cnt,c_ack_cnt_p,c_bytes_uniq,c_pkts_data,c_bytes_all,c_pkts_retx,c_bytes_retx,c_pkts_ooo,c_syn_cnt,c_fin_cnt,s_ip,s_port,s_pkts_all,s_rst_cnt,s_ack_cnt,s_ack_cnt_p,s_bytes_uniq,s_pkts_data,s_bytes_all,s_pkts_retx,s_bytes_retx,s_pkts_ooo,s_syn_cnt,s_fin_cnt,first,last,durat,c_first,s_first,c_last,s_last,c_first_ack,s_first_ack,c_isint,s_isint,c_iscrypto,s_iscrypto,con_t,p2p_t,http_t\n")
-		query = "select * from monroe_exp_tstat_tcp_nocomplete where first >= {} and first < {} allow filtering".format(startTime, endTime)
-		print query
-		rows = session.execute(query, timeout=None)
-		count = 0
-		for row in rows:
-			try:
-				output.write('{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(row.nodeid, row.iccid, row.dataid, row.c_ip, row.c_port, row.c_pkts_all, row.c_rst_cnt, row.c_ack_cnt, row.c_ack_cnt_p, row.c_bytes_uniq, row.c_pkts_data, row.c_bytes_all, row.c_pkts_retx, row.c_bytes_retx, row.c_pkts_ooo, row.c_syn_cnt, row.c_fin_cnt, row.s_ip, row.s_port, row.s_pkts_all, row.s_rst_cnt, row.s_ack_cnt, row.s_ack_cnt_p, row.s_bytes_uniq, row.s_pkts_data, row.s_bytes_all, row.s_pkts_retx, row.s_bytes_retx, row.s_pkts_ooo, row.s_syn_cnt, row.s_fin_cnt, row.first, row.last, row.durat, row.c_first, row.s_first, row.c_last, row.s_last, row.c_first_ack, row.s_first_ack, row.c_isint, row.s_isint, row.c_iscrypto, row.s_iscrypto, row.con_t, row.p2p_t, row.http_t))
-			except Exception as error:
-				print "Error in row:", row, error
-			count += 1
-	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
 
-	########## monroe_exp_nettest ###############
-	session.default_fetch_size = 1000
-	fileName = FileNamePrefix(startTime) + "{}_monroe_exp_nettest.csv".format(startTime)
-	with open(fileName, "wt") as output:	
-		output.write("timestamp,iccid,nodeid,dataversion,dataid,sequencenumber,guid,operator,errorcode,cnf_server_host,res_id_test,res_time_start_s,res_time_end_s,res_status,res_status_msg,res_version_client,res_version_server,res_server_ip,res_server_port,res_encrypt,res_chunksize,res_tcp_congestion,res_total_bytes_dl,res_total_bytes_ul,res_uname_sysname,res_uname_nodename,res_uname_release,res_uname_version,res_uname_machine,res_rtt_tcp_payload_num,res_rtt_tcp_payload_client_ns,res_rtt_tcp_payload_server_ns,res_dl_num_flows,res_dl_time_ns,res_dl_bytes,res_dl_throughput_kbps,res_ul_num_flows,res_ul_time_ns,res_ul_bytes,res_ul_throughput_kbps,IMSIMCCMNC,NWMCCMNC\n")
-		query = "select * from monroe_exp_nettest where timestamp >= {} and timestamp < {} allow filtering".format(startTime, endTime)
-		print query
-		rows = session.execute(query, timeout=None)
-		count = 0;
-		for row in rows:
-			# The driver automatically fetches the next page of rows when the current one is exhausted.
-			try:
-				output.write("{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format(row.timestamp, row.iccid, row.nodeid, row.dataversion, row.dataid, row.sequencenumber, row.guid, row.operator.encode('latin-1'), row.errorcode, row.cnf_server_host, row.res_id_test, row.res_time_start_s, row.res_time_end_s, row.res_status, row.res_status_msg, row.res_version_client, row.res_version_server, row.res_server_ip, row.res_server_port, row.res_encrypt, row.res_chunksize, row.res_tcp_congestion, row.res_total_bytes_dl, row.res_total_bytes_ul, row.res_uname_sysname, row.res_uname_nodename, row.res_uname_release, row.res_uname_version, row.res_uname_machine, row.res_rtt_tcp_payload_num, row.res_rtt_tcp_payload_client_ns, row.res_rtt_tcp_payload_server_ns, row.res_dl_num_flows, row.res_dl_time_ns, row.res_dl_bytes, row.res_dl_throughput_kbps, row.res_ul_num_flows, row.res_ul_time_ns, row.res_ul_bytes, row.res_ul_throughput_kbps, row.imsimccmnc, row.nwmccmnc))
-			except Exception as error:
-                                print "Error in row:", row, error
-			count += 1
-	print FormatDate(), "Dumped {} rows to {}\n".format(count, fileName)
+###############################################################################
+def ParseDate(text):
+	return datetime.strptime(text, "%Y-%m-%d").date()
+
+def ParseCommandLine():
+	tableNames = [d.table for d in TABLE_DUMPS]
+	parser = argparse.ArgumentParser(description = "Daily dump of the MONROE tables to CSV files")
+
+	parser.add_argument('-s', '--startDate', help = 'First day to dump (YYYY-MM-DD, UTC). Enables backfill mode', required = False, type = ParseDate)
+	parser.add_argument('-e', '--endDate', help = 'Last day to dump, inclusive (YYYY-MM-DD, default startDate)', required = False, type = ParseDate)
+	parser.add_argument('-t', '--tables', help = 'Tables to dump (default all)', required = False, nargs = '+', choices = tableNames, default = tableNames)
+	parser.add_argument('-p', '--processes', help = 'Backfill processes (default 4)', required = False, type = int, default = 4)
+	parser.add_argument('-q', '--maxQueries', help = 'Maximum number of concurrent queries on the cluster (default 2)', required = False, type = int, default = 2)
+	parser.add_argument('-r', '--retries', help = 'Retries of every failed backfill job (default 2)', required = False, type = int, default = 2)
+	parser.add_argument('-c', '--compress', help = 'Write compressed files (default none)', required = False, choices = ['none', 'xz', 'zstd'], default = 'none')
+	parser.add_argument('-l', '--compressLevel', help = 'Compression level (default 6 for xz, 3 for zstd)', required = False, type = int)
+	parser.add_argument('-w', '--compressThreads', help = 'zstd worker threads (default 2)', required = False, type = int, default = 2)
+	parser.add_argument('--bucketed', help = 'Read the day-bucketed (_daily) tables when there are (needed once the importer runs with --buckets only)', required = False, action = 'store_true')
+	parser.add_argument('--profile', help = 'Profile the fetch, format, write and compress stages and write the JSON report to this file (FILE.<pid> per backfill process)', required = False, type = str)
+
+	args = parser.parse_args()
+
+	# Validate args
+	if (args.endDate is None):
+		args.endDate = args.startDate
+	if (args.startDate is not None) and (args.endDate < args.startDate):
+		parser.error("endDate is before startDate")
+	if (args.processes < 1) or (args.maxQueries < 1) or (args.retries < 0):
+		parser.error("processes and maxQueries must be positive, retries cannot be negative")
+	if (args.compress == 'xz') and (lzma is None):
+		parser.error("--compress xz needs the lzma module of Python 3 or backports.lzma (pip install backports.lzma)")
+	if (args.compress == 'zstd') and (zstandard is None):
+		parser.error("--compress zstd needs the zstandard module (pip install zstandard)")
+
+	if args.compress == 'none':
+		args.compression = None
+	else:
+		level = args.compressLevel if args.compressLevel is not None else 6 if args.compress == 'xz' else 3
+		args.compression = Compression(args.compress, level, args.compressThreads)
+
+	return args
 
 if __name__ == '__main__':
+	args = ParseCommandLine()
 
-	auth = PlainTextAuthProvider(username = "xxxx", password = "yyy")
-	cluster = Cluster(contact_points = ['127.0.0.1'], port = 9042, auth_provider = auth)
-	session = None
-	session = cluster.connect("monroe") # Set default keyspace to 'monroe'
-	session.default_timeout = None
-	session.default_fetch_size = 1000
+	if args.startDate is not None:
+		ok = Backfill(args.startDate, args.endDate, args.tables, args.processes, args.maxQueries, args.retries, args.compression, args.profile, args.bucketed)
+		print FormatDate(), "BACKFILL FINISHED.\n"
+		sys.exit(0 if ok else 1)
+
+	if args.profile:
+		profiler = Profiler(os.path.basename(__file__))
+
+	(cluster, session) = Connect()
 
 	for ii in range (1, 2): # Default is one day back (the previous day).
-		DumpOneDay(session, ii)
+		DumpOneDay(session, ii, args.tables, args.compression, args.bucketed)
 
 	cluster.shutdown() # Closes connection to the DB and frees resources.
 
-	print FormatDate(), "DUMP FINISHED.\n"
+	if args.profile:
+		profiler.write(args.profile)
+		print FormatDate(), "Profile written to {}".format(args.profile)
 
+	print FormatDate(), "DUMP FINISHED.\n"
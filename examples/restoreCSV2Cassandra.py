@@ -0,0 +1,203 @@
+#!/usr/bin/python
+
+"""
+ Tool to load the daily dumps written by dailyCassandra2CSV.py back into a Cassandra keyspace,
+  e.g. to restore some days into a fresh cluster or a test keyspace.
+  https://www.monroe-project.eu
+
+ The table of every file is taken from its name (<date>_<startTime>_<table>.csv, optionally
+  .xz or .zst compressed). Comma (CSV) and tab separated (TSV, the traceroute tables) files
+  are recognized from their header line. The header names are mapped to the columns of the
+  table as found in the schema registry (importer/monroeschema.py, compiled from
+  db_schema.cql), and every value is converted to the type of its
+  column. Rows are written with a prepared statement, CHUNK_ROWS at a time with up to
+  --concurrency concurrent requests, and the throughput is printed after every chunk.
+
+ Usage: ./restoreCSV2Cassandra.py -k monroe_test /experiments/dailyDumps/2017-01-0[1-7]_*
+
+ Dependencies: sudo pip install cassandra-driver python-dateutil
+  Optional: backports.lzma (.xz files), zstandard (.zst files)
+
+ Cassandra driver (Python) documentation: https://datastax.github.io/python-driver/index.html
+"""
+
+from cassandra.cluster import Cluster
+from cassandra.auth import PlainTextAuthProvider
+from cassandra.concurrent import execute_concurrent_with_args
+from dailyCassandra2CSV import TABLE_DUMPS, lzma, zstandard
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+from ast import literal_eval
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "importer"))
+from monroeschema import load_registry, column_types
+
+CHUNK_ROWS = 5000
+READ_BYTES = 1 << 20
+
+FILE_NAME = re.compile(r"^\d{4}-\d{2}-\d{2}_\d+_(\w+)\.csv(\.xz|\.zst)?$")
+INTEGER_TYPES = ("int", "bigint", "smallint", "tinyint", "varint")
+FLOAT_TYPES = ("double", "float")
+TEXT_TYPES = ("text", "varchar", "ascii")
+
+def FormatDate():
+	return "[{} (UTC)] --".format(datetime.utcnow())
+
+
+###############################################################################
+# Yields the lines of a decompressed stream, decompress being called on every chunk read.
+def DecompressedLines(f, decompress):
+	pending = ""
+	while True:
+		chunk = f.read(READ_BYTES)
+		if not chunk:
+			break
+		lines = (pending + decompress(chunk)).split("\n")
+		pending = lines.pop()
+		for line in lines:
+			yield line + "\n"
+	if pending:
+		yield pending
+
+def ReadLines(fileName):
+	with open(fileName, "rb") as f:
+		if fileName.endswith(".xz"):
+			lines = DecompressedLines(f, lzma.LZMADecompressor().decompress)
+		elif fileName.endswith(".zst"):
+			lines = DecompressedLines(f, zstandard.ZstdDecompressor().decompressobj().decompress)
+		else:
+			lines = f
+		for line in lines:
+			yield line
+
+
+###############################################################################
+# Returns a function that converts the text written by the exporter back into a value of cqlType.
+def ValueConverter(column, cqlType):
+	if cqlType in INTEGER_TYPES:
+		convert = int
+	elif cqlType == "decimal":
+		convert = Decimal
+	elif cqlType in FLOAT_TYPES:
+		convert = float
+	elif cqlType == "boolean":
+		convert = lambda text: text == "True"
+	elif cqlType.startswith(("list<", "set<", "map<")):
+		convert = literal_eval
+	elif column == "nmea":
+		# The exporter escapes the line breaks of the NMEA sentences.
+		convert = lambda text: text.decode('latin-1').replace("\\r", "\r").replace("\\n", "\n")
+	elif cqlType in TEXT_TYPES:
+		convert = lambda text: text.decode('latin-1')
+	else:
+		raise Exception("Unsupported type {} of column {}".format(cqlType, column))
+	# Python None values were written as "None"
+	return lambda text: None if text == "None" else convert(text)
+
+def TableOfFile(fileName):
+	match = FILE_NAME.match(os.path.basename(fileName))
+	if match is None or match.group(1) not in [d.table for d in TABLE_DUMPS]:
+		raise Exception("{} is not a daily dump file".format(fileName))
+	return match.group(1)
+
+
+###############################################################################
+# Loads one dump file and returns (rows loaded, rows failed).
+def LoadFile(session, registry, fileName, concurrency):
+	table = TableOfFile(fileName)
+	lines = ReadLines(fileName)
+	header = next(lines)
+	delimiter = "\t" if "\t" in header else ","
+	columns = [name.strip().lower() for name in header.rstrip("\r\n").split(delimiter)]
+	types = column_types(registry, table)
+	for column in columns:
+		if column not in types:
+			raise Exception("Column {} of {} is not in table {}".format(column, fileName, table))
+	converters = [ValueConverter(column, types[column]) for column in columns]
+
+	statement = session.prepare("INSERT INTO {} ({}) VALUES ({})".format(table, ", ".join(columns), ", ".join(["?"] * len(columns))))
+	print FormatDate(), "Loading {} into {}".format(fileName, table)
+
+	reader = csv.reader(lines, delimiter = delimiter, quotechar = '"')
+	loaded = 0
+	failed = 0
+	startTime = time.time()
+	while True:
+		params = []
+		for fields in islice(reader, CHUNK_ROWS):
+			try:
+				if len(fields) != len(columns):
+					raise Exception("{} fields, expected {}".format(len(fields), len(columns)))
+				params.append([convert(text) for (convert, text) in zip(converters, fields)])
+			except Exception as error:
+				print "Error in line {} of {}: {} {}".format(reader.line_num + 1, fileName, fields, error)
+				failed += 1
+		if len(params) == 0:
+			break
+		results = execute_concurrent_with_args(session, statement, params, concurrency = concurrency, raise_on_first_error = False)
+		for (success, result) in results:
+			if success:
+				loaded += 1
+			else:
+				print "Error inserting into {}: {}".format(table, result)
+				failed += 1
+		elapsed = time.time() - startTime
+		print FormatDate(), "{}: {} rows loaded, {} failed, {:.0f} rows/s".format(table, loaded, failed, loaded / elapsed if elapsed > 0 else 0.0)
+	return (loaded, failed)
+
+
+###############################################################################
+def ParseCommandLine():
+	parser = argparse.ArgumentParser(description = "Loads daily CSV/TSV dumps into Cassandra")
+
+	parser.add_argument('files', help = 'Dump files (<date>_<startTime>_<table>.csv[.xz|.zst])', nargs = '+')
+	parser.add_argument('-k', '--keyspace', help = 'Keyspace to load into (default monroe)', required = False, type = str, default = "monroe")
+	parser.add_argument('-H', '--hosts', help = 'Hosts in the cluster (default 127.0.0.1)', required = False, nargs = '+', default = ['127.0.0.1'])
+	parser.add_argument('-u', '--user', help = 'Cassandra username', required = False, type = str, default = "xxxx")
+	parser.add_argument('-p', '--password', help = 'Cassandra password', required = False, type = str, default = "yyy")
+	parser.add_argument('-c', '--concurrency', help = 'Concurrent insert requests (default 64)', required = False, type = int, default = 64)
+
+	args = parser.parse_args()
+
+	# Validate args
+	for fileName in args.files:
+		TableOfFile(fileName)
+		if fileName.endswith(".xz") and lzma is None:
+			parser.error("{} needs the lzma module (pip install backports.lzma)".format(fileName))
+		if fileName.endswith(".zst") and zstandard is None:
+			parser.error("{} needs the zstandard module (pip install zstandard)".format(fileName))
+
+	return args
+
+if __name__ == '__main__':
+	args = ParseCommandLine()
+
+	registry = load_registry()
+	auth = PlainTextAuthProvider(username = args.user, password = args.password)
+	cluster = Cluster(contact_points = args.hosts, port = 9042, auth_provider = auth, schema_metadata_enabled = False)
+	session = cluster.connect(args.keyspace)
+	session.default_timeout = None
+
+	totalLoaded = 0
+	totalFailed = 0
+	startTime = time.time()
+	for fileName in args.files:
+		try:
+			(loaded, failed) = LoadFile(session, registry, fileName, args.concurrency)
+		except Exception as error:
+			print FormatDate(), "Error loading {}: {}".format(fileName, error)
+			continue
+		totalLoaded += loaded
+		totalFailed += failed
+
+	cluster.shutdown() # Closes connection to the DB and frees resources.
+
+	elapsed = time.time() - startTime
+	print FormatDate(), "RESTORE FINISHED: {} rows loaded, {} failed in {:.0f} s ({:.0f} rows/s).\n".format(totalLoaded, totalFailed, elapsed, totalLoaded / elapsed if elapsed > 0 else 0.0)
@@ -0,0 +1,397 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+r"""
+Archives the dated folders of the importer's failed and processed directories.
+
+Every folder of the source directories (except the one of the current day,
+which the importer may still be writing to) is written to
+<dest>/<source>-<folder>.txz (or .tzst) and removed once the archive has
+been verified. Folders are archived in parallel (--jobs), each one through a
+multi-threaded xz or zstd process.
+
+While an archive is written the SHA-256 of every member and of the
+compressed stream are computed. The members are listed with their size,
+modification time and checksum in an index file next to the archive
+(<archive>.index.json). Verification re-reads the archive from disk and
+compares its checksum with the one of the stream (catching write errors
+without decompressing); with --deep-verify the archive is also decompressed
+and every member checked against the index.
+
+A run that died leaves its folders to the next one: temporary files are
+removed, an archive without a readable index (or that does not match it) is
+written again from the folder, and an archive that matches its index (deep
+verification) is kept and the remaining files of its folder removed.
+
+Replaces the tar cJf / xz -t loop of autocopy.sh, which it is called from.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import textwrap
+import threading
+import time
+from datetime import date, datetime
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+CMD_NAME = os.path.basename(__file__)
+READ_BYTES = 1 << 20
+INDEX_SUFFIX = '.index.json'
+TMP_SUFFIX = '.tmp'
+
+# method: (archive extension, compress command, decompress command)
+# {threads} and {level} are replaced by the options.
+COMPRESSORS = {
+    'xz': ('.txz',
+           ['xz', '-T{threads}', '-{level}', '-c'],
+           ['xz', '-d', '-c']),
+    'zstd': ('.tzst',
+             ['zstd', '-T{threads}', '-{level}', '-q', '-c'],
+             ['zstd', '-d', '-q', '-c']),
+}
+DEFAULT_LEVELS = {'xz': 6, 'zstd': 10}
+
+
+def log(log_str):
+    """Log with a timestamp (stdout is redirected to the log by autocopy.sh)."""
+    print("[{}] {}".format(datetime.now().isoformat(), log_str))
+    sys.stdout.flush()
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(READ_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _HashingReader(object):
+    """File wrapper that hashes what tarfile reads from it."""
+
+    def __init__(self, f):
+        self._f = f
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self.digest.update(data)
+        return data
+
+
+def _copy_hashed(src, dest, digest):
+    """Copy stream src to dest, adding the data to digest."""
+    while True:
+        chunk = src.read(READ_BYTES)
+        if not chunk:
+            break
+        digest.update(chunk)
+        dest.write(chunk)
+
+
+def _command(template, threads, level):
+    return [arg.format(threads=threads, level=level) for arg in template]
+
+
+def build_archive(folder, archive, method, level, threads):
+    """
+    Write folder to archive through the compressor.
+
+    Returns the index: the checksum of the compressed archive and the list of
+    members with their checksums.
+    """
+    (extension, compress, decompress) = COMPRESSORS[method]
+    members = []
+    archive_digest = hashlib.sha256()
+    tmp_archive = archive + TMP_SUFFIX
+    base = os.path.dirname(os.path.normpath(folder))
+
+    with open(tmp_archive, 'wb') as output:
+        compressor = subprocess.Popen(_command(compress, threads, level),
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE)
+        # Hash the compressed stream on its way to disk.
+        writer = threading.Thread(target=_copy_hashed,
+                                  args=(compressor.stdout, output,
+                                        archive_digest))
+        writer.start()
+        try:
+            with tarfile.open(fileobj=compressor.stdin, mode='w|') as tar:
+                for (dirpath, dirnames, filenames) in os.walk(folder):
+                    dirnames.sort()
+                    for name in sorted(filenames):
+                        path = os.path.join(dirpath, name)
+                        arcname = os.path.relpath(path, base)
+                        info = tar.gettarinfo(path, arcname)
+                        with open(path, 'rb') as f:
+                            reader = _HashingReader(f)
+                            tar.addfile(info, reader)
+                        members.append({'name': arcname,
+                                        'size': info.size,
+                                        'mtime': info.mtime,
+                                        'sha256': reader.digest.hexdigest()})
+        finally:
+            compressor.stdin.close()
+            writer.join()
+            returncode = compressor.wait()
+        output.flush()
+        os.fsync(output.fileno())
+    if returncode != 0:
+        os.unlink(tmp_archive)
+        raise Exception("{} exited with {}".format(compress[0], returncode))
+    os.rename(tmp_archive, archive)
+
+    return {'archive': os.path.basename(archive),
+            'folder': folder,
+            'compression': method,
+            'created': datetime.now().isoformat(),
+            'sha256': archive_digest.hexdigest(),
+            'members': members}
+
+
+def verify_archive(archive, index, deep):
+    """Return None if archive matches its index, else the error."""
+    if _sha256_file(archive) != index['sha256']:
+        return "checksum of {} differs from the written stream".format(archive)
+    if not deep:
+        return None
+
+    decompress = COMPRESSORS[index['compression']][2]
+    expected = dict((m['name'], m['sha256']) for m in index['members'])
+    seen = 0
+    with open(archive, 'rb') as f:
+        decompressor = subprocess.Popen(decompress, stdin=f,
+                                        stdout=subprocess.PIPE)
+        try:
+            with tarfile.open(fileobj=decompressor.stdout, mode='r|') as tar:
+                for info in tar:
+                    if not info.isfile():
+                        continue
+                    digest = hashlib.sha256()
+                    _copy_hashed(tar.extractfile(info), _NullWriter(), digest)
+                    if expected.get(info.name) != digest.hexdigest():
+                        return "member {} of {} does not match the index".format(
+                            info.name, archive)
+                    seen += 1
+        finally:
+            decompressor.stdout.close()
+            returncode = decompressor.wait()
+    if returncode != 0:
+        return "{} exited with {}".format(decompress[0], returncode)
+    if seen != len(expected):
+        return "{} has {} members, the index {}".format(archive, seen,
+                                                        len(expected))
+    return None
+
+
+class _NullWriter(object):
+    def write(self, data):
+        pass
+
+
+def write_index(archive, index):
+    """Write the index of archive (through a temporary file)."""
+    path = archive + INDEX_SUFFIX
+    with open(path + TMP_SUFFIX, 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(path + TMP_SUFFIX, path)
+
+
+def read_index(archive):
+    """Return the index of archive, or None if it is missing or invalid."""
+    try:
+        with open(archive + INDEX_SUFFIX, 'r') as f:
+            index = json.load(f)
+        if (index['compression'] in COMPRESSORS and
+                all(set(m) >= set(['name', 'size', 'mtime', 'sha256'])
+                    for m in index['members'])):
+            return index
+    except (IOError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def _unindexed_files(folder, index):
+    """The files of folder that are not in index as they are on disk."""
+    members = dict((m['name'], (m['size'], int(m['mtime'])))
+                   for m in index['members'])
+    base = os.path.dirname(os.path.normpath(folder))
+    unindexed = []
+    for (dirpath, dirnames, filenames) in os.walk(folder):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            stat = os.stat(path)
+            if (members.get(os.path.relpath(path, base)) !=
+                    (stat.st_size, int(stat.st_mtime))):
+                unindexed.append(path)
+    return unindexed
+
+
+def recover_archive(folder, archive):
+    """
+    Check an archive left by an earlier run (see module doc).
+
+    Returns its index if it can be kept, or None if it must be written
+    again. Raises if the folder has files that the archive lacks.
+    """
+    index = read_index(archive)
+    if index is None:
+        log("Rebuilding {}: no valid index".format(archive))
+        return None
+    error = verify_archive(archive, index, True)
+    if error is not None:
+        log("Rebuilding {}: {}".format(archive, error))
+        return None
+    unindexed = _unindexed_files(folder, index)
+    if unindexed:
+        raise Exception("{} exists without {} files of the folder, e.g. "
+                        "{}".format(archive, len(unindexed), unindexed[0]))
+    log("Reusing {} written by an earlier run".format(archive))
+    return index
+
+
+def archive_folder(job):
+    """
+    Archive, verify and remove one folder.
+
+    Returns (folder, archive, None) or (folder, archive, error).
+    """
+    (folder, archive, method, level, threads, deep, keep) = job
+    start_time = time.time()
+    try:
+        for leftover in (archive + TMP_SUFFIX,
+                         archive + INDEX_SUFFIX + TMP_SUFFIX):
+            if os.path.exists(leftover):
+                log("Removing {} left by an earlier run".format(leftover))
+                os.unlink(leftover)
+        index = None
+        if os.path.exists(archive):
+            index = recover_archive(folder, archive)
+        if index is None:
+            index = build_archive(folder, archive, method, level, threads)
+            write_index(archive, index)
+            error = verify_archive(archive, index, deep)
+            if error is not None:
+                raise Exception("Verification failed: {}".format(error))
+        if not keep:
+            shutil.rmtree(folder)
+    except Exception as error:
+        return (folder, archive, str(error))
+    log(("Archived {} ({} files, {} bytes) into {} in {:.0f} s{}"
+         "").format(folder,
+                    len(index['members']),
+                    sum(m['size'] for m in index['members']),
+                    archive,
+                    time.time() - start_time,
+                    "" if keep else ", folder removed"))
+    return (folder, archive, None)
+
+
+def find_jobs(src_dir, sources, dest_dir, method, level, threads, deep, keep):
+    """List the folders to archive, skipping the one of the current day."""
+    today = date.today().isoformat()
+    extension = COMPRESSORS[method][0]
+    jobs = []
+    for source in sources:
+        source_dir = os.path.join(src_dir, source)
+        if not os.path.isdir(source_dir):
+            log("Skipping missing folder {}".format(source_dir))
+            continue
+        for folder in sorted(os.listdir(source_dir)):
+            path = os.path.join(source_dir, folder)
+            if not os.path.isdir(path):
+                continue
+            if folder == today:
+                log("Ignoring {} folder {}".format(source, folder))
+                continue
+            archive = os.path.join(dest_dir,
+                                   "{}-{}{}".format(source, folder, extension))
+            jobs.append((path, archive, method, level, threads, deep, keep))
+    return jobs
+
+
+def create_arg_parser():
+    """Create a argument parser and return it."""
+    parser = argparse.ArgumentParser(
+        prog=CMD_NAME,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''
+            Archives the dated folders of the failed/processed directories
+            (except today's) into compressed, indexed and verified tar
+            files, removing the folders afterwards.'''))
+    parser.add_argument('sources',
+                        nargs='*',
+                        default=['failed', 'processed'],
+                        help=("Directories under --src to archive "
+                              "(default failed processed)"))
+    parser.add_argument('-S', '--src',
+                        metavar='DIR',
+                        default="/experiments",
+                        help="Parent of the sources (default /experiments)")
+    parser.add_argument('-D', '--dest',
+                        metavar='DIR',
+                        default="/experiments/backups",
+                        help=("Archive directory (default "
+                              "/experiments/backups)"))
+    parser.add_argument('-m', '--method',
+                        choices=sorted(COMPRESSORS.keys()),
+                        default='xz',
+                        help="Compression (default xz)")
+    parser.add_argument('-l', '--level',
+                        type=int,
+                        help="Compression level (default xz 6, zstd 10)")
+    parser.add_argument('-j', '--jobs',
+                        metavar='N',
+                        type=int,
+                        default=2,
+                        help="Folders archived in parallel (default 2)")
+    parser.add_argument('-t', '--threads',
+                        metavar='N',
+                        type=int,
+                        default=max(1, cpu_count() // 2),
+                        help=("Compression threads per folder "
+                              "(default {})").format(max(1, cpu_count() // 2)))
+    parser.add_argument('--deep-verify',
+                        action="store_true",
+                        help=("Also decompress every archive and check its "
+                              "members against the index"))
+    parser.add_argument('--keep',
+                        action="store_true",
+                        help="Do not remove the archived folders")
+    return parser
+
+
+if __name__ == '__main__':
+    parser = create_arg_parser()
+    args = parser.parse_args()
+    level = args.level if args.level is not None else DEFAULT_LEVELS[args.method]
+    if not os.path.isdir(args.dest):
+        os.makedirs(args.dest)
+
+    log("Archiver running")
+    jobs = find_jobs(args.src, args.sources, args.dest, args.method, level,
+                     args.threads, args.deep_verify, args.keep)
+    pool = ThreadPool(processes=max(1, args.jobs))
+    errors = 0
+    for (folder, archive, error) in pool.imap_unordered(archive_folder, jobs):
+        if error is not None:
+            log("Error archiving {} into {}: {}".format(folder, archive, error))
+            errors += 1
+    pool.close()
+    pool.join()
+    log("Archived {} folders, {} failed".format(len(jobs) - errors, errors))
+    raise SystemExit(1 if errors > 0 else 0)
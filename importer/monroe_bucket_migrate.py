@@ -0,0 +1,308 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Copies the rows of a table into its day-bucketed variant (<table>_daily).
+
+The day-bucketed tables (see db_schema.cql) partition the rows of a node (and
+Iccid) by day, so that a time window only reads the partitions of its days.
+The migration is done online:
+
+ 1. Restart the importer with --buckets dual, so new entries are written to
+    both tables.
+ 2. Run this tool, which copies the existing rows. It scans the table by
+    token ranges (--splits), several at a time (--workers), at most --rate
+    rows per second, and records the completed ranges in a checkpoint file
+    so an interrupted run resumes where it stopped. Rows written by the
+    importer meanwhile are simply written again (inserts are idempotent).
+    Rows are copied as the JSON text read, with the Day added, so decimals
+    keep all their digits.
+ 3. Switch the readers to the bucketed tables (--bucketed, see readme.md)
+    and, once verified, restart the importer with --buckets only.
+
+The tables and their keys come from the schema registry (monroeschema.py).
+"""
+import argparse
+import json
+import os
+import sys
+import textwrap
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+from multiprocessing.pool import ThreadPool
+
+from cassandra.cluster import Cluster
+from cassandra.auth import PlainTextAuthProvider
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.query import SimpleStatement
+
+import monroeschema
+
+CMD_NAME = os.path.basename(__file__)
+MIN_TOKEN = -2 ** 63  # Murmur3Partitioner
+MAX_TOKEN = 2 ** 63 - 1
+CHUNK_ROWS = 500
+DEFAULT_RATE = 2000  # Rows per second, to leave room for the importer
+
+
+def log(log_str):
+    """Log with a timestamp."""
+    print("[{}] {}".format(datetime.now().isoformat(), log_str))
+    sys.stdout.flush()
+
+
+def token_ranges(splits):
+    """Split the token ring into splits (start, end] ranges."""
+    step = (MAX_TOKEN - MIN_TOKEN) // splits
+    bounds = [MIN_TOKEN + i * step for i in range(splits)] + [MAX_TOKEN]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class RateLimiter(object):
+    """Blocks callers so that at most rate units per second are acquired."""
+
+    def __init__(self, rate):
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self, units):
+        if self._interval == 0.0:
+            return
+        with self._lock:
+            now = time.time()
+            wait = self._next - now
+            self._next = max(self._next, now) + units * self._interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Checkpoint(object):
+    """Completed token ranges of a migration, saved after every range."""
+
+    def __init__(self, path, table, splits):
+        self._path = path
+        self._lock = threading.Lock()
+        self.state = {'table': table, 'splits': splits, 'done': {}}
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as f:
+                state = json.load(f)
+            if state['table'] != table or state['splits'] != splits:
+                raise Exception(("Checkpoint {} is of table {} with {} splits"
+                                 "").format(path, state['table'],
+                                            state['splits']))
+            self.state = state
+
+    def is_done(self, index):
+        return str(index) in self.state['done']
+
+    def done(self, index, rows):
+        with self._lock:
+            self.state['done'][str(index)] = rows
+            if self._path is not None:
+                tmp_path = self._path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(self.state, f, indent=1, sort_keys=True)
+                os.rename(tmp_path, self._path)
+
+
+def migrate_range(session, select, insert, token_range, first, page_size,
+                  concurrency, limiter):
+    """
+    Copy the rows of one token range, adding the day bucket.
+
+    Returns (rows copied, rows failed).
+    """
+    (start, end) = token_range
+    # The first range also holds the minimum token.
+    statement = SimpleStatement(select.format('>=' if first else '>'),
+                                fetch_size=page_size)
+    copied = 0
+    failed = 0
+    chunk = []
+    rows = iter(session.execute(statement, [start, end]))
+    while True:
+        row = next(rows, None)
+        if row is not None:
+            entry = json.loads(row[0], parse_float=Decimal)
+            day = monroeschema.bucket(entry[monroeschema.TIME_COLUMN])
+            # Add the Day to the text as read: encoding the entry again
+            # would turn its decimals into floats.
+            text = row[0].rstrip()
+            chunk.append([u'{}, "{}": {}}}'.format(
+                text[:-1], monroeschema.BUCKET_COLUMN, day)])
+        if len(chunk) >= CHUNK_ROWS or (row is None and chunk):
+            limiter.acquire(len(chunk))
+            results = execute_concurrent_with_args(session, insert, chunk,
+                                                   concurrency=concurrency,
+                                                   raise_on_first_error=False)
+            for (success, result) in results:
+                if success:
+                    copied += 1
+                else:
+                    log("Error inserting row: {}".format(result))
+                    failed += 1
+            chunk = []
+        if row is None:
+            return (copied, failed)
+
+
+def migrate_table(session, registry, table, splits, workers, page_size,
+                  concurrency, rate, checkpoint_path):
+    """Copy table into its bucketed variant. Returns the rows failed."""
+    info = registry['tables'][table]
+    bucketed = info['bucketed_table']
+    if bucketed is None:
+        raise Exception("{} has no day-bucketed table".format(table))
+    partition_key = ', '.join(info['partition_key'])
+    select = ("SELECT JSON * FROM {} WHERE token({}) {{}} ? AND token({}) <= ?"
+              "").format(table, partition_key, partition_key)
+    insert = session.prepare("INSERT INTO {} JSON ?".format(bucketed))
+    checkpoint = Checkpoint(checkpoint_path, table, splits)
+    limiter = RateLimiter(rate)
+    ranges = [(index, token_range)
+              for (index, token_range) in enumerate(token_ranges(splits))
+              if not checkpoint.is_done(index)]
+    log("Copying {} into {}: {} of {} token ranges left".format(
+        table, bucketed, len(ranges), splits))
+
+    totals = {'copied': 0, 'failed': 0}
+    totals_lock = threading.Lock()
+    start_time = time.time()
+
+    def copy_range(job):
+        (index, token_range) = job
+        try:
+            (copied, failed) = migrate_range(session, select, insert,
+                                             token_range, index == 0,
+                                             page_size, concurrency, limiter)
+        except Exception as error:
+            log("Error copying token range {}: {}".format(index, error))
+            return
+        if failed == 0:
+            checkpoint.done(index, copied)
+        with totals_lock:
+            totals['copied'] += copied
+            totals['failed'] += failed
+            elapsed = time.time() - start_time
+            log(("Token range {} done ({} rows, {} failed); "
+                 "{} rows copied, {:.0f} rows/s").format(
+                     index, copied, failed, totals['copied'],
+                     totals['copied'] / elapsed if elapsed > 0 else 0.0))
+
+    pool = ThreadPool(processes=max(1, workers))
+    pool.map(copy_range, ranges)
+    pool.close()
+    pool.join()
+    left = splits - len(checkpoint.state['done'])
+    log("Copied {} rows of {} ({} failed), {} token ranges left".format(
+        totals['copied'], table, totals['failed'], left))
+    return left
+
+
+def create_arg_parser():
+    """Create a argument parser and return it."""
+    parser = argparse.ArgumentParser(
+        prog=CMD_NAME,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''
+            Copies the rows of tables into their day-bucketed
+            <table>_daily variants, by token ranges, resuming from a
+            checkpoint.'''))
+    parser.add_argument('tables',
+                        nargs='+',
+                        help="Tables to copy (e.g. monroe_exp_ping)")
+    parser.add_argument('-u', '--user',
+                        help="Cassandra username")
+    parser.add_argument('-p', '--password',
+                        help="Cassandra password")
+    parser.add_argument('--authenv',
+                        action="store_true",
+                        help=("Use environment variables MONROE_DB_USER and "
+                              "MONROE_DB_PASSWD as username and password"))
+    parser.add_argument('-H', '--hosts',
+                        nargs='+',
+                        default=["127.0.0.1"],
+                        help="Hosts in the cluster (default 127.0.0.1)")
+    parser.add_argument('-k', '--keyspace',
+                        default="monroe",
+                        help="Keyspace to use (default monroe)")
+    parser.add_argument('--splits',
+                        metavar='N',
+                        type=int,
+                        default=1024,
+                        help="Token ranges per table (default 1024)")
+    parser.add_argument('-w', '--workers',
+                        metavar='N',
+                        type=int,
+                        default=4,
+                        help="Token ranges copied in parallel (default 4)")
+    parser.add_argument('-c', '--concurrency',
+                        metavar='N',
+                        type=int,
+                        default=32,
+                        help="Concurrent inserts per worker (default 32)")
+    parser.add_argument('--page-size',
+                        metavar='N',
+                        type=int,
+                        default=1000,
+                        help="Rows per page of the scans (default 1000)")
+    parser.add_argument('--rate',
+                        metavar='ROWS',
+                        type=float,
+                        default=DEFAULT_RATE,
+                        help=("Maximum rows per second over all workers, "
+                              "0 for unlimited (default {})").format(
+                                  DEFAULT_RATE))
+    parser.add_argument('--checkpoint-dir',
+                        metavar='DIR',
+                        default=".",
+                        help=("Directory of the checkpoint files "
+                              "(<table>.migrate.json, default .)"))
+    parser.add_argument('--registry',
+                        metavar='FILE',
+                        default=monroeschema.DEFAULT_REGISTRY,
+                        help="Schema registry (default {})".format(
+                            monroeschema.DEFAULT_REGISTRY))
+    return parser
+
+
+if __name__ == '__main__':
+    parser = create_arg_parser()
+    args = parser.parse_args()
+    db_user = args.user
+    db_password = args.password
+    if args.authenv:
+        db_user = db_user or os.environ.get('MONROE_DB_USER')
+        db_password = db_password or os.environ.get('MONROE_DB_PASSWD')
+    if not (db_user and db_password):
+        parser.error('either --authenv or -u/--user USER and -p/--password '
+                     'PASSWORD needs to be defined')
+    if args.splits < 1:
+        parser.error('--splits must be at least 1')
+
+    registry = monroeschema.load_registry(args.registry)
+    for table in args.tables:
+        if table not in registry['tables']:
+            parser.error("unknown table {}".format(table))
+
+    auth = PlainTextAuthProvider(username=db_user, password=db_password)
+    cluster = Cluster(args.hosts, auth_provider=auth, protocol_version=4,
+                      schema_metadata_enabled=False)
+    session = cluster.connect(args.keyspace)
+    session.default_timeout = None
+
+    left = 0
+    for table in args.tables:
+        checkpoint_path = os.path.join(args.checkpoint_dir,
+                                       "{}.migrate.json".format(table))
+        left += migrate_table(session, registry, table, args.splits,
+                              args.workers, args.page_size, args.concurrency,
+                              args.rate, checkpoint_path)
+    cluster.shutdown()
+    raise SystemExit(1 if left > 0 else 0)
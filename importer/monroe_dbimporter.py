@@ -28,7 +28,20 @@ import textwrap
 from multiprocessing.pool import ThreadPool
 from multiprocessing import cpu_count
 import fnmatch
+import subprocess
+import tarfile
 import monroevalidator
+import monroerollup
+import monroenmea
+import monroe_archiver
+import monroeschema
+import monroeclaim
+import monroerouting
+import monroeprofile
+import monroededup
+import monroetabular
+import functools
+from itertools import chain, islice
 import lzma
 import errno
 import syslog
@@ -41,8 +54,28 @@ from cassandra import InvalidRequest
 from cassandra.auth import PlainTextAuthProvider
 
 CMD_NAME = os.path.basename(__file__)
+# Archive extension: decompress command (see monroe_archiver.py)
+ARCHIVE_DECOMPRESSORS = dict(
+    (extension, decompress)
+    for (extension, compress, decompress) in
+    monroe_archiver.COMPRESSORS.values())
+ARCHIVE_DECOMPRESSORS['.tar'] = None
 DEBUG = False
 VERBOSITY = 1
+# Entries parsed, validated and inserted at a time by handle_file; the
+# inserts of a chunk run while the next chunk is parsed
+CHUNK_ENTRIES = 500
+READ_BYTES = 1 << 20
+# Writes to the day-bucketed tables (<table>_daily, see db_schema.cql):
+# off, dual (also insert into them) or only (insert into them instead)
+BUCKET_WRITES = 'off'
+BUCKET_MODES = ('off', 'dual', 'only')
+# Per-stage profiling (--profile, see monroeprofile.py)
+PROFILER = monroeprofile.NullProfiler()
+# Skips entries inserted before (--dedup, see monroededup.py)
+DEDUP = None
+# Imports CSV/TSV files (--tabular, see monroetabular.py)
+TABULAR = False
 
 
 def log_msg(log_str, syslog_level, verbosity_level):
@@ -53,14 +86,13 @@ def log_msg(log_str, syslog_level, verbosity_level):
         print (log_str)
 
 
-def parse_json(f, filename):
+def iter_json(f, filename):
     """
-    Parse JSON objects from open file f.
+    Parse JSON objects from open file f, yielding them as they are parsed.
 
     Several objects may be present in the file, and an object may be spread
     across several lines. Two objects may not occupy the same line.
     """
-    jsons = []
     fname, fextension = os.path.splitext(filename)
     for line in f:
         # This while loops allow JSON objects to be pretty printed in the files
@@ -80,7 +112,7 @@ def parse_json(f, filename):
             # try/catch however this is "hairy" as JSON allows {} inside
             # strings, see comment by Petr Viktorin http://tinyurl.com/gvwq7cy
             try:
-                jsons.append(json.loads(line))
+                entry = json.loads(line)
                 break
             except ValueError:
                 # Not yet a complete JSON value add next line and try again
@@ -91,13 +123,190 @@ def parse_json(f, filename):
                     # End of file without complete JSON object; probably a
                     # malformed file, discard entire file for now
                     raise Exception("Parse Error {}".format(error))
+        yield entry
 
     #TODO : Check why xz is on multiple line
     if (not each_json_on_single_line):
         log_str = ("possible performance hit : file {} contains "
                    "pretty printed JSON objects").format(filename)
         log_msg(log_str, syslog.LOG_WARNING, 1)
-    return jsons
+
+
+def parse_json(f, filename):
+    """Return the list of the JSON objects of open file f (see iter_json)."""
+    return list(iter_json(f, filename))
+
+
+def decompressed_lines(f):
+    """Yield the lines of .xz file f, decompressing READ_BYTES at a time."""
+    decompressor = lzma.LZMADecompressor()
+    pending = ""
+    while True:
+        data = f.read(READ_BYTES)
+        if not data:
+            break
+        with PROFILER.stage('decompress'):
+            lines = (pending + decompressor.decompress(data)).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def read_chunks(filename, path):
+    """
+    Yield the entries of file filename, read from path, by chunks.
+
+    Chunks of JSON files are lists of up to CHUNK_ENTRIES entries (dicts),
+    the ones of CSV/TSV files TabularChunks (see monroetabular.py).
+    """
+    with open(path, 'rb') as f:
+        for chunk in stream_chunks(filename, f):
+            yield chunk
+
+
+def stream_chunks(filename, f):
+    """Yield the entries of file filename by chunks (see read_chunks)."""
+    for chunk in line_chunks(filename, file_lines(filename, f)):
+        yield chunk
+
+
+def file_lines(filename, f):
+    """Return an iterator of the (decompressed) lines of file filename."""
+    fname, fextension = os.path.splitext(filename)
+    if fextension.endswith('.xz'):
+        return decompressed_lines(f)
+    elif (fextension.endswith('.json') or
+          monroetabular.is_tabular(filename)):
+        return iter(f)  # Archive members are iterable, not iterators
+    raise Exception("Unknown fileformat {}".format(fextension))
+
+
+def line_chunks(filename, lines):
+    """Yield the entries of the lines of file filename by chunks."""
+    if monroetabular.is_tabular(filename):
+        (table, values) = monroetabular.table_of(filename)
+        tabular = monroetabular.TabularFile(lines,
+                                            monroeschema.get_registry(),
+                                            table,
+                                            values)
+        for chunk in tabular.chunks(CHUNK_ENTRIES):
+            yield chunk
+    else:
+        entries = iter_json(lines, filename)
+        while True:
+            chunk = list(islice(entries, CHUNK_ENTRIES))
+            if not chunk:
+                break
+            yield chunk
+
+
+class Bitmap(object):
+    """Set of entry numbers (one bit per entry up to the highest one)."""
+
+    def __init__(self):
+        self.bits = bytearray()
+        self.count = 0
+
+    def add(self, nr):
+        index = nr >> 3
+        if index >= len(self.bits):
+            self.bits.extend(bytearray(index + 1 - len(self.bits)))
+        if not self.bits[index] & (1 << (nr & 7)):
+            self.bits[index] |= 1 << (nr & 7)
+            self.count += 1
+
+    def __contains__(self, nr):
+        index = nr >> 3
+        return index < len(self.bits) and bool(self.bits[index] &
+                                               (1 << (nr & 7)))
+
+    def __len__(self):
+        return self.count
+
+
+class PartFile(object):
+    """
+    Entries written to a part file as they come: JSON objects, or the rows
+    as read for CSV/TSV files. The file is created by the first write.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+        self.writer = None
+
+    def write(self, chunk, nr):
+        if self.f is None:
+            self.f = open(self.path, 'w')
+        if isinstance(chunk, monroetabular.TabularChunk):
+            if self.writer is None:
+                self.writer = chunk.tabular.writer(self.f)
+            self.writer.writerow(chunk.text_row(nr))
+        else:
+            self.f.write(json.dumps(chunk[nr]))
+            self.f.write(os.linesep)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+
+    def remove(self):
+        """Close and delete the file, if it was created."""
+        self.close()
+        if self.f is not None:
+            os.unlink(self.path)
+            self.f = None
+
+
+def write_parts(filename, path, entries, failed_inserts, processed_part,
+                tail_path=None):
+    """
+    Write the first entries of file filename (read from path), but the
+    failed_inserts, to processed_part and, with tail_path, the lines after
+    them (as read, decompressed, after the header line of CSV/TSV files,
+    with their extra columns) to tail_path: the part of a file not parsed
+    after a parse error.
+    """
+    with open(path, 'rb') as f:
+        lines = file_lines(filename, f)
+        header = []
+        if monroetabular.is_tabular(filename):
+            header = [next(lines)]
+        # Chunks are read from lines as needed, the tail is what is left
+        chunks = line_chunks(filename, chain(header, lines))
+        nr = 0
+        extra = ('', '')
+        while nr < entries:
+            chunk = next(chunks)
+            for chunk_nr in range(len(chunk)):
+                if nr + chunk_nr not in failed_inserts:
+                    processed_part.write(chunk, chunk_nr)
+            nr += len(chunk)
+            if isinstance(chunk, monroetabular.TabularChunk):
+                tabular = chunk.tabular
+                extra = tuple(''.join(tabular.delimiter + text
+                                      for text in texts)
+                              for texts in (tabular.extra_names,
+                                            tabular.extra_texts))
+        processed_part.close()
+        if tail_path is not None:
+            with open(tail_path, 'w') as tail:
+                for (nr, line) in enumerate(chain(header, lines)):
+                    line = line.rstrip('\r\n')
+                    if line.strip():
+                        line += extra[0] if nr < len(header) else extra[1]
+                    tail.write(line + '\n')
+
+
+def part_extension(filename):
+    """Extension of the part files of filename (.json, .csv or .tsv)."""
+    if filename.endswith('.xz'):
+        filename = filename[:-len('.xz')]
+    if monroetabular.is_tabular(filename):
+        return os.path.splitext(filename)[1]
+    return ".json"
 
 
 def construct_filepath(filename, dest_dir, middlefix="", extension=None):
@@ -109,80 +318,299 @@ def construct_filepath(filename, dest_dir, middlefix="", extension=None):
     return os.path.join(dest_dir, os.path.basename(dest_name))
 
 
+def entry_inserts(j, prepared_statements, data_id, columns=None, values=None):
+    """
+    Return the [(statement, parameters)] inserting entry j, as JSON or, for
+    CSV/TSV rows, the values of columns (see monroetabular.py).
+    """
+    if columns is None:
+        statement = prepared_statements[data_id]
+        parameters = [json.dumps(j)]
+    else:
+        statement = prepared_statements.columns(data_id, columns)
+        parameters = values
+    bucketed = None
+    if BUCKET_WRITES != 'off':
+        if columns is None:
+            bucketed = prepared_statements.bucketed(data_id)
+        else:
+            bucketed = prepared_statements.bucketed_columns(data_id, columns)
+    inserts = []
+    if bucketed is None or BUCKET_WRITES == 'dual':
+        inserts.append((statement, parameters))
+    if bucketed is not None:
+        day = monroeschema.bucket(j['Timestamp'])
+        if columns is None:
+            inserts.append((bucketed, [json.dumps(dict(j, Day=day))]))
+        else:
+            inserts.append((bucketed, values + (day,)))
+    return inserts
+
+
+def start_inserts(chunk, session, prepared_statements, data_ids=None):
+    """
+    Validate the entries of a chunk and start their inserts.
+
+    chunk is a list of entries or a TabularChunk (see monroetabular.py).
+    Entries whose DataId is not in data_ids (if not None, lower case) and,
+    with --dedup, entries inserted before are skipped.
+    Returns ([(number, entry, insert futures)] of the started entries,
+    [(number, error)] of the failed ones, number of skipped entries); the
+    inserts are completed by finish_inserts.
+    """
+    tabular = isinstance(chunk, monroetabular.TabularChunk)
+    started = []
+    failed_inserts = []
+    skipped = 0
+    for nr in range(len(chunk)):
+        try:
+            j = chunk.entry(nr) if tabular else chunk[nr]
+            if data_ids is not None:
+                if str(j.get('DataId')).lower() not in data_ids:
+                    skipped += 1
+                    continue
+            futures = []
+            if not DEBUG:
+                with PROFILER.stage('validate'):
+                    (data_ok, log_str) = monroevalidator.check(j, VERBOSITY)
+                    if not data_ok:
+                        raise Exception("Validation error : {}".format(
+                            log_str))
+                    if not tabular:  # Rows are annotated by their chunk
+                        j = monroenmea.annotated(j)
+                if DEDUP is not None:
+                    with PROFILER.stage('dedup'):
+                        duplicate = DEDUP.seen(j)
+                    if duplicate:
+                        skipped += 1
+                        continue
+                with PROFILER.stage('insert'):
+                    if tabular:
+                        inserts = entry_inserts(j,
+                                                prepared_statements,
+                                                chunk.data_id,
+                                                chunk.columns,
+                                                chunk.values[nr])
+                    else:
+                        inserts = entry_inserts(j,
+                                                prepared_statements,
+                                                j['DataId'].lower())
+                    futures = [session.execute_async(statement, parameters)
+                               for (statement, parameters) in inserts]
+            started.append((nr, j, futures))
+
+        except Exception as error:
+            failed_inserts.append((nr, str(error)))
+    return (started, failed_inserts, skipped)
+
+
+def finish_inserts(started, rollup=None):
+    """
+    Wait for the inserts started by start_inserts.
+
+    Inserted entries are added to rollup (a RollupSource, if not None).
+    Returns (numbers of the inserted entries, [(number, error)] of the
+    failed ones).
+    """
+    processed_inserts = []
+    failed_inserts = []
+    for (nr, j, futures) in started:
+        try:
+            with PROFILER.stage('insert'):
+                for future in futures:
+                    future.result()
+            if not DEBUG:
+                if DEDUP is not None:
+                    DEDUP.add(j)
+                if rollup is not None:
+                    rollup.add(j)
+            processed_inserts.append(nr)
+
+        except Exception as error:
+            failed_inserts.append((nr, str(error)))
+    return (processed_inserts, failed_inserts)
+
+
+def insert_entries(chunk,
+                   session,
+                   prepared_statements,
+                   rollup=None,
+                   data_ids=None):
+    """
+    Validate and insert the entries of a chunk (see start_inserts).
+
+    Inserted entries are added to rollup (a RollupSource, if not None).
+    Returns (numbers of the inserted entries, [(number, error)] of the
+    failed ones, number of skipped entries).
+    """
+    (started, failed_inserts, skipped) = start_inserts(chunk,
+                                                       session,
+                                                       prepared_statements,
+                                                       data_ids)
+    (processed_inserts, failed) = finish_inserts(started, rollup)
+    return (processed_inserts, sorted(failed_inserts + failed), skipped)
+
+
+def profiled_file(function):
+    """Record the time and memory of function(filename, ...) in PROFILER."""
+    @functools.wraps(function)
+    def wrapper(filename, *args, **kwargs):
+        with PROFILER.file(filename):
+            return function(filename, *args, **kwargs)
+    return wrapper
+
+
+@profiled_file
 def handle_file(filename,
                 failed_dir,
                 processed_dir,
                 session,
-                prepared_statements):
+                prepared_statements,
+                rollup=None,
+                claims=None):
     """
     Parse and insert file in db.
 
     Parse the file and tries to insert it into the database.
     move finished files to failed_dir and sucsseful to processed_dir.
+    Inserted entries are added to rollup (if not None) as the source of the
+    file name (see monroerollup.py), finished once the file is done.
+    With claims (see monroeclaim.py) the file is first claimed; if another
+    instance claimed it, it is skipped ('claimed' is False in the result).
+
+    The file is read, validated and inserted by chunks of CHUNK_ENTRIES
+    entries (see read_chunks), the inserts of a chunk running while the
+    next one is parsed, so memory does not grow with the size of the file.
+    Failed entries are written to the failed part as they fail and recorded
+    in a bitmap, from which the processed part is written at the end. After
+    a parse error the lines not parsed are written to the parse error part
+    (see write_parts).
     """
-    json_statements = []
-    nr_jsons = 0
+    if claims is not None:
+        try:
+            claimed = claims.claim(filename)
+        except Exception as error:
+            log_str = "Error claiming {}: {}".format(filename, error)
+            log_msg(log_str, syslog.LOG_ERR, 1)
+            return {'inserts': 0, 'failed': 0, 'claimed': False}
+        if claimed is None:
+            log_str = "{} claimed by another instance".format(filename)
+            log_msg(log_str, syslog.LOG_INFO, 2)
+            return {'inserts': 0, 'failed': 0, 'claimed': False}
+        filename = claimed
+    source = None
+    if rollup is not None:
+        source = rollup.source(monroerollup.source_name(filename))
+    path = filename
+    # The part files are named after the .wip file
+    wip_name = filename + ".wip"
+    parse_error = None
+    chunk = None
     try:
         # Sanity Check 1: Zero files size and existance check
         if os.stat(filename).st_size == 0:
             raise Exception("Zero file size")
+        chunks = read_chunks(filename, path)
+        with PROFILER.stage('parse'):
+            chunk = next(chunks, None)
 
-        json_store = []
-        # Read and parse file
-        fname, fextension = os.path.splitext(filename)
-        if fextension.endswith('.xz'):
-            # WORKAROUND to avoid CRASH in LZMAFile 
-	    with open(filename, 'rb') as f:
-		complete_file =  iter(lzma.LZMADecompressor().decompress(f.read()).splitlines())
-                json_store.extend(parse_json(complete_file, filename))
-        elif fextension.endswith('.json'):
-            with open(filename, 'r') as f:
-                json_store.extend(parse_json(f, filename))
-        else:
-            raise Exception("Unknown fileformat {}".format(fextension))
-
-        nr_jsons = len(json_store)
-        dest_path = filename + ".wip"
         if not DEBUG:
-            os.rename(filename, dest_path)
-
-        filename = dest_path
-    # Fail: We could not parse the file
+            with PROFILER.stage('move'):
+                os.rename(filename, wip_name)
+            path = wip_name
+    # Fail: We could not read the file
     except Exception as error:
-        dest_path = construct_filepath(filename, failed_dir, "_parse-error")
-        log_str = "{} in file, moving {} to {}".format(error,
-                                                       filename,
-                                                       dest_path)
-        log_msg(log_str, syslog.LOG_ERR, 1)
-        if not DEBUG:
-            os.rename(filename, dest_path)
-
-        return {'inserts': -1, 'failed': 0}
+        parse_error = error
+        chunk = None
 
     # Try to insert queries into db
     # This code assuems there is no breakage during the import
     # (ie the importer is not stopped while trying to do inserts)
     # If so happens there will be a .wip file left in the indir
     # and we are left in incosisten state that needs manual handling
-    failed_inserts = []
-    processed_inserts = []
-    for nr, j in enumerate(json_store):
+    dest_path_failed = construct_filepath(wip_name,
+                                          failed_dir,
+                                          "_failed-part",
+                                          part_extension(filename))
+    failed_part = PartFile(dest_path_failed)
+    failed_inserts = Bitmap()
+    nr_jsons = 0
+    nr_inserts = 0
+    started = None
+    while chunk is not None:
+        chunk_started = start_inserts(chunk, session, prepared_statements)
+        if started is not None:
+            # The inserts of the previous chunk ran while this one was parsed
+            nr_inserts += finish_chunk(filename, started, source,
+                                       failed_inserts, failed_part)
+        started = (nr_jsons, chunk, chunk_started)
+        nr_jsons += len(chunk)
         try:
-            if not DEBUG:
-                data_id = j['DataId'].lower()
-                (data_ok, log_str) = monroevalidator.check(j, VERBOSITY)
-                if not data_ok:
-                    raise Exception("Validation error : {}".format(log_str))
-                session.execute(prepared_statements[data_id],
-                                [json.dumps(j)])
-            processed_inserts.append(nr)
-
+            with PROFILER.stage('parse'):
+                chunk = next(chunks, None)
         except Exception as error:
-            failed_inserts.append((nr, str(error)))
+            # The entries before are inserted: saved apart from the rest
+            parse_error = error
+            chunk = None
+    if started is not None:
+        nr_inserts += finish_chunk(filename, started, source,
+                                   failed_inserts, failed_part)
+    failed_part.close()
+    if source is not None:
+        source.finish()
+
+    # Fail: We could not parse (the rest of) the file
+    if parse_error is not None and nr_jsons > 0:
+        # The inserted entries go to the processed part and the lines not
+        # parsed to the parse error part (high-cost: the file is read again)
+        dest_path_processed = construct_filepath(wip_name,
+                                                 processed_dir,
+                                                 "_processed-part",
+                                                 part_extension(filename))
+        dest_path = construct_filepath(wip_name,
+                                       failed_dir,
+                                       "_parse-error",
+                                       part_extension(filename))
+        log_str = ("{} in file {} after {} entries, saving them in {} (failed "
+                   "in {}) and the rest in {}").format(parse_error,
+                                                       filename,
+                                                       nr_jsons,
+                                                       dest_path_processed,
+                                                       dest_path_failed,
+                                                       dest_path)
+        log_msg(log_str, syslog.LOG_ERR, 1)
+        if DEBUG:
+            return {'inserts': -1, 'failed': len(failed_inserts)}
+        with PROFILER.stage('move'):
+            processed_part = PartFile(dest_path_processed)
+            try:
+                write_parts(filename, path, nr_jsons, failed_inserts,
+                            processed_part, dest_path)
+                os.unlink(path)
+                return {'inserts': -1, 'failed': len(failed_inserts)}
+            except Exception as error:
+                # E.g. a corrupt .xz, the rest of which cannot be read
+                processed_part.remove()
+                if os.path.exists(dest_path):
+                    os.unlink(dest_path)
+                parse_error = error
+
+    if parse_error is not None:
+        dest_path = construct_filepath(filename, failed_dir, "_parse-error")
+        log_str = "{} in file, moving {} to {}".format(parse_error,
+                                                       filename,
+                                                       dest_path)
+        log_msg(log_str, syslog.LOG_ERR, 1)
+        if not DEBUG:
+            with PROFILER.stage('move'):
+                failed_part.remove()
+                os.rename(path, dest_path)
+
+        return {'inserts': -1, 'failed': 0}
 
     # If all is ok move file as-is to processed (low-cost)
     if len(failed_inserts) == 0:
-        dest_path = construct_filepath(filename,
+        dest_path = construct_filepath(wip_name,
                                        processed_dir,
                                        "",
                                        "")
@@ -192,67 +620,157 @@ def handle_file(filename,
                                           dest_path)
         log_msg(log_str, syslog.LOG_INFO, 1)
         if not DEBUG:
-            os.rename(filename, dest_path)
+            with PROFILER.stage('move'):
+                os.rename(path, dest_path)
 
     # IF all is bad move file as-is to failed (low-cost)
     elif len(failed_inserts) == nr_jsons:
-        dest_path = construct_filepath(filename,
+        dest_path = construct_filepath(wip_name,
                                        failed_dir,
                                        "",
                                        "")
 
         log_str = ("Failed {} (all) insert(s) in file {} "
-                   "moving to {}; ").format(nr_jsons,
-                                            filename,
-                                            dest_path)
-        for nr, error in failed_inserts:
-            log_str += "{} Failed with {}, ".format(nr, error)
-
+                   "moving to {}").format(nr_jsons,
+                                          filename,
+                                          dest_path)
         log_msg(log_str, syslog.LOG_ERR, 1)
         if not DEBUG:
-            os.rename(filename, dest_path)
+            with PROFILER.stage('move'):
+                failed_part.remove()
+                os.rename(path, dest_path)
 
-    # If some fail and some succed write the ones that failed to failed dir
-    # and rest to processed dir (high-cost)
+    # If some fail and some succed the ones that failed are in the failed
+    # part, write the rest to processed dir (high-cost: the file is read
+    # again)
     else:
-        dest_path_failed = construct_filepath(filename,
-                                              failed_dir,
-                                              "_failed-part",
-                                              ".json")
-
-        dest_path_processed = construct_filepath(filename,
+        dest_path_processed = construct_filepath(wip_name,
                                                  processed_dir,
                                                  "_processed-part",
-                                                 ".json")
+                                                 part_extension(filename))
         log_str_error = ("Failed {} ({}) inserts in file {} "
-                         "saving in {};").format(len(failed_inserts),
-                                                 nr_jsons,
-                                                 filename,
-                                                 dest_path_failed)
-        for nr, error in failed_inserts:
-            log_str_error += "{} Failed with {}, ".format(nr, error)
+                         "saved in {}").format(len(failed_inserts),
+                                               nr_jsons,
+                                               filename,
+                                               dest_path_failed)
 
         log_str_processed = ("Succeded with {} ({}) insert(s) in file {} "
-                             "saving in {}").format(len(processed_inserts),
+                             "saving in {}").format(nr_inserts,
                                                     nr_jsons,
                                                     filename,
                                                     dest_path_processed)
         log_msg(log_str_error, syslog.LOG_ERR, 1)
         log_msg(log_str_processed, syslog.LOG_INFO, 1)
         if not DEBUG:
-            os.unlink(filename)
+            with PROFILER.stage('move'):
+                processed_part = PartFile(dest_path_processed)
+                write_parts(filename, path, nr_jsons, failed_inserts,
+                            processed_part)
+                os.unlink(path)
+
+    return {'inserts': nr_inserts, 'failed': len(failed_inserts)}
+
+
+def finish_chunk(filename, started, rollup, failed_inserts, failed_part):
+    """
+    Complete the inserts of a chunk of handle_file.
+
+    started is (number of the first entry of the chunk in the file, chunk,
+    result of start_inserts). The failed entries are logged, added to the
+    failed_inserts bitmap and written to failed_part (unless DEBUG).
+    Returns the number of inserted entries.
+    """
+    (first, chunk, (entries, failed, skipped)) = started
+    (processed_inserts, failed_finished) = finish_inserts(entries, rollup)
+    failed = sorted(failed + failed_finished)
+    if failed:
+        log_str = "Failed {} insert(s) in file {}; ".format(len(failed),
+                                                             filename)
+        for nr, error in failed:
+            log_str += "{} Failed with {}, ".format(first + nr, error)
+            failed_inserts.add(first + nr)
+            if not DEBUG:
+                failed_part.write(chunk, nr)
+        log_msg(log_str, syslog.LOG_ERR, 1)
+    return len(processed_inserts)
+
+
+def flush_rollup(rollup):
+    """Flush the rollup buckets and log the outcome."""
+    try:
+        (written, failed, kept, error) = rollup.flush()
+        log_str = "Flushed {} rollup buckets".format(written)
+        log_msg(log_str, syslog.LOG_INFO, 1)
+        if failed > 0:
+            log_str = ("Failed to flush {} rollup buckets ({}), their "
+                       "samples may be missing").format(failed, error)
+            log_msg(log_str, syslog.LOG_WARNING, 0)
+        if kept > 0:
+            log_str = ("Failed to record {} rollup sources ({}), "
+                       "retrying next scan").format(kept, error)
+            log_msg(log_str, syslog.LOG_WARNING, 0)
+    except Exception as error:
+        log_str = "Error in flushing rollups {}".format(error)
+        log_msg(log_str, syslog.LOG_ERR, 0)
 
-            with open(dest_path_failed, 'w') as f:
-                for nr, error in failed_inserts:
-                    f.write(json.dumps(json_store[nr]))
-                    f.write(os.linesep)
 
-            with open(dest_path_processed, 'w') as f:
-                for nr in processed_inserts:
-                    f.write(json.dumps(json_store[nr]))
-                    f.write(os.linesep)
+def save_dedup(dedup):
+    """Save the dedup filters and log the duplicates skipped since last."""
+    try:
+        (checked, duplicates, days) = dedup.save(time.time())
+        log_str = ("Skipped {} duplicate(s) of {} checked entries").format(
+            duplicates, checked)
+        log_msg(log_str, syslog.LOG_INFO, 1)
+        for day in sorted(days):
+            if days[day] > dedup.capacity:
+                day_date = datetime.utcfromtimestamp(day * monroededup.DAY)
+                log_str = ("Dedup filter of {} holds {} entries, more than "
+                           "--dedup-capacity {}").format(day_date.date(),
+                                                         days[day],
+                                                         dedup.capacity)
+                log_msg(log_str, syslog.LOG_WARNING, 0)
+    except Exception as error:
+        log_str = "Error in saving dedup filters {}".format(error)
+        log_msg(log_str, syslog.LOG_ERR, 0)
+
 
-    return {'inserts': len(processed_inserts), 'failed': len(failed_inserts)}
+def recover_claims(claims, own=False):
+    """
+    Take back the files claimed by dead instances and log them.
+
+    With own, start claims instead, taking back its own leftover claims.
+    """
+    try:
+        recovered = claims.start() if own else claims.recover()
+    except Exception as error:
+        log_str = "Error in recovering claims {}".format(error)
+        log_msg(log_str, syslog.LOG_ERR, 0)
+        return
+    for (claimed, restored) in recovered:
+        log_str = "Recovered stale claim {} to {}".format(claimed, restored)
+        log_msg(log_str, syslog.LOG_WARNING, 0)
+
+
+def handle_routed_file(router, table, mtime, *args):
+    """handle_file(*args), recording the lag of the file in router."""
+    result = handle_file(*args)
+    if result.get('claimed', True):
+        router.done(table, mtime)
+    return result
+
+
+def report_lags(router):
+    """Log the lag of every table in the last scan and the SLO misses."""
+    for (table, files, max_lag, slo, late) in router.report():
+        log_str = ("{}: {} files, max lag {:.0f} s"
+                   "").format(table or "unclassified", files, max_lag)
+        if slo is not None:
+            log_str += ", SLO {} s, {} files late".format(slo, late)
+        log_msg(log_str, syslog.LOG_INFO, 1)
+        if late > 0:
+            log_str = ("{} files of {} missed the freshness SLO of {} s "
+                       "(max lag {:.0f} s)").format(late, table, slo, max_lag)
+            log_msg(log_str, syslog.LOG_WARNING, 0)
 
 
 def schedule_workers(in_dir,
@@ -261,11 +779,29 @@ def schedule_workers(in_dir,
                      concurrency,
                      session,
                      prepared_statements,
-                     recursive):
-    """Traverse the directory tree and kick off workers to handle the files."""
+                     recursive,
+                     rollup=None,
+                     claims=None,
+                     router=None,
+                     wait=True,
+                     scan=True):
+    """
+    Traverse the directory tree and kick off workers to handle the files.
+
+    With a router (see monroerouting.py) files are started by deadline in
+    the pool of their table, files still in flight are skipped and, unless
+    wait, only the files done by now are counted: the others are counted
+    by a later scan. Without scan no new files are started.
+    """
     file_count = 0
-    pool = ThreadPool(processes=concurrency)
+    pool = None
+    if router is None:
+        pool = ThreadPool(processes=concurrency)
     async_results = []
+    routed = []
+
+    if claims is not None:
+        recover_claims(claims)
 
     # Create outdirs
     dest_dir_processed = processed_dir + str(date.today())
@@ -286,28 +822,84 @@ def schedule_workers(in_dir,
 
     # Scan in_dir and look for all files ending in .json excluding
     # processsed_dir and failed_dir to avoid insert "loops"
-    for root, dirs, files in os.walk(in_dir, topdown=True):
-        if not recursive and len(dirs) > 0:
-            dirs[:] = dirs[0]
-        for extension in ('*.json', '*.xz'):
-            for filename in fnmatch.filter(files, extension):
-                path = os.path.join(root, filename)
-                file_count += 1
-		log_msg("Start : {}".format(path), syslog.LOG_INFO, 1)
-                result = pool.apply_async(handle_file,
-                                          (path,
-                                           dest_dir_failed,
-                                           dest_dir_processed,
-                                           session,
-                                           prepared_statements,))
-                async_results.append(result)
-
-    pool.close()
-    pool.join()
+    with PROFILER.stage('scan'):
+        for root, dirs, files in (os.walk(in_dir, topdown=True)
+                                  if scan else []):
+            # Skip the claimed files of all instances
+            dirs[:] = [d for d in dirs if d != monroeclaim.CLAIMS_DIR]
+            if not recursive and len(dirs) > 0:
+                dirs[:] = dirs[0]
+            for extension in ('*.json', '*.xz', '*.csv', '*.tsv'):
+                for filename in fnmatch.filter(files, extension):
+                    if monroetabular.is_tabular(filename) and not TABULAR:
+                        continue
+                    path = os.path.join(root, filename)
+                    if router is not None:
+                        if router.in_flight(path):
+                            continue
+                        try:
+                            mtime = os.stat(path).st_mtime
+                        except OSError:
+                            # Claimed by another instance meanwhile
+                            continue
+                        (table, deadline) = router.route(path, mtime)
+                        routed.append((deadline, mtime, path, table))
+                        continue
+                    file_count += 1
+                    log_msg("Start : {}".format(path), syslog.LOG_INFO, 1)
+                    result = pool.apply_async(handle_file,
+                                              (path,
+                                               dest_dir_failed,
+                                               dest_dir_processed,
+                                               session,
+                                               prepared_statements,
+                                               rollup,
+                                               claims,))
+                    async_results.append(result)
+
+    # Oldest first among the files of a deadline (e.g. of no SLO)
+    for (deadline, mtime, path, table) in sorted(routed):
+        log_msg("Start : {} ({})".format(path, table), syslog.LOG_INFO, 1)
+        router.start(table,
+                     path,
+                     deadline,
+                     mtime,
+                     handle_routed_file,
+                     (router,
+                      table,
+                      mtime,
+                      path,
+                      dest_dir_failed,
+                      dest_dir_processed,
+                      session,
+                      prepared_statements,
+                      rollup,
+                      claims,))
+
+    in_flight = 0
+    if router is None:
+        pool.close()
+        pool.join()
+    else:
+        (async_results, in_flight) = router.collect(wait)
+        file_count = len(async_results)
+        if in_flight > 0:
+            log_str = "{} files still in flight".format(in_flight)
+            log_msg(log_str, syslog.LOG_INFO, 1)
+
+    if rollup is not None:
+        flush_rollup(rollup)
+    # The filters of files in flight would skip their inserted entries
+    # when recovered, and these would miss from their rollups
+    if DEDUP is not None and (in_flight == 0 or rollup is None):
+        save_dedup(DEDUP)
 
     results = None
     try:
         results = [async_result.get() for async_result in async_results]
+        # Files claimed by other instances are not counted
+        results = [e for e in results if e.get('claimed', True)]
+        file_count = len(results)
         # Parse errors generate inserts = -1, failed = 0
     except Exception as error:
         log_str = "Error in reading return values {}".format(error)
@@ -336,19 +928,23 @@ def schedule_workers(in_dir,
             failed_parse_files_count = 0
             failed_insert_files_count = 0
 
-    # Remove empty dirs
-    try:
-        # Will only succed if the directory is empty
-        os.rmdir(dest_dir_failed)
-    except OSError as e:
-        # If the directory is not empty we do nothing
-        pass
-    try:
-        # Will only succed if the directory is empty
-        os.rmdir(dest_dir_processed)
-    except OSError as e:
-        # If the directory is not empty we do nothing
-        pass
+    if router is not None:
+        report_lags(router)
+
+    # Remove empty dirs, unless files in flight are still to be moved there
+    if in_flight == 0:
+        try:
+            # Will only succed if the directory is empty
+            os.rmdir(dest_dir_failed)
+        except OSError as e:
+            # If the directory is not empty we do nothing
+            pass
+        try:
+            # Will only succed if the directory is empty
+            os.rmdir(dest_dir_processed)
+        except OSError as e:
+            # If the directory is not empty we do nothing
+            pass
 
     return (file_count,
             insert_count,
@@ -357,6 +953,188 @@ def schedule_workers(in_dir,
             failed_insert_files_count)
 
 
+def handle_archive(archive,
+                   failed_dir,
+                   session,
+                   prepared_statements,
+                   rollup=None,
+                   data_ids=None):
+    """
+    Replay the files of an archive written by monroe_archiver.
+
+    The members (.json, .csv, .tsv or .xz files) are streamed from the
+    decompressor through parse, validation and insert by chunks (see
+    stream_chunks), without being extracted to disk or read whole. A member
+    with a parse error is skipped from there on (the chunks before it are
+    inserted) and counted in parse_errors.
+    Only entries whose DataId is in data_ids (if not None) are inserted.
+    Every member is a rollup source of its file name, so replaying files
+    that were imported before does not count them twice in the rollups.
+    Entries that fail are written to failed_dir; the archive is left as is.
+    """
+    result = {'members': 0, 'parse_errors': 0,
+              'inserts': 0, 'failed': 0, 'skipped': 0}
+    fname, fextension = os.path.splitext(archive)
+    if fextension not in ARCHIVE_DECOMPRESSORS:
+        raise Exception("Unknown archive format {}".format(fextension))
+    decompress = ARCHIVE_DECOMPRESSORS[fextension]
+    dest_path_failed = construct_filepath(archive,
+                                          failed_dir,
+                                          "_replay-failed",
+                                          ".json")
+    failed_file = None
+
+    with open(archive, 'rb') as f:
+        decompressor = None
+        stream = f
+        if decompress is not None:
+            decompressor = subprocess.Popen(decompress,
+                                            stdin=f,
+                                            stdout=subprocess.PIPE)
+            stream = decompressor.stdout
+        try:
+            tar = tarfile.open(fileobj=stream, mode='r|')
+            for info in tar:
+                if not info.isfile():
+                    continue
+                if monroetabular.is_tabular(info.name):
+                    if not TABULAR:
+                        continue
+                elif not info.name.endswith(('.json', '.xz')):
+                    continue
+                member = "{}:{}".format(archive, info.name)
+                chunks = stream_chunks(info.name, tar.extractfile(info))
+                result['members'] += 1
+
+                source = None
+                if rollup is not None:
+                    source = rollup.source(
+                        monroerollup.source_name(info.name))
+                first = 0
+                while True:
+                    try:
+                        chunk = next(chunks, None)
+                    except Exception as error:
+                        log_str = ("{} in {} after {} entries, skipping "
+                                   "the rest").format(error, member, first)
+                        log_msg(log_str, syslog.LOG_ERR, 1)
+                        result['parse_errors'] += 1
+                        break
+                    if chunk is None:
+                        break
+                    (processed_inserts,
+                     failed_inserts,
+                     skipped) = insert_entries(chunk,
+                                               session,
+                                               prepared_statements,
+                                               source,
+                                               data_ids)
+                    result['inserts'] += len(processed_inserts)
+                    result['failed'] += len(failed_inserts)
+                    result['skipped'] += skipped
+                    if failed_inserts:
+                        log_str = "Failed {} inserts in {}; ".format(
+                            len(failed_inserts), member)
+                        for nr, error in failed_inserts:
+                            log_str += "{} Failed with {}, ".format(
+                                first + nr, error)
+                        log_msg(log_str, syslog.LOG_ERR, 1)
+                    if failed_inserts and not DEBUG:
+                        if failed_file is None:
+                            failed_file = open(dest_path_failed, 'a')
+                        for nr, error in failed_inserts:
+                            # CSV/TSV rows as JSON objects of their fields
+                            if isinstance(chunk, monroetabular.TabularChunk):
+                                entry = chunk.text_entry(nr)
+                            else:
+                                entry = chunk[nr]
+                            failed_file.write(json.dumps(entry))
+                            failed_file.write(os.linesep)
+                    first += len(chunk)
+                if source is not None:
+                    source.finish()
+            tar.close()
+        finally:
+            if failed_file is not None:
+                failed_file.close()
+            if decompressor is not None:
+                decompressor.stdout.close()
+                if decompressor.wait() != 0:
+                    log_str = "{} exited with {} for {}".format(
+                        decompress[0], decompressor.returncode, archive)
+                    log_msg(log_str, syslog.LOG_ERR, 0)
+
+    log_str = ("Replayed {} files from {}: {} inserts, {} failed, "
+               "{} skipped, {} parse errors").format(result['members'],
+                                                     archive,
+                                                     result['inserts'],
+                                                     result['failed'],
+                                                     result['skipped'],
+                                                     result['parse_errors'])
+    log_msg(log_str, syslog.LOG_INFO, 0)
+    return result
+
+
+def replay_archives(archives,
+                    failed_dir,
+                    concurrency,
+                    session,
+                    prepared_statements,
+                    rollup=None,
+                    data_ids=None):
+    """Replay archives, concurrency of them at a time."""
+    start_time = time.time()
+    try:
+        os.makedirs(failed_dir)
+    except OSError as e:
+        # If the directory already exist do nothing
+        if e.errno != errno.EEXIST:
+            raise e
+
+    pool = ThreadPool(processes=concurrency)
+    async_results = []
+    for archive in archives:
+        log_msg("Start : {}".format(archive), syslog.LOG_INFO, 1)
+        async_results.append(pool.apply_async(handle_archive,
+                                              (archive,
+                                               failed_dir,
+                                               session,
+                                               prepared_statements,
+                                               rollup,
+                                               data_ids,)))
+    pool.close()
+    pool.join()
+
+    if rollup is not None:
+        flush_rollup(rollup)
+    if DEDUP is not None:
+        save_dedup(DEDUP)
+
+    totals = {'inserts': 0, 'failed': 0, 'skipped': 0, 'parse_errors': 0}
+    failed_archives = 0
+    for (archive, async_result) in zip(archives, async_results):
+        try:
+            result = async_result.get()
+        except Exception as error:
+            log_str = "Error replaying {}: {}".format(archive, error)
+            log_msg(log_str, syslog.LOG_ERR, 0)
+            failed_archives += 1
+            continue
+        for key in totals:
+            totals[key] += result[key]
+
+    log_str = ("Replaying {} archives took {} s; {} inserts, {} failed, "
+               "{} skipped, {} files with parse errors, {} archives "
+               "failed").format(len(archives),
+                                time.time() - start_time,
+                                totals['inserts'],
+                                totals['failed'],
+                                totals['skipped'],
+                                totals['parse_errors'],
+                                failed_archives)
+    log_msg(log_str, syslog.LOG_INFO, 0)
+
+
 def parse_files(session,
                 interval,
                 shutoff_time,
@@ -365,11 +1143,23 @@ def parse_files(session,
                 processed_dir,
                 concurrency,
                 prepared_statements,
-                recursive):
-    """Scan in_dir for files."""
+                recursive,
+                rollup=None,
+                claims=None,
+                router=None):
+    """
+    Scan in_dir for files.
+
+    With a router, scans do not wait for the files in flight (see
+    schedule_workers), except the last one.
+    """
+    draining = False
     while True:
         start_time = time.time()
-        log_str = "Start parsing files."
+        if draining:
+            log_str = "Waiting for the files in flight."
+        else:
+            log_str = "Start parsing files."
         log_msg(log_str, syslog.LOG_INFO, 0)
         (files,
          inserts,
@@ -381,7 +1171,12 @@ def parse_files(session,
                                                 concurrency,
                                                 session,
                                                 prepared_statements,
-                                                recursive)
+                                                recursive,
+                                                rollup,
+                                                claims,
+                                                router,
+                                                interval <= 0 or draining,
+                                                not draining)
 
         # Calculate time we should wait to satisfy the interval requirement
         elapsed = time.time() - start_time
@@ -399,12 +1194,17 @@ def parse_files(session,
                                    insert_error_files)
         log_str += " failed"
         log_msg(log_str, syslog.LOG_INFO, 0)
+        if draining:
+            break
 
         # If we have a "timer" set return if it is due
         if (shutoff_time > 0 and time.time() > shutoff_time):
             diff = shutoff_time - time.time()
             log_str = "Exiting due to shutoff timer: {}".format(diff)
             log_msg(log_str, syslog.LOG_INFO, 0)
+            if router is not None:
+                draining = True
+                continue
             break
 
         # Wait if interval > 0 else return
@@ -424,8 +1224,8 @@ def create_arg_parser():
         prog=CMD_NAME,
         formatter_class=argparse.RawDescriptionHelpFormatter,
         description=textwrap.dedent('''
-            Parses .json or (.xz) files in in_dir and inserts them into the
-            Cassandra Cluster specified in -H/--hosts.
+            Parses .json, .csv or .tsv (or .xz) files in in_dir and inserts
+            them into the Cassandra Cluster specified in -H/--hosts.
             All directories not existing will be created.'''))
     parser.add_argument('-u', '--user',
                         help="Cassandra username")
@@ -479,6 +1279,98 @@ def create_arg_parser():
     parser.add_argument('-r', '--recursive',
                         action="store_true",
                         help="recurse into subdirectries")
+    parser.add_argument('--rollup',
+                        action="store_true",
+                        help=("Maintain the hourly ping/modem rollup tables "
+                              "(monroe_rollup_*)"))
+    parser.add_argument('-A', '--archive',
+                        metavar='FILE',
+                        nargs='+',
+                        help=("Replay these archives (.txz, .tzst or .tar, "
+                              "as written by monroe_archiver.py) instead of "
+                              "scanning --indir"))
+    parser.add_argument('--dataid',
+                        metavar='ID',
+                        nargs='+',
+                        help=("With --archive, only insert entries with "
+                              "these DataIds (e.g. MONROE.EXP.PING)"))
+    parser.add_argument('--registry',
+                        metavar='FILE',
+                        default=monroeschema.DEFAULT_REGISTRY,
+                        help=("Schema registry, recompiled in memory if the "
+                              ".cql it was compiled from changed (default "
+                              "{})").format(monroeschema.DEFAULT_REGISTRY))
+    parser.add_argument('--buckets',
+                        choices=BUCKET_MODES,
+                        default='off',
+                        help=("Also (dual) or only (only) insert into the "
+                              "day-bucketed <table>_daily tables, when the "
+                              "table has one (default off)"))
+    parser.add_argument('--instance',
+                        metavar='NAME',
+                        nargs='?',
+                        const=monroeclaim.default_instance(),
+                        help=("Share --indir with other instances: claim "
+                              "files in --indir/.claims/NAME before reading "
+                              "them (default NAME <host>-<pid>)"))
+    parser.add_argument('--claim-timeout',
+                        metavar='N',
+                        type=int,
+                        default=300,
+                        help=("Seconds without heartbeat after which the "
+                              "claims of an instance are recovered "
+                              "(default 300)"))
+    parser.add_argument('--pool',
+                        metavar='TABLE=N',
+                        nargs='+',
+                        help=("Import the files of TABLE (classified by the "
+                              "DataId of their first entry) with N workers "
+                              "of their own, e.g. "
+                              "monroe_exp_tstat_tcp_complete=2"))
+    parser.add_argument('--tabular',
+                        action='store_true',
+                        help=("Also import the CSV/TSV files (.csv, .tsv, "
+                              "optionally .xz) of indir, which are skipped "
+                              "otherwise (see monroetabular.py)"))
+    parser.add_argument('--table',
+                        metavar='PATTERN=TABLE',
+                        nargs='+',
+                        help=("Import the CSV/TSV files without a DataId "
+                              "column whose name matches PATTERN (a regular "
+                              "expression, the named groups of which supply "
+                              "missing columns) into TABLE, e.g. "
+                              "'(?P<NodeId>\\d+)_(?P<Iccid>\\d+)_log_tcp_"
+                              "complete.*=monroe_exp_tstat_tcp_complete' "
+                              "(implies --tabular, see monroetabular.py)"))
+    parser.add_argument('--slo',
+                        metavar='TABLE=SECONDS',
+                        nargs='+',
+                        help=("Freshness SLO of TABLE: files are started by "
+                              "deadline and late files reported, e.g. "
+                              "monroe_meta_device_modem=60"))
+    parser.add_argument('--profile',
+                        metavar='FILE',
+                        help=("Profile the scan, decompress, parse, validate, "
+                              "insert and move stages and the memory of every "
+                              "file, and write the report (JSON) to FILE "
+                              "(see monroeprofile.py)"))
+    parser.add_argument('--dedup',
+                        metavar='DIR',
+                        help=("Skip entries inserted before (within the "
+                              "validator's time grace), keeping Bloom "
+                              "filters of their keys in DIR "
+                              "(see monroededup.py)"))
+    parser.add_argument('--dedup-capacity',
+                        metavar='ENTRIES',
+                        type=int,
+                        default=1000000,
+                        help="Expected entries per day (default 1000000)")
+    parser.add_argument('--dedup-error-rate',
+                        metavar='RATE',
+                        type=float,
+                        default=1e-6,
+                        help=("False positive rate, i.e. new entries "
+                              "skipped (default 1e-6)"))
     parser.add_argument('--debug',
                         action="store_true",
                         help="Do not execute queries or move files")
@@ -539,6 +1431,18 @@ if __name__ == '__main__':
      shutoff_time) = parse_special_args( args, parser)
     DEBUG = args.debug
     VERBOSITY = args.verbosity
+    BUCKET_WRITES = args.buckets
+    TABULAR = args.tabular or bool(args.table)
+    if args.profile:
+        PROFILER = monroeprofile.Profiler(CMD_NAME)
+    if args.dedup:
+        # Older entries are rejected by the validator
+        grace = monroevalidator.TS_GRACE
+        window_days = grace.days + 1 if grace else monroededup.DEFAULT_DAYS
+        DEDUP = monroededup.Dedup(args.dedup,
+                                  window_days,
+                                  args.dedup_capacity,
+                                  args.dedup_error_rate)
 
     if (failed_dir.startswith(os.path.realpath(args.indir)+'/') or
             processed_dir.startswith(os.path.realpath(args.indir)+'/')):
@@ -553,16 +1457,21 @@ if __name__ == '__main__':
     session = None
     cluster = None
     prepared_statements = {}
+    rollup = None
     if not DEBUG:
+        # Tables come from the schema registry (see monroeschema.py) and
+        # inserts are prepared the first time their DataId is seen, so
+        # neither the schema metadata nor unused statements are fetched.
+        registry = monroeschema.load_registry(args.registry)
+        monroeschema.set_registry(registry)
         auth = PlainTextAuthProvider(username=db_user, password=db_password)
-        cluster = Cluster(args.hosts, auth_provider=auth, protocol_version=4)
+        cluster = Cluster(args.hosts, auth_provider=auth, protocol_version=4,
+                          schema_metadata_enabled=False)
         session = cluster.connect(args.keyspace)
         session.row_factory = dict_factory
-        table_names = list(cluster.metadata.keyspaces[args.keyspace].tables.keys())
-        for table_name in table_names:
-            query = 'INSERT INTO {} JSON ?'.format(table_name)
-            data_id = table_name.replace('_', '.')
-            prepared_statements[data_id] = session.prepare(query)
+        prepared_statements = monroeschema.PreparedInserts(session, registry)
+        if args.rollup:
+            rollup = monroerollup.Rollup(session)
     else:
         date_shutoff = (datetime.
                         fromtimestamp(shutoff_time).
@@ -587,15 +1496,62 @@ if __name__ == '__main__':
                                            args.concurrency,
                                            date_shutoff))
 
-    parse_files(session,
-                args.interval,
-                shutoff_time,
-                args.indir,
-                failed_dir,
-                processed_dir,
-                args.concurrency,
-                prepared_statements,
-                args.recursive)
+    if args.table:
+        try:
+            monroetabular.TABLE_PATTERNS = monroetabular.parse_table_patterns(
+                args.table, monroeschema.get_registry())
+        except ValueError as error:
+            parser.error(str(error))
 
+    router = None
+    if args.pool or args.slo:
+        try:
+            registry = monroeschema.get_registry()
+            router = monroerouting.Router(
+                args.concurrency,
+                monroerouting.parse_table_values(args.pool, int, registry),
+                monroerouting.parse_table_values(args.slo, float, registry),
+                registry)
+        except ValueError as error:
+            parser.error(str(error))
+
+    claims = None
+    if args.instance and not DEBUG and not args.archive:
+        claims = monroeclaim.Claims(args.indir,
+                                    args.instance,
+                                    args.claim_timeout)
+        recover_claims(claims, own=True)
+
+    if args.archive:
+        data_ids = None
+        if args.dataid:
+            data_ids = set(data_id.lower() for data_id in args.dataid)
+        replay_archives(args.archive,
+                        failed_dir,
+                        args.concurrency,
+                        session,
+                        prepared_statements,
+                        rollup,
+                        data_ids)
+    else:
+        parse_files(session,
+                    args.interval,
+                    shutoff_time,
+                    args.indir,
+                    failed_dir,
+                    processed_dir,
+                    args.concurrency,
+                    prepared_statements,
+                    args.recursive,
+                    rollup,
+                    claims,
+                    router)
+
+    if claims is not None:
+        claims.stop()
     if not DEBUG:
         cluster.shutdown()
+    if args.profile:
+        PROFILER.write(args.profile)
+        log_str = "Profile written to {}".format(args.profile)
+        log_msg(log_str, syslog.LOG_INFO, 0)
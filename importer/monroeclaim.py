@@ -0,0 +1,184 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Used by monroe_dbimporter to share an input directory between instances.
+
+Before reading a file an instance claims it by renaming it into its claim
+directory, <indir>/.claims/<instance>/ (keeping its path relative to
+<indir>). The rename is atomic, also on NFS, so exactly one instance gets
+every file; the others find it gone and skip it. The file is then parsed,
+inserted and moved to the failed/processed directories from there.
+
+Every instance touches <claim dir>/.heartbeat every HEARTBEAT_FRACTION of
+the claim timeout. A claim directory whose heartbeat is older than the
+timeout belongs to a dead instance: the first instance to notice renames
+the directory to .claims/.recovering-<its name>-<dead name> (so only one
+recovers it; it is itself recovered after the timeout if that instance
+dies meanwhile) and moves its files back to <indir>, where they are claimed
+again. Heartbeats are compared with the instance's own heartbeat, so only
+the clock of the file server matters. Files that were being inserted
+(.wip) are imported again from the start: inserts are idempotent, and so
+are the rollups (--rollup) of a file (see monroerollup.py).
+
+An instance restarted with the same name recovers its own claims at start.
+"""
+import errno
+import os
+import socket
+import threading
+
+CLAIMS_DIR = '.claims'
+HEARTBEAT = '.heartbeat'
+RECOVERING_PREFIX = '.recovering-'
+WIP_SUFFIX = '.wip'
+HEARTBEAT_FRACTION = 0.25
+
+
+def default_instance():
+    """Instance name of this process: <host>-<pid>."""
+    return "{}-{}".format(socket.gethostname(), os.getpid())
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        # If the directory already exist do nothing
+        if e.errno != errno.EEXIST:
+            raise e
+
+
+def _touch(path):
+    with open(path, 'a'):
+        os.utime(path, None)
+    return os.stat(path).st_mtime
+
+
+class Claims(object):
+    """
+    Claims of one instance over in_dir.
+
+    claim() returns the path of the claimed file, or None if another
+    instance claimed it first. recover() returns [(claimed path, restored
+    path)] of the files taken back from dead instances.
+    """
+
+    def __init__(self, in_dir, instance, timeout):
+        self.in_dir = os.path.realpath(in_dir)
+        self.instance = instance
+        self.timeout = timeout
+        self.claims_dir = os.path.join(self.in_dir, CLAIMS_DIR)
+        self.claim_dir = os.path.join(self.claims_dir, instance)
+        self._heartbeat = os.path.join(self.claim_dir, HEARTBEAT)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Recover own leftover claims and start the heartbeat thread."""
+        recovered = []
+        if os.path.isdir(self.claim_dir):
+            recovered = self._restore(self.claim_dir)
+        _makedirs(self.claim_dir)
+        _touch(self._heartbeat)
+        self._thread = threading.Thread(target=self._beat)
+        self._thread.daemon = True
+        self._thread.start()
+        return recovered
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _beat(self):
+        while not self._stop.wait(self.timeout * HEARTBEAT_FRACTION):
+            try:
+                _touch(self._heartbeat)
+            except (IOError, OSError):
+                # Retried on the next beat; the claims stay valid until
+                # the timeout.
+                pass
+
+    def claim(self, path):
+        relpath = os.path.relpath(os.path.realpath(path), self.in_dir)
+        claimed = os.path.join(self.claim_dir, relpath)
+        _makedirs(os.path.dirname(claimed))
+        try:
+            os.rename(path, claimed)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise e
+        return claimed
+
+    def recover(self):
+        """Take back the claims of the instances whose heartbeat expired."""
+        recovered = []
+        try:
+            now = _touch(self._heartbeat)
+            instances = os.listdir(self.claims_dir)
+        except (IOError, OSError):
+            return recovered
+        own_recovering = "{}{}-".format(RECOVERING_PREFIX, self.instance)
+        for instance in instances:
+            path = os.path.join(self.claims_dir, instance)
+            if instance == self.instance or not os.path.isdir(path):
+                continue
+            if instance.startswith(own_recovering):
+                # Left by an earlier run with this name
+                recovered.extend(self._restore(path))
+                continue
+            try:
+                beat = os.stat(os.path.join(path, HEARTBEAT)).st_mtime
+            except OSError:
+                # Not started yet; use the directory.
+                try:
+                    beat = os.stat(path).st_mtime
+                except OSError:
+                    continue
+            if now - beat < self.timeout:
+                continue
+            recovering = os.path.join(self.claims_dir,
+                                      own_recovering + instance)
+            try:
+                os.rename(path, recovering)
+            except OSError:
+                continue  # Recovered by another instance
+            # If this instance dies while restoring, another one will
+            # recover the directory after the timeout.
+            _touch(os.path.join(recovering, HEARTBEAT))
+            recovered.extend(self._restore(recovering))
+        return recovered
+
+    def _restore(self, claim_dir):
+        """Move the files of claim_dir back to in_dir and remove it."""
+        restored = []
+        for (root, dirs, files) in os.walk(claim_dir, topdown=False):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if root == claim_dir and filename == HEARTBEAT:
+                    os.unlink(path)
+                    continue
+                dest = os.path.join(self.in_dir,
+                                    os.path.relpath(path, claim_dir))
+                if dest.endswith(WIP_SUFFIX):
+                    dest = dest[:-len(WIP_SUFFIX)]
+                if os.path.exists(dest):
+                    continue  # Left for manual handling
+                _makedirs(os.path.dirname(dest))
+                os.rename(path, dest)
+                restored.append((path, dest))
+            for dirname in dirs:
+                try:
+                    os.rmdir(os.path.join(root, dirname))
+                except OSError:
+                    pass
+        try:
+            os.rmdir(claim_dir)
+        except OSError:
+            pass
+        return restored
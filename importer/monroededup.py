@@ -0,0 +1,239 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Used by monroe_dbimporter to skip entries that were already inserted (--dedup).
+
+Nodes re-upload files after connectivity problems. Inserting their entries
+again is harmless (inserts are upserts) but costs write I/O and compaction.
+The key of every inserted entry (DataId, NodeId, Iccid, Timestamp,
+SequenceNumber) is added to a Bloom filter of the day of its Timestamp, and
+entries whose key is found in the filter of their day are skipped.
+Entries without a Timestamp (e.g. tstat flows) are never skipped.
+
+Only the days of the validator's TS_GRACE window (plus one) are kept, as
+older entries are rejected anyway, so memory is bounded by the number of
+days times the size of a filter, set from the expected entries per day
+(capacity) and the false positive rate. A false positive skips an entry
+that was never inserted, so the default rate is low (1e-6). Beyond its
+capacity the false positive rate of a day grows; the number of entries of
+every day is logged on save so the capacity can be adjusted.
+
+Key values are compared as text, numbers by value (e.g. a float Timestamp of
+a JSON entry and the Decimal of the same CSV/TSV row give the same key).
+Keys are added after a successful insert, so entries whose insert failed
+are not skipped when retried. The filters are saved in a directory (one
+file per day, written atomically) after every scan and loaded at start.
+"""
+import hashlib
+import json
+import math
+import os
+import shutil
+import struct
+import tempfile
+import threading
+from decimal import Decimal
+
+DAY = 24 * 3600
+# Days kept when the validator does not check timestamps (no TS_GRACE)
+DEFAULT_DAYS = 15
+FILE_SUFFIX = '.bloom'
+KEY_FIELDS = ('DataId', 'NodeId', 'Iccid', 'Timestamp', 'SequenceNumber')
+
+
+def _key_value(value):
+    """value as text, integral numbers as integers and others as floats."""
+    if value is None:
+        return None
+    if (isinstance(value, (int, long, float, Decimal)) and
+            not isinstance(value, bool)):
+        try:
+            if value == int(value):
+                return str(int(value))
+        except (ValueError, OverflowError):
+            pass  # NaN or infinite
+        return repr(float(value))
+    return unicode(value)
+
+
+def entry_key(entry):
+    """The dedup key (a string) of an entry."""
+    return json.dumps([_key_value(entry.get(field)) for field in KEY_FIELDS])
+
+
+class BloomFilter(object):
+    """Bloom filter of bits bits and hashes hash functions (double hashing)."""
+
+    def __init__(self, bits, hashes, data=None, count=0):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = data if data is not None else bytearray((bits + 7) // 8)
+        self.count = count
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate):
+        bits = int(math.ceil(-capacity * math.log(error_rate) /
+                             math.log(2) ** 2))
+        hashes = max(1, int(round(float(bits) / capacity * math.log(2))))
+        return cls(bits, hashes)
+
+    def _positions(self, key):
+        digest = hashlib.md5(key).digest()
+        (h1, h2) = struct.unpack('<QQ', digest)
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        data = self.data
+        for position in self._positions(key):
+            if not data[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, key):
+        data = self.data
+        for position in self._positions(key):
+            data[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+class Dedup(object):
+    """Day Bloom filters of the keys inserted in the last window_days days."""
+
+    def __init__(self, directory, window_days, capacity, error_rate):
+        self.directory = directory
+        self.window_days = window_days
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filters = {}  # Day (since 1970-01-01 UTC): BloomFilter
+        self.dirty = set()
+        self.checked = 0
+        self.duplicates = 0
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.load()
+
+    def _path(self, day):
+        return os.path.join(self.directory, "{}{}".format(day, FILE_SUFFIX))
+
+    def _first_day(self, now):
+        return int(now) // DAY - self.window_days
+
+    def load(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith(FILE_SUFFIX):
+                continue
+            try:
+                day = int(name[:-len(FILE_SUFFIX)])
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    header = json.loads(f.readline())
+                    data = bytearray(f.read())
+                self.filters[day] = BloomFilter(header['bits'],
+                                                header['hashes'],
+                                                data,
+                                                header['count'])
+            except (IOError, ValueError, KeyError):
+                continue  # Unreadable: the day starts again empty
+
+    def _filter(self, entry, create):
+        if entry.get('Timestamp') is None:
+            return (None, None)
+        day = int(float(entry['Timestamp'])) // DAY
+        bloom = self.filters.get(day)
+        if bloom is None and create:
+            bloom = BloomFilter.for_capacity(self.capacity, self.error_rate)
+            self.filters[day] = bloom
+        return (day, bloom)
+
+    def seen(self, entry):
+        """True if the key of entry was (probably) inserted before."""
+        key = entry_key(entry)
+        with self._lock:
+            self.checked += 1
+            (day, bloom) = self._filter(entry, False)
+            if bloom is not None and key in bloom:
+                self.duplicates += 1
+                return True
+        return False
+
+    def add(self, entry):
+        """Record the key of an inserted entry."""
+        key = entry_key(entry)
+        with self._lock:
+            (day, bloom) = self._filter(entry, True)
+            if bloom is not None:
+                bloom.add(key)
+                self.dirty.add(day)
+
+    def save(self, now):
+        """
+        Drop the days older than the window and write the changed ones.
+
+        Returns and resets (entries checked, duplicates, {day: entries}) of
+        the changed days.
+        """
+        first_day = self._first_day(now)
+        with self._lock:
+            for day in [d for d in self.filters if d < first_day]:
+                del self.filters[day]
+                self.dirty.discard(day)
+                try:
+                    os.unlink(self._path(day))
+                except OSError:
+                    pass
+            dirty = [(day, self.filters[day]) for day in self.dirty]
+            snapshots = [(day, bloom.bits, bloom.hashes, bloom.count,
+                          bytes(bloom.data)) for (day, bloom) in dirty]
+            self.dirty = set()
+            stats = (self.checked, self.duplicates,
+                     dict((day, count) for (day, b, h, count, d) in snapshots))
+            self.checked = 0
+            self.duplicates = 0
+        for (day, bits, hashes, count, data) in snapshots:
+            (fd, tmp_path) = tempfile.mkstemp(dir=self.directory,
+                                              suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps({'bits': bits,
+                                    'hashes': hashes,
+                                    'count': count}) + '\n')
+                f.write(data)
+            os.rename(tmp_path, self._path(day))
+        return stats
+
+
+def self_check():
+    """Check that a JSON entry and the same CSV/TSV row share their key."""
+    import monroetabular
+    import monroeschema
+    lines = ["NodeId,Iccid,DataId,Timestamp,SequenceNumber,Rtt,Bytes,Host",
+             "7,89,MONROE.EXP.PING,1500000000.25,3,12.5,84,8.8.8.8",
+             "7,89,MONROE.EXP.PING,1500000001,4,12.5,84,8.8.8.8"]
+    tabular = monroetabular.TabularFile(lines, monroeschema.get_registry())
+    chunk = next(tabular.chunks())
+    entries = [json.loads('{"NodeId": "7", "Iccid": "89", '
+                          '"DataId": "MONROE.EXP.PING", '
+                          '"Timestamp": 1500000000.25, "SequenceNumber": 3}'),
+               json.loads('{"NodeId": "7", "Iccid": "89", '
+                          '"DataId": "MONROE.EXP.PING", '
+                          '"Timestamp": 1500000001, "SequenceNumber": 4}')]
+    directory = tempfile.mkdtemp()
+    try:
+        dedup = Dedup(directory, DEFAULT_DAYS, 1000, 1e-6)
+        for nr in range(len(chunk)):
+            assert not dedup.seen(chunk.entry(nr))
+            dedup.add(chunk.entry(nr))
+        for entry in entries:
+            assert dedup.seen(entry), entry
+        dedup.save(1500000000)
+        assert Dedup(directory, DEFAULT_DAYS, 1000, 1e-6).seen(entries[0])
+    finally:
+        shutil.rmtree(directory)
+    print("Dedup keys of CSV/TSV rows and JSON entries match")
+
+
+if __name__ == '__main__':
+    self_check()
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Used by monroe_dbimporter to classify the NMEA sentence of GPS entries.
+
+MONROE.META.DEVICE.GPS entries carry the raw NMEA sentence in Nmea. Before
+insertion the importer adds NmeaType, the address of the sentence without
+the '$' (e.g. GPRMC, GPGGA), and FixQuality, so that readers can
+select e.g. the GPRMC positions with a filter on NmeaType instead of fetching
+and searching the Nmea text of every row.
+
+FixQuality is the fix quality field of GGA sentences (0 invalid, 1 GPS,
+2 DGPS, ...) and, for RMC sentences, 1 if the status is A (valid) and 0 if
+it is V (warning). It is None for other sentences. If Nmea holds several
+sentences the first position sentence (RMC, then GGA) is used, else the first.
+"""
+
+DATA_ID = 'MONROE.META.DEVICE.GPS'
+POSITION_TYPES = ('RMC', 'GGA')  # In order of preference
+
+
+def _fix_quality(sentence_type, fields):
+    try:
+        if sentence_type == 'GGA':
+            return int(fields[6])
+        if sentence_type == 'RMC':
+            return 1 if fields[2] == 'A' else 0
+    except (IndexError, ValueError):
+        pass
+    return None
+
+
+def _sentences(nmea):
+    """Yield (address, fields) of the well formed sentences in an NMEA text."""
+    for line in nmea.splitlines():
+        start = line.find('$')
+        if start < 0:
+            continue
+        fields = line[start + 1:].split('*')[0].split(',')
+        address = fields[0].strip()
+        if len(address) >= 5 and address.isalnum():
+            yield (address, fields)
+
+
+def classify(nmea):
+    """Return (NmeaType, FixQuality) of an NMEA text, or (None, None)."""
+    if not nmea:
+        return (None, None)
+    sentences = list(_sentences(nmea))
+    if not sentences:
+        return (None, None)
+    for sentence_type in POSITION_TYPES:
+        for (address, fields) in sentences:
+            if address[-3:] == sentence_type:
+                return (address, _fix_quality(sentence_type, fields))
+    (address, fields) = sentences[0]
+    return (address, _fix_quality(address[-3:], fields))
+
+
+def annotated(entry):
+    """
+    Return a copy of a GPS entry with NmeaType and FixQuality (other entries
+    are returned as is), leaving the entry as read.
+    """
+    if str(entry.get('DataId')).upper() != DATA_ID:
+        return entry
+    (nmea_type, fix_quality) = classify(entry.get('Nmea'))
+    return dict(entry, NmeaType=nmea_type, FixQuality=fix_quality)
@@ -0,0 +1,216 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Per-stage profiling of monroe_dbimporter and the exporters (--profile).
+
+Code is divided in named stages (e.g. scan, decompress, parse, validate,
+insert, move) with `with profiler.stage(name):`. Every stage has its own
+cProfile profiler per thread, enabled only inside the stage, so the report
+tells which stage the time of a function was spent in, also with several
+worker threads. A stage entered inside another one pauses the outer
+profiler; the wall time of a stage includes the stages nested in it.
+
+Every processed file is wrapped in `with profiler.file(name):`, which
+records its duration and memory: the peak RSS of the process (rusage) and,
+if tracemalloc is available (Python 3, or Python 2 with pytracemalloc), the
+traced memory and peak. The top allocation sites are kept for the file with
+the highest traced peak. With several workers the memory of a file includes
+the allocations of the files processed at the same time.
+
+write() saves the report as JSON: per stage the calls, wall seconds and the
+functions with the most own time; per file its time and memory. The complete
+profile of every stage is also saved next to it (<report>.<stage>.pstats),
+to be browsed with pstats, snakeviz, etc.
+"""
+import cProfile
+import json
+import os
+import pstats
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 20
+TRACEMALLOC_FRAMES = 1
+
+
+class _NullStage(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class NullProfiler(object):
+    """Profiler that records nothing, used when not profiling."""
+
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def file(self, name):
+        return _NULL_STAGE
+
+
+def _function_name(key):
+    (filename, line, function) = key
+    return "{}:{}({})".format(filename, line, function)
+
+
+def _max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Profiler(object):
+    """Records the stages and files of a command (see module doc)."""
+
+    enabled = True
+
+    def __init__(self, command):
+        self.command = command
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiles = {}  # stage: [cProfile.Profile of every thread]
+        self._stages = {}  # stage: [calls, seconds, max seconds]
+        self._files = []
+        self._peak_file = None
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def _profile(self, name):
+        profiles = self._local.__dict__.setdefault('profiles', {})
+        profile = profiles.get(name)
+        if profile is None:
+            profile = profiles[name] = cProfile.Profile()
+            with self._lock:
+                self._profiles.setdefault(name, []).append(profile)
+        return profile
+
+    @contextmanager
+    def stage(self, name):
+        active = self._local.__dict__.setdefault('active', [])
+        profile = self._profile(name)
+        if active:
+            active[-1].disable()
+        active.append(profile)
+        start = time.time()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.time() - start
+            active.pop()
+            if active:
+                active[-1].enable()
+            with self._lock:
+                stats = self._stages.setdefault(name, [0, 0.0, 0.0])
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] = max(stats[2], elapsed)
+
+    @contextmanager
+    def file(self, name):
+        record = {'file': name}
+        start = time.time()
+        if tracemalloc is not None:
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            traced_start = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            record['seconds'] = time.time() - start
+            record['max_rss_kb'] = _max_rss_kb()
+            if tracemalloc is not None:
+                (traced, peak) = tracemalloc.get_traced_memory()
+                record['traced_bytes'] = traced - traced_start
+                record['traced_peak_bytes'] = peak
+            with self._lock:
+                self._files.append(record)
+                if tracemalloc is not None and (
+                        self._peak_file is None or
+                        peak > self._peak_file['traced_peak_bytes']):
+                    self._peak_file = dict(record)
+                    self._peak_file['allocations'] = self._allocations()
+
+    def _allocations(self):
+        statistics = tracemalloc.take_snapshot().statistics('lineno')
+        return [{'site': str(stat.traceback),
+                 'bytes': stat.size,
+                 'blocks': stat.count}
+                for stat in statistics[:TOP_ALLOCATIONS]]
+
+    def _stage_stats(self, name):
+        with self._lock:
+            profiles = list(self._profiles.get(name, []))
+        stats = None
+        for profile in profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                continue  # Never enabled in its thread
+        return stats
+
+    def report(self):
+        """Return the report (a dict) of what was recorded so far."""
+        stages = {}
+        for (name, (calls, seconds, max_seconds)) in self._stages.items():
+            top = []
+            stats = self._stage_stats(name)
+            if stats is not None:
+                functions = sorted(stats.stats.items(),
+                                   key=lambda item: item[1][2],
+                                   reverse=True)
+                for (key, (cc, nc, tt, ct, callers)) in \
+                        functions[:TOP_FUNCTIONS]:
+                    top.append({'function': _function_name(key),
+                                'calls': nc,
+                                'own_seconds': tt,
+                                'cumulative_seconds': ct})
+            stages[name] = {'calls': calls,
+                            'seconds': seconds,
+                            'max_seconds': max_seconds,
+                            'top_functions': top}
+        return {'command': self.command,
+                'pid': os.getpid(),
+                'started': self.started,
+                'seconds': time.time() - self.started,
+                'max_rss_kb': _max_rss_kb(),
+                'tracemalloc': tracemalloc is not None,
+                'stages': stages,
+                'files': list(self._files),
+                'peak_file': self._peak_file}
+
+    def write(self, path):
+        """Write the JSON report to path and the stage profiles next to it."""
+        report = self.report()
+        for name in report['stages']:
+            stats = self._stage_stats(name)
+            if stats is not None:
+                stats.dump_stats("{}.{}.pstats".format(path, name))
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+        os.rename(tmp_path, path)
+        return report
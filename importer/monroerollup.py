@@ -0,0 +1,318 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Used by monroe_dbimporter to maintain hourly rollups of ping and modem values.
+
+Every inserted entry of a DataId listed in ROLLUPS is added to a histogram
+per (NodeId, Iccid, hour, metric) of the file it was read from (its source).
+The histograms of a file are kept in memory until the file is done and then
+added to the monroe_rollup_* tables (see db_schema.cql) after the scan.
+
+Each row is one histogram bucket of an hour, with Samples and Total (the sum
+of the values) counters, so several importers and late data add to the same
+rows and readers get an hour of a metric in a few rows (see summarize). The
+histograms of the sources finished since the last flush are merged and every
+bucket is one counter update. From the buckets of an hour one gets the exact
+count and mean, and min, max and percentiles with the resolution of the
+buckets: exact for the integer signal values (one bucket per dB) and within
+RTT_BUCKET_BASE (2%) for the RTT.
+
+A source is counted once: before its buckets are added it is recorded in
+monroe_rollup_sources (INSERT ... IF NOT EXISTS), and a source recorded
+before is skipped. So the rollups do not double count when claimed files are
+recovered and imported again (see monroeclaim.py), when the same file is
+uploaded again or when archives are replayed (--archive): sources are named
+by their file name (see source_name), so the processed part of a file is the
+same source as the file. Entries skipped by --dedup are not counted, as they
+are counted by the source that inserted them. Every source is recorded with
+a random claim, so a record whose write timed out is recognized (and the
+source counted) when it is retried at the next flush.
+
+Remaining errors: a counter update that fails is not retried (it may have
+been applied), so its samples may be missing, as are the ones of the
+sources recorded by an importer that stopped before adding their buckets.
+A file imported again under the same name with more entries (e.g. a file
+that grew) is only counted as first imported.
+"""
+import math
+import os
+import threading
+import uuid
+
+from cassandra.concurrent import execute_concurrent_with_args
+
+TABLE_PREFIX = 'monroe_rollup_'
+SOURCES_TABLE = 'monroe_rollup_sources'
+HOUR = 3600
+DAY = 24 * HOUR
+RTT_BUCKET_BASE = 1.02
+FLUSH_CONCURRENCY = 50
+# Suffixes of the names of a file while and after it is processed by
+# monroe_dbimporter, stripped from the source name
+WIP_SUFFIX = '.wip'
+PROCESSED_PART = '_processed-part'
+
+_LOG_RTT_BUCKET_BASE = math.log(RTT_BUCKET_BASE)
+
+
+def _log_bucket(value):
+    """Logarithmic buckets: bucket b holds [base^b, base^(b+1))."""
+    return int(math.floor(math.log(value) / _LOG_RTT_BUCKET_BASE))
+
+
+def _log_bucket_value(bucket):
+    return RTT_BUCKET_BASE ** bucket
+
+
+def _int_bucket(value):
+    """One bucket per integer value."""
+    return int(value)
+
+
+def _int_bucket_value(bucket):
+    return bucket
+
+
+# DataId: (rollup table, ((metric, entry key, bucket function, total scale),))
+# Keys are matched case insensitively. Totals are stored as integers, so the
+# RTT (ms) is summed in microseconds.
+ROLLUPS = {
+    'MONROE.EXP.PING': ('monroe_rollup_ping_hourly',
+                        (('rtt', 'rtt', _log_bucket, 1000),)),
+    'MONROE.META.DEVICE.MODEM': ('monroe_rollup_modem_hourly',
+                                 (('rsrp', 'rsrp', _int_bucket, 1),
+                                  ('rsrq', 'rsrq', _int_bucket, 1),
+                                  ('rssi', 'rssi', _int_bucket, 1))),
+}
+
+# metric: (function from bucket to the lower bound of its values, total scale)
+METRICS = {
+    'rtt': (_log_bucket_value, 1000),
+    'rsrp': (_int_bucket_value, 1),
+    'rsrq': (_int_bucket_value, 1),
+    'rssi': (_int_bucket_value, 1),
+}
+
+
+def source_name(filename):
+    """
+    The source of the entries of a file: its name, without the suffixes
+    the importer adds (.wip, _processed-part...), so that the file and its
+    processed part, e.g. replayed from an archive, are the same source.
+    """
+    name = os.path.basename(filename)
+    if name.endswith(WIP_SUFFIX):
+        name = name[:-len(WIP_SUFFIX)]
+    position = name.find(PROCESSED_PART)
+    if position > 0:
+        name = name[:position]
+    return name
+
+
+def _cells(entry):
+    """Return [((table, nodeid, iccid, hour, metric, bucket), total)]."""
+    rollup = ROLLUPS.get(str(entry.get('DataId')).upper())
+    if rollup is None:
+        return []
+    (table, metrics) = rollup
+    fields = dict((k.lower(), v) for k, v in entry.items())
+    try:
+        nodeid = str(fields['nodeid'])
+        iccid = str(fields['iccid'])
+        hour = int(float(fields['timestamp'])) // HOUR * HOUR
+    except (KeyError, TypeError, ValueError):
+        return []
+
+    cells = []
+    for (metric, key, bucket_of, scale) in metrics:
+        value = fields.get(key)
+        if (isinstance(value, bool) or
+                not isinstance(value, (int, long, float))):
+            continue
+        try:
+            bucket = bucket_of(value)
+        except ValueError:  # log of a non positive RTT
+            continue
+        cells.append(((table, nodeid, iccid, hour, metric, bucket),
+                      int(round(value * scale))))
+    return cells
+
+
+class RollupSource(object):
+    """Histograms of the entries of one source, see Rollup.source."""
+
+    def __init__(self, rollup, name):
+        self._rollup = rollup
+        self.name = name
+        self._lock = threading.Lock()
+        # (table, nodeid, iccid, hour, metric, bucket) -> [samples, total]
+        self._cells = {}
+
+    def add(self, entry):
+        """Add the values of an inserted entry, if it has a rollup."""
+        cells = _cells(entry)
+        with self._lock:
+            for (cell, total) in cells:
+                counters = self._cells.setdefault(cell, [0, 0])
+                counters[0] += 1
+                counters[1] += total
+
+    def finish(self):
+        """The source is complete: add it with the next flush."""
+        with self._lock:
+            cells = self._cells
+            self._cells = {}
+        self._rollup._finish(self.name, cells)
+
+
+class Rollup(object):
+    """Thread safe accumulator of hourly histograms, flushed to Cassandra."""
+
+    def __init__(self, session):
+        self._session = session
+        self._lock = threading.Lock()
+        # source name -> (claim, {cell: [samples, total]}) of the finished
+        # sources
+        self._pending = {}
+        self._statements = {}
+        for (table, metrics) in ROLLUPS.values():
+            query = ('UPDATE {} SET Samples = Samples + ?, '
+                     'Total = Total + ? WHERE NodeId = ? AND Iccid = ? '
+                     'AND Day = ? AND Hour = ? AND Metric = ? '
+                     'AND Bucket = ?').format(table)
+            self._statements[table] = session.prepare(query)
+        self._record = session.prepare(
+            'INSERT INTO {} (Source, Claim, Recorded) '
+            'VALUES (?, ?, toTimestamp(now())) IF NOT EXISTS'.format(
+                SOURCES_TABLE))
+
+    def source(self, name):
+        """
+        The RollupSource collecting the entries of source name (see
+        source_name); it is counted unless a source of that name was
+        counted before.
+        """
+        return RollupSource(self, name)
+
+    def _finish(self, name, cells):
+        if not cells:
+            return
+        with self._lock:
+            # A source processed again before the flush is counted once
+            self._pending.setdefault(name, (uuid.uuid4(), cells))
+
+    def _record_sources(self, pending):
+        """
+        Record the pending sources in SOURCES_TABLE. Returns (the names of
+        the sources to count, the ones to retry, last error or None).
+        """
+        names = list(pending)
+        results = execute_concurrent_with_args(
+            self._session,
+            self._record,
+            [[name, pending[name][0]] for name in names],
+            concurrency=FLUSH_CONCURRENCY,
+            raise_on_first_error=False)
+        counted = []
+        retry = []
+        error = None
+        for (name, (success, result)) in zip(names, results):
+            if not success:
+                retry.append(name)
+                error = result
+                continue
+            row = list(result)[0]
+            # Not applied: recorded before, by this source if the claim is
+            # its own (a record that timed out but was written)
+            if row['[applied]'] or row.get('claim') == pending[name][0]:
+                counted.append(name)
+        return (counted, retry, error)
+
+    def flush(self):
+        """
+        Add the buckets of the finished sources to the rollup tables.
+
+        Sources that could not be recorded are kept for the next flush.
+        Returns (updated buckets, failed buckets, sources kept, last error
+        or None).
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        if not pending:
+            return (0, 0, 0, None)
+
+        (counted, retry, error) = self._record_sources(pending)
+        if retry:
+            with self._lock:
+                for name in retry:
+                    # Unless the source was finished again meanwhile
+                    self._pending.setdefault(name, pending[name])
+
+        merged = {}
+        for name in counted:
+            for (cell, (samples, total)) in pending[name][1].items():
+                counters = merged.setdefault(cell, [0, 0])
+                counters[0] += samples
+                counters[1] += total
+        by_table = {}
+        for (cell, (samples, total)) in merged.items():
+            (table, nodeid, iccid, hour, metric, bucket) = cell
+            by_table.setdefault(table, []).append(
+                [samples, total, nodeid, iccid, hour // DAY, hour, metric,
+                 bucket])
+
+        written = 0
+        failed = 0
+        for (table, params) in by_table.items():
+            results = execute_concurrent_with_args(
+                self._session,
+                self._statements[table],
+                params,
+                concurrency=FLUSH_CONCURRENCY,
+                raise_on_first_error=False)
+            for (success, result) in results:
+                if success:
+                    written += 1
+                else:
+                    failed += 1
+                    error = result
+        return (written, failed, len(retry), error)
+
+
+def summarize(metric, buckets, percentiles=(50, 90, 99)):
+    """
+    Summarize the buckets of one (NodeId, Iccid, Hour, Metric).
+
+    buckets is an iterable of (Bucket, Samples, Total) as read from a rollup
+    table (buckets read more than once are merged). Returns a dict with
+    count, min, max, mean and the requested percentiles (as bucket lower
+    bounds), or None if there are no samples.
+    """
+    (bucket_value, scale) = METRICS[metric]
+    merged = {}
+    for (b, s, t) in buckets:
+        counters = merged.setdefault(b, [0, 0])
+        counters[0] += s
+        counters[1] += t
+    buckets = sorted((b, s, t) for (b, (s, t)) in merged.items() if s > 0)
+    count = sum(s for (b, s, t) in buckets)
+    if count == 0:
+        return None
+    summary = {'count': count,
+               'min': bucket_value(buckets[0][0]),
+               'max': bucket_value(buckets[-1][0]),
+               'mean': float(sum(t for (b, s, t) in buckets)) / scale / count}
+    for p in percentiles:
+        rank = p / 100.0 * count
+        seen = 0
+        for (b, s, t) in buckets:
+            seen += s
+            if seen >= rank:
+                summary['p{}'.format(p)] = bucket_value(b)
+                break
+    return summary
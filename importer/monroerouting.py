@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Used by monroe_dbimporter to route files to per-table worker pools.
+
+A file is classified by the DataId of its first entry (read from the first
+line, or the first row of CSV/TSV files, decompressing only the beginning of
+.xz files) into the table the entry goes to. Tables given a pool with
+--pool TABLE=N are handled by their own N workers, so e.g. a burst of heavy
+tstat files cannot occupy the workers of the modem and ping files; the other
+files share the default pool (--concurrency workers). Files without a
+readable first entry go to the default pool and fail there as usual.
+
+Tables can be given a freshness SLO with --slo TABLE=SECONDS: the maximum
+time between the modification of a file and the end of its import. Within
+every pool files are started by deadline (modification time plus the SLO of
+their table, tables without an SLO last, oldest first), and after every scan
+the lag of every table and the files that missed their SLO are reported.
+
+The pools live across scans: a scan queues the new files and collects the
+ones done since the previous scan, without waiting for the others, so a
+burst of files in one pool does not delay the next scan of the other pools.
+Files still in flight (queued or running) are not queued again. The workers
+of a pool take the queued file of the earliest deadline (see DeadlinePool),
+so a file of a later scan with a tighter deadline starts before the files
+queued by earlier scans.
+"""
+import heapq
+import itertools
+import json
+import threading
+import time
+
+import lzma
+
+import monroeschema
+import monroetabular
+
+DEFAULT_POOL = None
+PEEK_BYTES = 1 << 16
+NO_SLO = float('inf')
+
+
+def parse_table_values(specs, value_type, registry):
+    """Return {table: value} of TABLE=VALUE specs (tables as in registry)."""
+    values = {}
+    for spec in specs or []:
+        (table, separator, value) = spec.partition('=')
+        table = table.strip().lower()
+        if not separator or table not in registry['tables']:
+            raise ValueError("{} is not TABLE=VALUE with a known "
+                             "table".format(spec))
+        values[table] = value_type(value)
+        if values[table] <= 0:
+            raise ValueError("{} must be positive".format(spec))
+    return values
+
+
+def _first_lines(filename, count):
+    with open(filename, 'rb') as f:
+        data = f.read(PEEK_BYTES)
+    if filename.endswith('.xz'):
+        data = lzma.LZMADecompressor().decompress(data)
+    return [line for line in data.splitlines() if line.strip()][:count]
+
+
+def peek_data_id(filename):
+    """Return the DataId (lower case) of the first entry of a file, or None."""
+    try:
+        if monroetabular.is_tabular(filename):
+            lines = _first_lines(filename, 2)
+            if len(lines) < 2:
+                return None
+            return monroetabular.peek_data_id(
+                lines, monroetabular.table_of(filename)[0])
+        lines = _first_lines(filename, 1)
+        if not lines:
+            return None
+        return str(json.loads(lines[0])['DataId']).lower()
+    except Exception:
+        # Unreadable, pretty printed or incomplete: let the import report it
+        return None
+
+
+class _Result(object):
+    """Result of a function run by a DeadlinePool, as an AsyncResult."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._success = None
+        self._value = None
+
+    def _set(self, success, value):
+        self._success = success
+        self._value = value
+        self._event.set()
+
+    def ready(self):
+        return self._event.is_set()
+
+    def get(self):
+        self._event.wait()
+        if not self._success:
+            raise self._value
+        return self._value
+
+
+class DeadlinePool(object):
+    """
+    Worker threads running the queued functions by priority (e.g. deadline,
+    lowest first, then in the order queued), whichever scan queued them.
+    """
+
+    def __init__(self, processes):
+        self._queue = []  # Heap of (priority, order, function, args, result)
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work)
+                         for _ in range(processes)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def apply_async(self, priority, function, args):
+        """Queue function(*args); returns its result (see _Result)."""
+        result = _Result()
+        with self._condition:
+            heapq.heappush(self._queue, (priority, next(self._order),
+                                         function, args, result))
+            self._condition.notify()
+        return result
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                (priority, order, function, args,
+                 result) = heapq.heappop(self._queue)
+            try:
+                result._set(True, function(*args))
+            except Exception as error:
+                result._set(False, error)
+
+    def close(self):
+        """The workers stop once the queue is empty."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+
+class Router(object):
+    """
+    Pools and SLOs of the tables.
+
+    route() returns the table (or None) and the deadline of a file; start()
+    queues a function on a file in the pool of its table by deadline, unless
+    the file is in_flight(), and collect() returns the results of the files
+    done. done()
+    records the lag of an imported file and report() returns the per table
+    lags of the scan.
+    """
+
+    def __init__(self, default_size, pool_sizes, slos, registry):
+        self.default_size = default_size
+        self.pool_sizes = pool_sizes
+        self.slos = slos
+        self._tables = monroeschema.tables_by_data_id(registry)
+        self._lags = {}
+        self._lock = threading.Lock()
+        self._pools = None
+        # path -> AsyncResult of the files started and not collected
+        self._in_flight = {}
+
+    def pools(self):
+        """The worker pools, {table or DEFAULT_POOL: DeadlinePool}."""
+        if self._pools is None:
+            self._pools = dict((table, DeadlinePool(size))
+                               for (table, size) in self.pool_sizes.items())
+            self._pools[DEFAULT_POOL] = DeadlinePool(self.default_size)
+        return self._pools
+
+    def pool_of(self, table):
+        return table if table in self.pool_sizes else DEFAULT_POOL
+
+    def in_flight(self, path):
+        with self._lock:
+            return path in self._in_flight
+
+    def start(self, table, path, deadline, mtime, function, args):
+        """
+        Queue function(*args) for file path in the pool of table, by
+        deadline and, for the same deadline (e.g. no SLO), oldest first.
+        """
+        result = self.pools()[self.pool_of(table)].apply_async(
+            (deadline, mtime, path), function, args)
+        with self._lock:
+            self._in_flight[path] = result
+
+    def collect(self, wait=False):
+        """
+        Return ([AsyncResult] of the files done since the last call, number
+        of files still in flight). With wait, wait for all the files and
+        close the pools (they are created again by the next start).
+        """
+        if wait and self._pools is not None:
+            for pool in self._pools.values():
+                pool.close()
+            for pool in self._pools.values():
+                pool.join()
+            self._pools = None
+        with self._lock:
+            done = [path for (path, result) in self._in_flight.items()
+                    if result.ready()]
+            results = [self._in_flight.pop(path) for path in sorted(done)]
+            return (results, len(self._in_flight))
+
+    def route(self, filename, mtime):
+        table = self._tables.get(peek_data_id(filename))
+        return (table, mtime + self.slos.get(table, NO_SLO))
+
+    def done(self, table, mtime):
+        lag = time.time() - mtime
+        with self._lock:
+            (files, max_lag, missed) = self._lags.get(table, (0, 0.0, 0))
+            missed += 1 if lag > self.slos.get(table, NO_SLO) else 0
+            self._lags[table] = (files + 1, max(max_lag, lag), missed)
+
+    def report(self):
+        """Return and reset [(table, files, max lag, SLO, files late)]."""
+        with self._lock:
+            lags = self._lags
+            self._lags = {}
+        return [(table, files, max_lag, self.slos.get(table), missed)
+                for (table, (files, max_lag, missed)) in sorted(lags.items())]
@@ -0,0 +1,326 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Schema registry of the MONROE keyspace, compiled from db_schema.cql.
+
+For every table the registry holds the columns (lower case, with their CQL
+type, and their names as written, e.g. SequenceNumber, the keys of the JSON
+entries), the partition and clustering key columns, the time column and the
+DataId the importer maps to it (the table name with '_' replaced by '.',
+lower case). Day-bucketed variants (<table>_daily, with the Day column in the
+partition key) are linked to their table: 'bucketed_table' in the table and
+'bucket_of' in the variant, which is not fed directly by any DataId. Nor
+are the rollup tables ('derived', written by monroerollup.py).
+
+The registry is stored as JSON (monroe_schema.json, next to this module)
+together with the path (relative to the registry) and the SHA-1 of the .cql
+it was compiled from. It is compiled and written only explicitly, with:
+
+    python monroeschema.py [../db_schema.cql] [-o monroe_schema.json]
+
+When loaded, a registry whose .cql changed since is recompiled in memory
+(the file is not written); a registry without its .cql is used as is.
+
+Used by monroe_dbimporter (to prepare the insert of a DataId the first time
+it is seen, without reading the cluster metadata), monroevalidator (to
+reject unknown DataIds) and the example exporters/loaders.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CQL = os.path.join(MODULE_DIR, os.pardir, 'db_schema.cql')
+DEFAULT_REGISTRY = os.path.join(MODULE_DIR, 'monroe_schema.json')
+REGISTRY_VERSION = 3
+BUCKET_SUFFIX = '_daily'
+# Tables written by the importer itself (monroerollup.py), not by DataIds
+DERIVED_PREFIX = 'monroe_rollup_'
+BUCKET_COLUMN = 'day'
+BUCKET_SECONDS = 24 * 3600
+TIME_COLUMN = 'timestamp'
+TIME_TYPES = ('decimal', 'timestamp', 'double')
+
+_COMMENTS = re.compile(r'/\*.*?\*/|//[^\n]*', re.DOTALL)
+_CREATE_TABLE = re.compile(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?'
+                           r'(?:\w+\.)?(\w+)\s*\(', re.IGNORECASE)
+_PRIMARY_KEY = re.compile(r'^PRIMARY\s+KEY\s*\((.*)\)$',
+                          re.IGNORECASE | re.DOTALL)
+
+
+def table_data_id(table):
+    """DataId (lower case) of the entries inserted into table."""
+    return table.replace('_', '.')
+
+
+def _split_top_level(text):
+    """Split text on the commas outside () and <>."""
+    parts = []
+    depth = 0
+    current = ''
+    for char in text:
+        if char in '(<':
+            depth += 1
+        elif char in ')>':
+            depth -= 1
+        if char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+        else:
+            current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def _table_body(cql, start):
+    """Return the text between the parenthesis opening at start - 1 and its match."""
+    depth = 1
+    for end in range(start, len(cql)):
+        if cql[end] == '(':
+            depth += 1
+        elif cql[end] == ')':
+            depth -= 1
+            if depth == 0:
+                return cql[start:end]
+    raise ValueError("Unbalanced parenthesis in CREATE TABLE")
+
+
+def _parse_table(name, body):
+    columns = []
+    names = {}
+    partition_key = []
+    clustering_key = []
+    for definition in _split_top_level(body):
+        key = _PRIMARY_KEY.match(definition)
+        if key is not None:
+            parts = _split_top_level(key.group(1))
+            if parts[0].startswith('('):
+                partition_key = [c.strip().lower()
+                                 for c in parts[0].strip('()').split(',')]
+            else:
+                partition_key = [parts[0].lower()]
+            clustering_key = [c.lower() for c in parts[1:]]
+            continue
+        (column, cql_type) = definition.split(None, 1)
+        columns.append([column.lower(),
+                        re.sub(r'\s+', '', cql_type).lower()])
+        names[column.lower()] = column
+
+    # Timestamp, else the first clustering column if it holds a time (tstat)
+    types = dict(columns)
+    if TIME_COLUMN in types:
+        time_column = TIME_COLUMN
+    elif clustering_key and types.get(clustering_key[0]) in TIME_TYPES:
+        time_column = clustering_key[0]
+    else:
+        time_column = None
+    return {'columns': columns,
+            'names': names,
+            'partition_key': partition_key,
+            'clustering_key': clustering_key,
+            'time_column': time_column,
+            'data_id': table_data_id(name),
+            'counter': any(t == 'counter' for (c, t) in columns),
+            'derived': name.startswith(DERIVED_PREFIX),
+            'bucketed_table': None,
+            'bucket_of': None}
+
+
+def compile_cql(cql):
+    """Return the registry (dict) of the tables created in a .cql text."""
+    cql = _COMMENTS.sub('', cql)
+    tables = {}
+    for match in _CREATE_TABLE.finditer(cql):
+        name = match.group(1).lower()
+        tables[name] = _parse_table(name, _table_body(cql, match.end()))
+    for (name, table) in tables.items():
+        base = name[:-len(BUCKET_SUFFIX)]
+        if (name.endswith(BUCKET_SUFFIX) and base in tables and
+                BUCKET_COLUMN in table['partition_key']):
+            table['bucket_of'] = base
+            tables[base]['bucketed_table'] = name
+    return {'version': REGISTRY_VERSION,
+            'source_sha1': hashlib.sha1(cql).hexdigest(),
+            'tables': tables}
+
+
+def _source_sha1(cql_path):
+    with open(cql_path, 'r') as f:
+        return hashlib.sha1(_COMMENTS.sub('', f.read())).hexdigest()
+
+
+def write_registry(registry, path=DEFAULT_REGISTRY):
+    """Write the registry atomically (rename of a temporary file)."""
+    (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                      suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(registry, f, indent=1, sort_keys=True)
+    os.chmod(tmp_path, 0o644)
+    os.rename(tmp_path, path)
+
+
+def compile_file(cql_path, path=DEFAULT_REGISTRY):
+    """Return the registry of cql_path, to be stored in path."""
+    with open(cql_path, 'r') as f:
+        registry = compile_cql(f.read())
+    registry['source'] = os.path.relpath(
+        os.path.abspath(cql_path), os.path.dirname(os.path.abspath(path)))
+    return registry
+
+
+def load_registry(path=DEFAULT_REGISTRY):
+    """
+    Return the registry stored in path, recompiled (in memory) if the .cql
+    it was compiled from still exists and changed since.
+    """
+    try:
+        with open(path, 'r') as f:
+            registry = json.load(f)
+    except (IOError, ValueError) as error:
+        raise IOError("No schema registry in {} ({}), compile it with "
+                      "monroeschema.py".format(path, error))
+    if registry.get('version') != REGISTRY_VERSION:
+        raise IOError("Schema registry {} is of version {}, not {}: compile "
+                      "it again with monroeschema.py".format(
+                          path, registry.get('version'), REGISTRY_VERSION))
+
+    if registry.get('source'):
+        cql_path = os.path.join(os.path.dirname(os.path.abspath(path)),
+                                registry['source'])
+        if (os.path.exists(cql_path) and
+                registry['source_sha1'] != _source_sha1(cql_path)):
+            registry = compile_file(cql_path, path)
+    return registry
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """The registry of the default paths, loaded once per process."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = load_registry()
+        return _registry
+
+
+def set_registry(registry):
+    """Make registry (e.g. loaded from another path) the one of get_registry."""
+    global _registry
+    with _registry_lock:
+        _registry = registry
+
+
+def tables_by_data_id(registry):
+    """Return {DataId (lower case): table} of the tables fed by the importer."""
+    return dict((t['data_id'], name)
+                for (name, t) in registry['tables'].items()
+                if not t['counter'] and not t['derived'] and
+                t['bucket_of'] is None)
+
+
+def bucket(timestamp):
+    """Day bucket (days since 1970-01-01 UTC) of a Unix timestamp."""
+    return int(float(timestamp)) // BUCKET_SECONDS
+
+
+def column_types(registry, table):
+    """Return {column: CQL type} of a table."""
+    return dict(registry['tables'][table]['columns'])
+
+
+def column_names(registry, table):
+    """Return {column: name as written in the schema} of a table."""
+    return registry['tables'][table]['names']
+
+
+class PreparedInserts(object):
+    """
+    INSERT ... JSON statements by DataId, prepared the first time they are used.
+
+    columns() and bucketed_columns() return the inserts of the values of
+    given columns instead (for the CSV/TSV files, see monroetabular.py).
+
+    Thread safe; raises KeyError for DataIds without a table.
+    """
+
+    def __init__(self, session, registry):
+        self._session = session
+        self._tables = tables_by_data_id(registry)
+        self._bucketed = dict(
+            (data_id, registry['tables'][table]['bucketed_table'])
+            for (data_id, table) in self._tables.items())
+        self._statements = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, data_id):
+        return data_id in self._tables
+
+    def _prepare(self, table, columns=None):
+        key = (table, columns)
+        statement = self._statements.get(key)
+        if statement is None:
+            with self._lock:
+                statement = self._statements.get(key)
+                if statement is None:
+                    if columns is None:
+                        query = 'INSERT INTO {} JSON ?'.format(table)
+                    else:
+                        query = 'INSERT INTO {} ({}) VALUES ({})'.format(
+                            table,
+                            ', '.join(columns),
+                            ', '.join(['?'] * len(columns)))
+                    statement = self._session.prepare(query)
+                    self._statements[key] = statement
+        return statement
+
+    def __getitem__(self, data_id):
+        return self._prepare(self._tables[data_id])
+
+    def bucketed(self, data_id):
+        """The insert into the day-bucketed variant of data_id, or None."""
+        table = self._bucketed.get(data_id)
+        return self._prepare(table) if table is not None else None
+
+    def columns(self, data_id, columns):
+        """The insert of the values of columns (a tuple) into data_id."""
+        return self._prepare(self._tables[data_id], columns)
+
+    def bucketed_columns(self, data_id, columns):
+        """
+        The insert of the values of columns and the day bucket into the
+        day-bucketed variant of data_id, or None.
+        """
+        table = self._bucketed.get(data_id)
+        if table is None:
+            return None
+        return self._prepare(table, columns + (BUCKET_COLUMN,))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Compile db_schema.cql into the schema registry")
+    parser.add_argument('cql',
+                        nargs='?',
+                        default=DEFAULT_CQL,
+                        help="Schema (default ../db_schema.cql)")
+    parser.add_argument('-o', '--output',
+                        default=DEFAULT_REGISTRY,
+                        help="Registry (default monroe_schema.json)")
+    args = parser.parse_args()
+    registry = compile_file(args.cql, args.output)
+    write_registry(registry, args.output)
+    print("Compiled {} tables from {} into {}".format(len(registry['tables']),
+                                                       args.cql,
+                                                       args.output))
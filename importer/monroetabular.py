@@ -0,0 +1,360 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# License: GNU General Public License v3
+# Developed for use by the EU H2020 MONROE project
+
+"""
+Used by monroe_dbimporter to import CSV/TSV files (.csv, .tsv, optionally .xz).
+
+Tabular tool output, e.g. the tstat logs, does not need to be wrapped into
+one JSON object per row: the first line of the file names the columns and
+every following line is a row. Columns are separated by tabs, commas or (as
+in the tstat logs) spaces, whichever the header contains first. Header names
+may be written as in tstat (#c_ip:1 s_ip:15 ...); the '#' and ':<number>'
+are dropped, and the entries are keyed by the names of the schema (e.g. a
+dataid or timestamp header gives DataId and Timestamp, as in JSON entries).
+The table comes from the DataId column, the DataId of the first row (as for
+JSON entries, see monroeschema.py), and rows with another DataId fail.
+Files without a DataId column, e.g. the tstat logs, need a table mapped to
+their name (TABLE_PATTERNS, the --table option of monroe_dbimporter): their
+rows get the DataId of that table. The named groups of the pattern supply
+columns the file does not have, e.g. NodeId and Iccid, which tstat does not
+write: (?P<NodeId>\d+)_(?P<Iccid>\d+)_log_tcp_complete.*. A file without all
+the partition key columns of its table fails as a whole. The columns added
+to the rows are also written to the part files, which therefore do not need
+the mapping. Empty fields are null. GPS rows with an Nmea
+column get the NmeaType and FixQuality columns, as JSON entries do (see
+monroenmea.py).
+
+The rows are read in chunks and converted to the types of their columns
+(from the schema registry) column by column: every column is
+converted with the converter of its type, without building a dict per row
+or encoding JSON, and rows are inserted with a prepared
+INSERT INTO table (columns) VALUES (?, ...). If a chunk has an invalid
+value, its rows are converted one by one and the invalid ones fail.
+"""
+import csv
+import itertools
+import json
+import os
+import re
+from decimal import Decimal
+
+import monroenmea
+import monroeschema
+
+DATA_ID = 'dataid'
+EXTENSIONS = ('.csv', '.tsv')
+BATCH_ROWS = 5000
+DELIMITERS = ('\t', ',', ' ')
+INTEGER_TYPES = ('int', 'bigint', 'smallint', 'tinyint', 'varint')
+FLOAT_TYPES = ('double', 'float')
+TEXT_TYPES = ('text', 'varchar', 'ascii')
+TRUE_VALUES = ('true', '1')
+NMEA = 'nmea'
+# Added to GPS rows, in the order of monroenmea.classify
+NMEA_NAMES = ('NmeaType', 'FixQuality')
+# [(file name regular expression, table)] mapping files to their table
+TABLE_PATTERNS = []
+
+
+def is_tabular(filename):
+    """True if filename is a CSV/TSV file (optionally .xz compressed)."""
+    if filename.endswith('.xz'):
+        filename = filename[:-len('.xz')]
+    return filename.endswith(EXTENSIONS)
+
+
+def _strip(line, delimiter):
+    # Space separated lines may end with spaces
+    return line.rstrip('\r\n ' if delimiter == ' ' else '\r\n')
+
+
+def parse_header(line):
+    """Return (delimiter, column names as written) of a header line."""
+    line = line.strip('\r\n ')
+    delimiter = next((d for d in DELIMITERS if d in line), ',')
+    names = []
+    for name in line.split(delimiter):
+        name = name.strip().lstrip('#')
+        (base, separator, position) = name.rpartition(':')
+        if separator and position.isdigit():
+            name = base
+        names.append(name.strip())
+    return (delimiter, names)
+
+
+def parse_table_patterns(specs, registry):
+    """
+    Return [(pattern, table)] of PATTERN=TABLE specs (TABLE_PATTERNS), the
+    patterns compiled to match whole file names.
+    """
+    patterns = []
+    tables = monroeschema.tables_by_data_id(registry).values()
+    for spec in specs or []:
+        (pattern, separator, table) = spec.rpartition('=')
+        table = table.strip().lower()
+        if (not separator or not pattern or table not in tables or
+                DATA_ID not in monroeschema.column_names(registry, table)):
+            raise ValueError("{} is not PATTERN=TABLE with a table of a "
+                             "DataId".format(spec))
+        try:
+            compiled = re.compile(r'(?:{})\Z'.format(pattern))
+        except re.error as error:
+            raise ValueError("Invalid pattern in {}: {}".format(spec, error))
+        names = monroeschema.column_names(registry, table)
+        for group in compiled.groupindex:
+            if group.lower() not in names:
+                raise ValueError("Group {} of {} is not a column of "
+                                 "{}".format(group, spec, table))
+        patterns.append((compiled, table))
+    return patterns
+
+
+def table_of(filename):
+    """
+    Return (table, {column: text} of the named groups) of the first pattern
+    of TABLE_PATTERNS matching filename, or (None, {}).
+    """
+    name = os.path.basename(filename)
+    for (pattern, table) in TABLE_PATTERNS:
+        match = pattern.match(name)
+        if match:
+            values = dict((group.lower(), text) for (group, text)
+                          in match.groupdict().items() if text is not None)
+            return (table, values)
+    return (None, {})
+
+
+def peek_data_id(lines, table=None):
+    """
+    Return the DataId (lower case) of the first row of [header, row], or the
+    one of table if the file has no DataId column.
+    """
+    (delimiter, names) = parse_header(lines[0])
+    lower = [name.lower() for name in names]
+    if DATA_ID not in lower and table is not None:
+        return monroeschema.get_registry()['tables'][table]['data_id']
+    row = next(csv.reader([_strip(lines[1], delimiter)], delimiter=delimiter))
+    return row[lower.index(DATA_ID)].strip().lower()
+
+
+def _text(text):
+    return text.decode('utf-8')
+
+
+def _boolean(text):
+    return text.strip().lower() in TRUE_VALUES
+
+
+def _converter(cql_type):
+    """Return the function converting a field to a value of cql_type."""
+    if cql_type in INTEGER_TYPES:
+        convert = int
+    elif cql_type == 'decimal':
+        convert = Decimal
+    elif cql_type in FLOAT_TYPES:
+        convert = float
+    elif cql_type == 'boolean':
+        convert = _boolean
+    elif cql_type in TEXT_TYPES:
+        convert = _text
+    elif cql_type.startswith(('list<', 'set<', 'map<')):
+        convert = json.loads
+    else:
+        raise ValueError("Unsupported column type {}".format(cql_type))
+    return lambda text: convert(text) if text != '' else None
+
+
+class TabularFile(object):
+    """
+    A CSV/TSV file of one table (see module doc), read by chunks().
+
+    header holds the column names as written, columns the ones of the
+    table and names the ones of the schema (the keys of the entries). The
+    table is known once the first row is read (None for files without
+    rows): from the DataId column or, without one, the table argument
+    (see table_of()). The columns missing from the file, its DataId and
+    the values argument ({column: text}), are added to every row:
+    extra_columns, extra_names, extra_texts and their converted
+    extra_values. nmea is the position of the Nmea column if the rows are
+    annotated (see module doc).
+    """
+
+    def __init__(self, lines, registry, table=None, values=None):
+        lines = iter(lines)
+        try:
+            header = next(lines)
+        except StopIteration:
+            raise ValueError("No header line")
+        (self.delimiter, self.header) = parse_header(header)
+        self.names = list(self.header)
+        self.columns = [name.lower() for name in self.header]
+        if DATA_ID not in self.columns and table is None:
+            raise ValueError("No DataId column and no table mapped to "
+                             "the file")
+        self._reader = csv.reader((_strip(line, self.delimiter)
+                                   for line in lines if line.strip()),
+                                  delimiter=self.delimiter)
+        self._first = next(self._reader, None)
+        self.data_id = None
+        self.table = None
+        self.nmea = None
+        self.extra_columns = []
+        self.extra_names = []
+        self.extra_texts = []
+        self.extra_values = ()
+        if self._first is not None:
+            if DATA_ID in self.columns:
+                index = self.columns.index(DATA_ID)
+                self.data_id = self._first[index].lower()
+                tables = monroeschema.tables_by_data_id(registry)
+                if self.data_id not in tables:
+                    raise ValueError("Unknown DataId {}".format(
+                        self.data_id))
+                self.table = tables[self.data_id]
+            else:
+                self.table = table
+                self.data_id = registry['tables'][table]['data_id']
+            types = monroeschema.column_types(registry, self.table)
+            for column in self.columns:
+                if column not in types:
+                    raise ValueError("Column {} is not in table {}".format(
+                        column, self.table))
+            names = monroeschema.column_names(registry, self.table)
+            self.names = [names[column] for column in self.columns]
+            self.converters = [_converter(types[column])
+                               for column in self.columns]
+            self._add_columns(registry, values or {}, types, names)
+            nmea_columns = [name.lower() for name in NMEA_NAMES]
+            if (self.data_id == monroenmea.DATA_ID.lower() and
+                    NMEA in self.columns and
+                    not set(nmea_columns) & set(self.columns)):
+                self.nmea = self.columns.index(NMEA)
+
+    def _add_columns(self, registry, values, types, names):
+        """Add the columns missing from the file (see class doc)."""
+        extra = []
+        if DATA_ID not in self.columns:
+            extra.append((DATA_ID, self.data_id.upper()))
+        for column in sorted(values):
+            if column not in self.columns and column in types:
+                extra.append((column, values[column]))
+        for (column, text) in extra:
+            self.extra_columns.append(column)
+            self.extra_names.append(names[column])
+            self.extra_texts.append(text)
+        try:
+            self.extra_values = tuple(_converter(types[column])(text)
+                                      for (column, text) in extra)
+        except Exception as error:
+            raise ValueError("Invalid value in the file name: {}".format(
+                error))
+        for column in registry['tables'][self.table]['partition_key']:
+            if column not in self.columns + self.extra_columns:
+                raise ValueError("No {} column (partition key of {})".format(
+                    names[column], self.table))
+
+    def chunks(self, size=BATCH_ROWS):
+        """Yield the rows as TabularChunks of up to size rows."""
+        if self._first is None:
+            return
+        rows = itertools.chain([self._first], self._reader)
+        while True:
+            batch = list(itertools.islice(rows, size))
+            if not batch:
+                break
+            yield TabularChunk(self, batch)
+
+    def writer(self, f):
+        """
+        A csv writer of rows (as read, with the extra columns) to f, after
+        writing the header.
+        """
+        writer = csv.writer(f, delimiter=self.delimiter, lineterminator='\n')
+        writer.writerow(self.header + self.extra_names)
+        return writer
+
+
+class TabularChunk(object):
+    """
+    Rows of a TabularFile converted column by column.
+
+    rows holds the fields of every row as read and values their converted
+    values, or None for the rows in errors ({row number: error}). columns
+    and names are the ones of the file, plus its extra columns and
+    NMEA_NAMES for annotated GPS rows.
+    """
+
+    def __init__(self, tabular, rows):
+        self.tabular = tabular
+        self.data_id = tabular.data_id
+        self.columns = tuple(tabular.columns)
+        self.names = tuple(tabular.names)
+        self.rows = rows
+        self.errors = {}
+        self.values = self._convert(rows)
+        if tabular.extra_columns:
+            self.columns += tuple(tabular.extra_columns)
+            self.names += tuple(tabular.extra_names)
+            self.values = [values + tabular.extra_values
+                           if values is not None else None
+                           for values in self.values]
+        if tabular.nmea is not None:
+            self.columns += tuple(name.lower() for name in NMEA_NAMES)
+            self.names += NMEA_NAMES
+            self.values = [values + monroenmea.classify(values[tabular.nmea])
+                           if values is not None else None
+                           for values in self.values]
+
+    def _convert(self, batch):
+        """Return the values of the rows of a batch, column by column."""
+        tabular = self.tabular
+        width = len(tabular.columns)
+        data_id = (tabular.columns.index(DATA_ID)
+                   if DATA_ID in tabular.columns else None)
+        if all(len(fields) == width and
+               (data_id is None or fields[data_id].lower() == self.data_id)
+               for fields in batch):
+            try:
+                values = [map(convert, column)
+                          for (convert, column) in zip(tabular.converters,
+                                                       zip(*batch))]
+                return zip(*values)
+            except Exception:
+                pass  # Find the invalid rows one by one
+        values = []
+        for (nr, fields) in enumerate(batch):
+            try:
+                if len(fields) != width:
+                    raise ValueError("{} fields, expected {}".format(
+                        len(fields), width))
+                if (data_id is not None and
+                        fields[data_id].lower() != self.data_id):
+                    raise ValueError("DataId {} in a file of {}".format(
+                        fields[data_id], self.data_id))
+                values.append(tuple(convert(text) for (convert, text)
+                                    in zip(tabular.converters, fields)))
+            except Exception as error:
+                self.errors[nr] = "Conversion error : {}".format(error)
+                values.append(None)
+        return values
+
+    def __len__(self):
+        return len(self.rows)
+
+    def entry(self, nr):
+        """Row nr as a dict of its values by column name."""
+        if self.values[nr] is None:
+            raise ValueError(self.errors[nr])
+        return dict(zip(self.names, self.values[nr]))
+
+    def text_row(self, nr):
+        """The fields of row nr as read, with the extra columns."""
+        return list(self.rows[nr]) + self.tabular.extra_texts
+
+    def text_entry(self, nr):
+        """Row nr as a dict of its fields (as read) by column name."""
+        return dict(zip(self.tabular.names + self.tabular.extra_names,
+                        self.text_row(nr)))
@@ -22,9 +22,12 @@ of a Db "primary keys" or for extra keys not in the db
 It is ok to check for keys that are not enforced by the db if so desired but
 it is the dbs responsibility to ensure that necessary keys exist in the table
 and that the table exist).
+The one exception is the DataId: entries whose DataId has no table in the
+schema registry (see monroeschema.py) are rejected here.
 """
 from datetime import datetime, timedelta
 import syslog
+import monroeschema
 from monroe_dbimporter import log_msg
 
 # User defined checks should not be called directly
@@ -42,6 +45,23 @@ def _ts_sanity_check(ts):
             return True
 
 
+_known_data_ids = None
+
+
+def _is_known_data_id(dataid):
+    """True if the registry has a table for dataid (or there is no registry)."""
+    global _known_data_ids
+    if _known_data_ids is None:
+        try:
+            registry = monroeschema.get_registry()
+            _known_data_ids = set(monroeschema.tables_by_data_id(registry))
+        except IOError as error:
+            log_msg("No schema registry ({}), accepting all DataIds"
+                    "".format(error), syslog.LOG_WARNING, 0)
+            _known_data_ids = False
+    return _known_data_ids is False or dataid.lower() in _known_data_ids
+
+
 def _default_accept(entry, VERBOSITY):
     log_str = ("No validity test for DataId : {} "
                "-> silently pass").format(entry.get('DataId'))
@@ -81,7 +101,10 @@ def check(entry, VERBOSITY):
         return (False, result)
 
     dataid = entry.get('DataId')
-    if dataid is not None:
+    if dataid is not None and not _is_known_data_id(dataid):
+        result = ("Input validation failed:"
+                  " unknown DataId {}").format(dataid)
+    elif dataid is not None:
         result = checks.get(dataid, _default_accept)(entry, VERBOSITY)
     else:
         result = "Input validation failed due to missing DataId"